@@ -0,0 +1,123 @@
+import threading
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+
+
+# in-memory cache for live availability, keyed by book id.
+# entries younger than ttl are served as-is. entries older than ttl but younger than
+# max_stale are served immediately while a background worker re-scrapes them
+# (stale-while-revalidate). anything older than that is treated as a miss.
+# with harvest=True, fetch(book_id) returns {bib_id: value} for every bib on the scraped page
+# (a record page carries availability for all of a title's formats), and all of them are cached.
+# concurrent misses for the same book share one scrape: the first request fetches, the rest
+# wait on its future.
+class AvailabilityCache:
+
+	def __init__(self, fetch, ttl=300, max_stale=3600, max_entries=10000, workers=2, harvest=False):
+		self.fetch = fetch
+		self.harvest = harvest
+		self.ttl = ttl
+		self.max_stale = max_stale
+		self.max_entries = max_entries
+		self._entries = OrderedDict() # book_id -> (fetched_at, value)
+		self._refreshing = set()
+		self._inflight = dict() # book_id -> Future of the scrape a miss is waiting on
+		self._lock = threading.Lock()
+		self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='availability')
+		self.counters = {'hits': 0, 'misses': 0, 'stale': 0, 'refreshes': 0, 'refresh_errors': 0, 'evictions': 0, 'harvested': 0, 'coalesced': 0}
+
+	def _count(self, key):
+		# callers must hold self._lock
+		self.counters[key] += 1
+
+	def _store(self, book_id, value):
+		with self._lock:
+			self._entries[book_id] = (time.monotonic(), value)
+			self._entries.move_to_end(book_id)
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+				self._count('evictions')
+
+	def _fetch_and_store(self, book_id):
+		if not self.harvest:
+			value = self.fetch(book_id)
+			self._store(book_id, value)
+			return value
+		values = self.fetch(book_id)
+		for bib_id, value in values.items():
+			if bib_id != book_id:
+				self._store(bib_id, value)
+				with self._lock:
+					self._count('harvested')
+		# stored last so the requested book is the most recently used entry
+		self._store(book_id, values[book_id])
+		return values[book_id]
+
+	def _refresh(self, book_id):
+		try:
+			self._fetch_and_store(book_id)
+			with self._lock:
+				self._count('refreshes')
+		except Exception as err:
+			logging.warning("Unexpected {}, {} refreshing availability of book {}".format(err, type(err), book_id))
+			with self._lock:
+				self._count('refresh_errors')
+		finally:
+			with self._lock:
+				self._refreshing.discard(book_id)
+
+	def _schedule_refresh(self, book_id):
+		# callers must hold self._lock
+		if book_id in self._refreshing:
+			return
+		self._refreshing.add(book_id)
+		self._executor.submit(self._refresh, book_id)
+
+	def get(self, book_id):
+		now = time.monotonic()
+		with self._lock:
+			entry = self._entries.get(book_id)
+			if entry is not None:
+				age = now - entry[0]
+				if age < self.ttl:
+					self._count('hits')
+					self._entries.move_to_end(book_id)
+					return entry[1]
+				if age < self.max_stale:
+					self._count('stale')
+					self._schedule_refresh(book_id)
+					return entry[1]
+			self._count('misses')
+			future = self._inflight.get(book_id)
+			if future is not None:
+				# another request is already scraping this book
+				self._count('coalesced')
+				leader = False
+			else:
+				future = self._inflight[book_id] = Future()
+				leader = True
+		# nothing usable cached, so this request has to wait for the scrape
+		if not leader:
+			return future.result()
+		try:
+			value = self._fetch_and_store(book_id)
+			future.set_result(value)
+			return value
+		except Exception as err:
+			future.set_exception(err)
+			raise
+		finally:
+			with self._lock:
+				self._inflight.pop(book_id, None)
+
+	def stats(self):
+		with self._lock:
+			stats = dict(self.counters)
+			stats['size'] = len(self._entries)
+			stats['refreshing'] = len(self._refreshing)
+			stats['inflight'] = len(self._inflight)
+		stats['ttl'] = self.ttl
+		stats['max_stale'] = self.max_stale
+		return stats
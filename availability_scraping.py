@@ -1,61 +1,61 @@
 import pandas as pd
 import json
-from bs4 import BeautifulSoup
 import requests
 import random
-from retry import retry
 from datetime import datetime
 import logging
+from page_json import extract_iso_json
+from fetch_engine import scraper_fetcher, Throughput, default_fetcher, record_url
+from chunk_writer import ChunkWriter
 
 
 
 
 
-@retry(exceptions=Exception, tries=5, delay=2, 
-       max_delay=None, backoff=1, jitter=(1,10), logger=logging.getLogger(__name__))
-def scrape_book_page(book_id):
-    # try:
-    page_url = 'https://seattle.bibliocommons.com/v2/record/{}'.format(book_id)
-    resp = requests.get(page_url)
-    soup = BeautifulSoup(resp.content, "html.parser")
-    book_info_json = soup.find('script', attrs={'type':'application/json',
-                                           'data-iso-key':'_0'
-                                      })
-    book_info = json.loads(book_info_json.text)
-    availability = [book_info['entities']['bibs'][k]['availability'] for k in book_info['entities']['bibs'].keys()]
-    availability_df = pd.json_normalize(availability)
-
-
-    # book_row = c_bibs[relevant_fields]
+def scrape_book_page(book_id, fetcher=None):
+    # availability of every bib on the record page, one row each. id is the bib the row describes,
+    # sourceId the record that was fetched.
+    fetcher = fetcher or default_fetcher()
+    page_url = record_url(book_id)
+    resp = fetcher.get(page_url)
+    resp.raise_for_status()
+    book_info = extract_iso_json(resp.content)
+    bibs = book_info['entities']['bibs']
+    bib_ids = [k for k in bibs.keys() if 'availability' in bibs[k]]
+    availability_df = pd.json_normalize([bibs[k]['availability'] for k in bib_ids])
+    availability_df['id'] = bib_ids
+    availability_df['sourceId'] = book_id
     return availability_df
-    # except Exception as err:
-    #     print("Unexpected {}, {} on book {}".format(err, type(err), book_id))
-    #     return (None, None)
     
-def scrape_pages(book_ids, first, last):
-    availability_list = list()
+def scrape_pages(book_ids, first, last, concurrency=1, rate=5.0, cache_dir=None, replay=False, rows_per_chunk=5000):
+    # each page covers all of a title's formats, so ids already seen on an earlier page are
+    # skipped. fetcher.map pulls ids lazily, so the check happens right before each fetch.
+    # rows stream into part files under ./pickles/availability_{first}_{last}/
     id_list = book_ids['id_num']
     
     if last <= 0:
         last = len(book_ids)
     
-    for i, book_id in enumerate(id_list[first:last], first):
-        # print progress
-        if i%100 == 0:
-            logging.info('\tscraping availability of book {}: {}'.format(i, book_id))
-        try:
-            avail = scrape_book_page(book_id)
-            availability_list.append(avail)
-        except Exception as err:
-            logging.warning("Unexpected {}, {} on book {}".format(err, type(err), book_id))
-
-    if availability_list:
-        availability = pd.concat(availability_list, ignore_index = True)
-        availability.to_pickle("./pickles/availability_{}_{}.pkl".format(first, last))
-        
-
-
-    
-    
-    
-    
\ No newline at end of file
+    seen = set()
+    skipped = [0]
+    def unseen(ids):
+        for book_id in ids:
+            if book_id in seen:
+                skipped[0] += 1
+                continue
+            yield book_id
+
+    fetcher = scraper_fetcher(concurrency, rate, cache_dir, replay)
+    progress = Throughput()
+    with ChunkWriter("./pickles/availability_{}_{}".format(first, last), rows_per_chunk, overwrite=True) as out:
+        for book_id, avail, err in fetcher.map(lambda b: scrape_book_page(b, fetcher), unseen(id_list[first:last])):
+            if err is not None:
+                logging.warning("Unexpected {}, {} on book {}".format(err, type(err), book_id))
+                progress.tick(ok=False)
+                continue
+            new_rows = ~avail['id'].isin(seen)
+            seen.update(avail['id'])
+            out.append(avail[new_rows])
+            progress.tick()
+    logging.info('scraped availability of books {} through {}: {}, {} ids skipped as already harvested'.format(
+        first, last, progress.summary(), skipped[0]))
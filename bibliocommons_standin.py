@@ -0,0 +1,257 @@
+import re
+import json
+import time
+import random
+import hashlib
+import logging
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+
+# a local stand-in for seattle.bibliocommons.com, for load testing and benchmarking the scrapers
+# without touching the real site. serves /v2/record/<id> and /v2/search?page=N with the same
+# <script type="application/json" data-iso-key="_0"> payload the scrapers parse: recorded pages
+# from a page_cache directory when there is one, otherwise generated ones. latency, 5xx errors
+# and 429s (with Retry-After) can be injected. point the scrapers at it with
+# BIBLIOCOMMONS_URL=http://127.0.0.1:8765
+#
+# /_stats returns counts of what was served, /_ids the record ids and search pages it knows.
+
+results_per_page = 25
+
+def synthetic_id(n):
+	return 'S30C{:07d}'.format(n)
+
+def _field(category, values_by_name):
+	return {'category': category, 'items': [
+		{'fieldName': name, 'fieldValues': [{'primary': {'values': values}, 'secondary': None}]}
+		for name, values in values_by_name.items()]}
+
+def _brief_info(book_id, rng):
+	title = 'Book {}'.format(book_id)
+	return {
+		'id': book_id,
+		'title': title,
+		'subtitle': None,
+		'authors': ['Author {}, A.'.format(rng.randint(1, 5000))],
+		'format': rng.choice(['AB', 'BK', 'EBOOK', 'MUSIC_CD']),
+		'consumptionFormat': rng.choice(['AUDIO', 'TEXT']),
+		'contentType': rng.choice(['FICTION', 'NONFICTION']),
+		'publicationDate': str(rng.randint(1950, 2022)),
+		'primaryLanguage': 'eng',
+		'description': 'A generated description of {}.'.format(title),
+		'isbns': [str(rng.randint(10**12, 10**13 - 1))],
+		'audiences': ['ADULT'],
+		'genreForm': ['Fiction.'],
+		'compositeSubjectHeadings': ['Subject {}'.format(rng.randint(1, 300))],
+		'subjectHeadings': ['Subject {}'.format(rng.randint(1, 300))],
+		'jacket': {'small': '', 'medium': '', 'large': ''},
+		'rating': {'averageRating': rng.randint(0, 100), 'totalCount': rng.randint(0, 500)},
+		}
+
+def _availability(rng):
+	total = rng.randint(1, 40)
+	available = rng.randint(0, total)
+	return {'availableCopies': available, 'totalCopies': total,
+		'heldCopies': rng.randint(0, 200), 'onOrderCopies': rng.randint(0, 5)}
+
+def record_payload(book_id):
+	# a record page's json: the book plus a few sibling formats, all with availability
+	rng = random.Random(book_id)
+	bib_ids = [book_id] + ['{}{:03d}'.format(book_id, i) for i in range(rng.randint(0, 3))]
+	bibs = {bib_id: {'briefInfo': _brief_info(bib_id, rng), 'availability': _availability(rng)} for bib_id in bib_ids}
+	hours, minutes, seconds = rng.randint(1, 30), rng.randint(0, 59), rng.randint(0, 59)
+	catalog_bib = {
+		'id': book_id,
+		'brief': {'title': 'Book {}'.format(book_id), 'subTitle': None, 'primaryLanguage': 'eng',
+			'publicationDate': str(rng.randint(1950, 2022)), 'description': 'A generated book.',
+			'coverImage': {'small': '', 'medium': '', 'large': ''}},
+		'fields': [
+			_field('DETAILS', {
+				'CREATORS': ['Author {}, A.'.format(rng.randint(1, 5000))],
+				'PUBLICATION': ['Ashland : Blackstone Audio, {}.'.format(rng.randint(1950, 2022))],
+				'TITLE': ['Book {}'.format(book_id)],
+				'SUMMARY': ['A generated summary.'],
+				'DESCRIPTION': ['1 online resource (1 audio file ({:02d} hr., {:02d} min., {:02d} sec.))'.format(hours, minutes, seconds)],
+				}),
+			_field('CONTRIBUTORS', {
+				'CONTRIBUTOR_NAME': ['Reader {}, B.'.format(rng.randint(1, 900))],
+				'CONTRIBUTOR_PERFORMERS': ['Read by Reader {}.'.format(rng.randint(1, 900))],
+				}),
+			_field('SUBJECTGENRE', {'SUBJECT': ['Subject {}.'.format(rng.randint(1, 300))], 'GENRE': ['Fiction.']}),
+			_field('IDENTIFIERS', {'ISBN': [str(rng.randint(10**12, 10**13 - 1))]}),
+			],
+		}
+	return {'entities': {'bibs': bibs, 'catalogBibs': {book_id: catalog_bib}}}
+
+def search_payload(page_num):
+	rng = random.Random(page_num)
+	first = page_num * results_per_page
+	bibs = {synthetic_id(n): {'briefInfo': _brief_info(synthetic_id(n), rng)} for n in range(first, first + results_per_page)}
+	return {'entities': {'bibs': bibs}}
+
+def render_page(payload, padding_kb):
+	# real pages are mostly markup around the script tag, which is what the parsers have to wade through
+	filler = '<div class="cp-filler"><a href="#">filler</a></div>\n' * (padding_kb * 1024 // 52)
+	return ('<!DOCTYPE html><html><head><title>stand-in</title></head><body>\n{}'
+		'<script type="application/json" data-iso-key="_0">{}</script>\n{}</body></html>').format(
+		filler[:len(filler)//2], json.dumps(payload), filler[len(filler)//2:]).encode('utf-8')
+
+
+class StandIn:
+
+	def __init__(self, host='127.0.0.1', port=8765, pages_dir=None, latency=0.05, jitter=0.02,
+				error_rate=0.0, throttle_rate=0.0, retry_after=1.0, padding_kb=100, seed=None):
+		self.latency = latency
+		self.jitter = jitter
+		self.error_rate = error_rate
+		self.throttle_rate = throttle_rate
+		self.retry_after = retry_after
+		self.padding_kb = padding_kb
+		self.rng = random.Random(seed)
+		self.counts = dict()
+		self._lock = threading.Lock()
+		self.records, self.searches, self.cache = dict(), dict(), None
+		if pages_dir:
+			self._index_recorded(pages_dir)
+		self.server = ThreadingHTTPServer((host, port), self._handler())
+		self.server.daemon_threads = True
+		self._thread = None
+
+	@property
+	def url(self):
+		host, port = self.server.server_address[:2]
+		return 'http://{}:{}'.format(host, port)
+
+	def _index_recorded(self, pages_dir):
+		from page_cache import PageCache
+		self.cache = PageCache(pages_dir)
+		for url in self.cache.urls():
+			parts = urlsplit(url)
+			match = re.match(r'/v2/record/([^/?]+)$', parts.path)
+			if match:
+				self.records[match.group(1)] = url
+			elif parts.path == '/v2/search':
+				page = parse_qs(parts.query).get('page')
+				if page:
+					self.searches[page[0]] = url
+		logging.info('serving {} recorded record pages and {} search pages'.format(len(self.records), len(self.searches)))
+
+	def _count(self, key):
+		with self._lock:
+			self.counts[key] = self.counts.get(key, 0) + 1
+
+	def _roll(self):
+		with self._lock:
+			delay = max(0.0, self.rng.gauss(self.latency, self.jitter)) if self.latency else 0.0
+			roll = self.rng.random()
+		if roll < self.throttle_rate:
+			return delay, 429
+		if roll < self.throttle_rate + self.error_rate:
+			return delay, 503
+		return delay, 200
+
+	def page(self, path, query):
+		# (status, body) for a request path, None if it isn't one we serve
+		match = re.match(r'/v2/record/([^/?]+)$', path)
+		if match:
+			book_id = match.group(1)
+			if book_id in self.records:
+				return 200, self.cache.response(self.records[book_id]).content
+			return 200, render_page(record_payload(book_id), self.padding_kb)
+		if path == '/v2/search':
+			page = query.get('page', ['1'])[0]
+			if page in self.searches:
+				return 200, self.cache.response(self.searches[page]).content
+			try:
+				return 200, render_page(search_payload(int(page)), self.padding_kb)
+			except ValueError:
+				return 400, b'bad page'
+		return None
+
+	def _handler(self):
+		standin = self
+
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1'
+
+			def log_message(self, format, *args):
+				pass
+
+			def _send(self, status, body, content_type='text/html; charset=utf-8', headers=None):
+				self.send_response(status)
+				self.send_header('Content-Type', content_type)
+				self.send_header('Content-Length', str(len(body)))
+				for k, v in (headers or {}).items():
+					self.send_header(k, v)
+				self.end_headers()
+				self.wfile.write(body)
+				standin._count(status)
+
+			def do_GET(self):
+				parts = urlsplit(self.path)
+				if parts.path == '/_stats':
+					with standin._lock:
+						body = json.dumps({str(k): v for k, v in standin.counts.items()})
+					return self._send(200, body.encode('utf-8'), 'application/json')
+				if parts.path == '/_ids':
+					body = json.dumps({'records': sorted(standin.records), 'search_pages': sorted(standin.searches)})
+					return self._send(200, body.encode('utf-8'), 'application/json')
+				delay, status = standin._roll()
+				time.sleep(delay)
+				if status == 429:
+					return self._send(429, b'slow down', headers={'Retry-After': str(standin.retry_after)})
+				if status != 200:
+					return self._send(status, b'injected error')
+				result = standin.page(parts.path, parse_qs(parts.query))
+				if result is None:
+					return self._send(404, b'not found')
+				status, body = result
+				etag = '"{}"'.format(hashlib.sha256(body).hexdigest()[:32])
+				if self.headers.get('If-None-Match') == etag:
+					return self._send(304, b'', headers={'ETag': etag})
+				self._send(status, body, headers={'ETag': etag})
+
+		return Handler
+
+	def start(self):
+		# serve from a background thread, for use inside another script
+		self._thread = threading.Thread(target=self.server.serve_forever, name='standin', daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+
+def main():
+	parser = argparse.ArgumentParser(description="serve stand-in bibliocommons pages for scraper tests and benchmarks")
+	parser.add_argument("--host", default='127.0.0.1', help="address to listen on, default = 127.0.0.1")
+	parser.add_argument("--port", type=int, default=8765, help="port to listen on, default = 8765")
+	parser.add_argument("--pages", default=None, help="page_cache directory of recorded pages to serve")
+	parser.add_argument("--latency", type=float, default=0.05, help="mean seconds before each response, default = 0.05")
+	parser.add_argument("--jitter", type=float, default=0.02, help="standard deviation of the latency, default = 0.02")
+	parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 503, default = 0")
+	parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with a 429, default = 0")
+	parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s, default = 1")
+	parser.add_argument("--padding", type=int, default=100, help="KB of filler markup around generated json, default = 100")
+	parser.add_argument("--seed", type=int, default=None, help="seed for latency and error injection")
+	args = parser.parse_args()
+	logging.basicConfig(level=logging.INFO, format = '%(asctime)s %(message)s')
+
+	standin = StandIn(args.host, args.port, args.pages, args.latency, args.jitter, args.error_rate,
+		args.throttle_rate, args.retry_after, args.padding, args.seed)
+	logging.info('stand-in bibliocommons at {}'.format(standin.url))
+	try:
+		standin.server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		standin.server.server_close()
+
+
+if __name__ == "__main__":
+	main()
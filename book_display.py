@@ -0,0 +1,21 @@
+# small formatting helpers used by the templates. kept free of pandas/numpy so the web app
+# can import them cheaply.
+
+def parse_author(author):
+	if not author:
+		return "Author not listed"
+	parts = list(map(str.strip, author.split(',')))
+	if len(parts) == 1:
+		return parts[0]
+	else:
+		return " ".join([parts[1], parts[0]])
+
+def parse_performers(perf):
+	if not perf:
+		return ''
+	if isinstance(perf, list):
+		# text[] column (tables loaded with copy_table)
+		return ', '.join(perf)
+	perf = perf[1:-1]
+	parts = perf.split('"')
+	return ''.join(parts)
@@ -1,27 +1,26 @@
 import pandas as pd
 import json
-from bs4 import BeautifulSoup
 import requests
 import random
-from retry import retry
+import re
+import time
 from datetime import datetime
 import argparse
 import logging
 from postgres_interaction import get_db_engine, get_book_ids
+from page_json import extract_iso_json
+from fetch_engine import scraper_fetcher, Throughput, default_fetcher, record_url
+from chunk_writer import ChunkWriter
 
-@retry(exceptions=Exception, tries=2, delay=2, 
-       max_delay=None, backoff=1, jitter=(1,10))
-def get_availability(book_id):
-    # try:
-    page_url = 'https://seattle.bibliocommons.com/v2/record/{}'.format(book_id)
-    resp = requests.get(page_url)
-    soup = BeautifulSoup(resp.content, "html.parser")
-    book_info_json = soup.find('script', attrs={'type':'application/json',
-                                           'data-iso-key':'_0'
-                                      })
-    book_info = json.loads(book_info_json.text)
-    avail_dict = book_info['entities']['bibs'][book_id]['availability']
-    
+def get_book_info_json(book_id, fetcher=None):
+    # fetch a record page and pull out the embedded data-iso-key="_0" json
+    fetcher = fetcher or default_fetcher()
+    page_url = record_url(book_id)
+    resp = fetcher.get(page_url)
+    resp.raise_for_status()
+    return extract_iso_json(resp.content)
+
+def availability_dict(avail_dict):
     return_dict = dict()
     
     return_dict['available'] = avail_dict['availableCopies']
@@ -30,18 +29,21 @@ def get_availability(book_id):
     return_dict['on_order'] = avail_dict['onOrderCopies']
     return return_dict
 
+def get_all_availability(book_id, fetcher=None):
+    # a record page lists every format of the title under entities.bibs, each with its own
+    # availability, so one fetch answers for all of them: {bib_id: availability}
+    book_info = get_book_info_json(book_id, fetcher)
+    bibs = book_info['entities']['bibs']
+    return {bib_id: availability_dict(bib['availability']) for bib_id, bib in bibs.items() if 'availability' in bib}
+
+def get_availability(book_id, fetcher=None):
+    return get_all_availability(book_id, fetcher)[book_id]
+
 
-@retry(exceptions=Exception, tries=5, delay=2, 
-       max_delay=None, backoff=1, jitter=(1,10), logger=logging.getLogger(__name__))
-def scrape_book_page(book_id):
-    # try:
-    page_url = 'https://seattle.bibliocommons.com/v2/record/{}'.format(book_id)
-    resp = requests.get(page_url)
-    soup = BeautifulSoup(resp.content, "html.parser")
-    book_info_json = soup.find('script', attrs={'type':'application/json',
-                                           'data-iso-key':'_0'
-                                      })
-    book_info = json.loads(book_info_json.text)
+def scrape_book_page(book_id, fetcher=None):
+    return parse_book_page(book_id, get_book_info_json(book_id, fetcher))
+
+def parse_book_page(book_id, book_info):
     related_books = [book_info['entities']['bibs'][k]['briefInfo'] for k in book_info['entities']['bibs'].keys()]
     related_books_df = pd.json_normalize(related_books)
     related_books_df['audioId'] = book_id
@@ -53,31 +55,66 @@ def scrape_book_page(book_id):
     return (related_books_df, c_bibs)
 
     
-def scrape_pages(engine, first, last):
+def scrape_batch(fetcher, book_ids, progress, related_out, features_out, on_progress=None):
+	# scrape book_ids concurrently into two chunk_writer.ChunkWriters. returns {book_id: error} for failures
+	failures = dict()
+	for book_id, result, err in fetcher.map(lambda b: scrape_book_page(b, fetcher), book_ids):
+		if err is not None:
+			logging.warning("Unexpected {}, {} on book {}".format(err, type(err), book_id))
+			failures[book_id] = err
+			progress.tick(ok=False)
+		else:
+			rel, info = result
+			related_out.append(rel)
+			features_out.append(info)
+			progress.tick()
+		if on_progress is not None:
+			on_progress()
+	return failures
+
+def output_writers(tag, rows_per_chunk, overwrite):
+	return (ChunkWriter("./pickles/related_titles_{}".format(tag), rows_per_chunk, overwrite),
+		ChunkWriter("./pickles/features_{}".format(tag), rows_per_chunk, overwrite))
+
+def scrape_pages(engine, first, last, concurrency=1, rate=5.0, cache_dir=None, replay=False, rows_per_chunk=2000):
+	# output goes to ./pickles/features_{first}_{last}/ and ./pickles/related_titles_{first}_{last}/
+	# a part file at a time (see chunk_writer), so it can be read before the scrape is done
 	book_ids = get_book_ids(engine)
-	related_list = list()
-	features_list = list()
 	id_list = book_ids['id_num']
 	
 	if last < 0:
 		last = len(book_ids)
-    
-	for i, book_id in enumerate(id_list[first:last], first):
-		if i%100 == 0:
-			logging.info('\tscraping book {}: {}'.format(i, book_id))
-		try:
-			rel, info = scrape_book_page(book_id)
-			related_list.append(rel)
-			features_list.append(info)
-		except Exception as err:
-			logging.warning("Unexpected {}, {} on book {}".format(err, type(err), book_id))
-	if related_list:
-		related = pd.concat(related_list, ignore_index = True)
-		related.to_pickle("./pickles/related_titles_{}_{}.pkl".format(first, last))
-	if features_list:
-		features = pd.concat(features_list, ignore_index = True)
-		features.to_pickle("./pickles/features_{}_{}.pkl".format(first, last))
-        
+	
+	fetcher = scraper_fetcher(concurrency, rate, cache_dir, replay)
+	progress = Throughput()
+	related_out, features_out = output_writers("{}_{}".format(first, last), rows_per_chunk, overwrite=True)
+	with related_out, features_out:
+		scrape_batch(fetcher, id_list[first:last], progress, related_out, features_out)
+	logging.info('scraped books {} through {}: {}, {} retries'.format(first, last, progress.summary(), fetcher.stats['retries']))
+
+def work_queue(queue, batch_size=200, concurrency=1, rate=5.0, cache_dir=None, replay=False, rows_per_chunk=2000):
+	# pull batches from a scrape_queue.WorkQueue until it is empty. each worker appends to its own
+	# part directories, and a batch is marked done only once its rows have been flushed to disk.
+	fetcher = scraper_fetcher(concurrency, rate, cache_dir, replay)
+	progress = Throughput()
+	related_out, features_out = output_writers(re.sub(r'[^\w.-]', '_', queue.worker), rows_per_chunk, overwrite=False)
+	with related_out, features_out:
+		for batch in queue.batches(batch_size):
+			last_extend = [time.monotonic()]
+			def keep_lease():
+				# checkpoint the lease well before it runs out on a slow batch
+				if time.monotonic() - last_extend[0] > queue.lease_seconds / 3:
+					queue.extend(batch)
+					last_extend[0] = time.monotonic()
+			failures = scrape_batch(fetcher, batch, progress, related_out, features_out, keep_lease)
+			related_out.flush()
+			features_out.flush()
+			done = queue.complete([b for b in batch if b not in failures])
+			if failures:
+				queue.fail(failures)
+			logging.info('{} batch {} - {}: {} done, {} failed; {}'.format(queue.worker, batch[0], batch[-1], done, len(failures), progress.summary()))
+	logging.info('{} found no more work: {}, {} retries'.format(queue.worker, progress.summary(), fetcher.stats['retries']))
+
 def custom_normalize(the_list):
     the_dict = dict()
     for item in the_list:
@@ -103,6 +140,14 @@ def main():
 								help="where to start scraping")
 	parser.add_argument("end", type=int,
 								help="where to stop scraping")
+	parser.add_argument("--concurrency", "-c", type=int, default=1,
+								help="how many pages to fetch at once, default = 1")
+	parser.add_argument("--rate", "-r", type=float, default=5.0,
+								help="max requests per second across all workers, default = 5")
+	parser.add_argument("--cache", default=None,
+								help="directory to keep raw pages in, refetches become conditional requests")
+	parser.add_argument("--replay", action="store_true",
+								help="parse pages from --cache only, without touching the network")
 	args = parser.parse_args()
 	logfile = 'logs/book_page_scraping.log'
 	logging.basicConfig(filename=logfile, 
@@ -112,7 +157,7 @@ def main():
 								
 	logging.info("scraping books # {} through {}...".format(args.start, args.end))
 	engine = get_db_engine()
-	scrape_pages(engine, args.start, args.end)
+	scrape_pages(engine, args.start, args.end, args.concurrency, args.rate, args.cache, args.replay)
 	logging.info("done")
 	logging.info("-------------------")
 
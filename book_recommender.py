@@ -1,21 +1,115 @@
-from flask import Flask, render_template, request, url_for, flash, redirect
-import pandas as pd
-import sqlalchemy as db
-from sqlalchemy import text
-# from werkzeug.exceptions import abort
+from flask import Flask, render_template, request, url_for, flash, redirect, jsonify, Response, copy_current_request_context, abort
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 
-from postgres_interaction import search_books, get_book_info, get_neighbors, get_neighbors_info
-from data_cleaning import parse_author
-from book_page_scraping import get_availability
+from postgres_interaction import search_page, BadCursor, get_book_info, get_neighbors_ranked, suggest_books, get_suggest_rows, get_table_signature, get_books_info, get_neighbors_batch, max_neighbors
+from book_display import parse_author, parse_performers
+from availability_cache import AvailabilityCache
+from suggest import Suggester
+from metrics import Metrics
+from chart_registry import ChartRegistry
 
-def parse_performers(perf):
-	perf = perf[1:-1]
-	parts = perf.split('"')
-	return ''.join(parts)
+# per-route timing, split into db / scrape / render. requests slower than SLOW_REQUEST_SECONDS get logged.
+metrics = Metrics(slow_threshold=float(os.environ.get('SLOW_REQUEST_SECONDS', 1.0)))
+search_page = metrics.timed('db')(search_page)
+get_book_info = metrics.timed('db')(get_book_info)
+get_neighbors_ranked = metrics.timed('db')(get_neighbors_ranked)
+get_books_info = metrics.timed('db')(get_books_info)
+get_neighbors_batch = metrics.timed('db')(get_neighbors_batch)
+render_template = metrics.timed('render')(render_template)
+
+@metrics.timed('scrape', 'get_availability')
+def fetch_availability(book_id):
+	# book_page_scraping pulls in bs4 and pandas, so it isn't imported until the first scrape
+	from book_page_scraping import get_all_availability
+	return get_all_availability(book_id)
 
 app = Flask(__name__)
+metrics.init_app(app)
+
+# chart pages are rendered and compressed once here instead of reading static/ on every request
+charts = ChartRegistry(os.path.join(app.root_path, 'static'))
+with app.app_context():
+	charts.render_pages(lambda chart: render_template('altair.html', chart=chart))
+
+# availability is scraped live from bibliocommons, so keep it in a short-lived cache.
+# AVAILABILITY_TTL / AVAILABILITY_MAX_STALE are in seconds. every scrape also caches the
+# availability of the title's other formats.
+availability_cache = AvailabilityCache(fetch_availability,
+	ttl=int(os.environ.get('AVAILABILITY_TTL', 300)),
+	max_stale=int(os.environ.get('AVAILABILITY_MAX_STALE', 3600)),
+	workers=int(os.environ.get('AVAILABILITY_WORKERS', 2)),
+	harvest=True
+	)
+
+def availability_gauges():
+	return {('bookrec_availability_cache', (('stat', k),)): v for k, v in availability_cache.stats().items()}
+metrics.gauges.append(availability_gauges)
+
+# with ASYNC_BOOK_PAGE=1 the book page renders straight from get_book_info and the
+# browser pulls availability and neighbors from the /api/ endpoints in parallel
+async_book_page = os.environ.get('ASYNC_BOOK_PAGE', '0') not in {'0', 'false', 'False', ''}
+
+# runs the slow upstream calls (scrape + neighbor query) side by side
+upstream_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('UPSTREAM_WORKERS', 8)), thread_name_prefix='upstream')
+
+search_page_size = 10
+
+# typeahead for the search box, served from memory; rebuilt when book_features changes
+suggester = Suggester(get_suggest_rows, get_table_signature, suggest_books,
+	check_interval=int(os.environ.get('SUGGEST_CHECK_INTERVAL', 60)))
+suggester.start()
+
+# NEIGHBOR_ARTIFACT points at the file written by nearest_neighbors.do_ml. when set, neighbor
+# lookups come from the mmapped file and only the display fields come from postgres.
+neighbor_artifact = None
+if os.environ.get('NEIGHBOR_ARTIFACT'):
+	from neighbor_artifact import ArtifactHandle
+	neighbor_artifact = ArtifactHandle(os.environ['NEIGHBOR_ARTIFACT'],
+		check_interval=int(os.environ.get('NEIGHBOR_ARTIFACT_CHECK_INTERVAL', 30)))
+
+def artifact_neighbors(book_ids, num_neighbors=max_neighbors):
+	# {book_id: [neighbor row dicts in rank order]} from the artifact, with one query for the book info
+	ranked = {book_id: neighbor_artifact.lookup(book_id, num_neighbors) or [] for book_id in book_ids}
+	wanted = {n_id for nearest in ranked.values() for n_id, _ in nearest}
+	info = {row.id: row._mapping for row in get_books_info(list(wanted))} if wanted else {}
+	neighbors = dict()
+	for book_id, nearest in ranked.items():
+		neighbors[book_id] = list()
+		for rank, (n_id, distance) in enumerate(nearest, 1):
+			if n_id in info:
+				item = dict(info[n_id])
+				item['rank'] = rank
+				item['distance'] = distance
+				neighbors[book_id].append(item)
+	return neighbors
+
+def find_neighbors(book_id):
+	if neighbor_artifact is not None:
+		return artifact_neighbors([book_id])[book_id]
+	return list(get_neighbors_ranked(book_id))
+
+def neighbor_dict(row):
+	item = dict(row._mapping) if hasattr(row, '_mapping') else dict(row)
+	item['author'] = parse_author(item['author'])
+	item['performers'] = parse_performers(item['performers'])
+	return item
+
+# the batch api answers for at most MAX_BATCH_IDS books per request
+max_batch_ids = int(os.environ.get('MAX_BATCH_IDS', 100))
+
+def batch_ids():
+	# ?ids=a,b,c -> ['a', 'b', 'c'], deduplicated, order kept. aborts with 400 if over the cap.
+	ids = list(dict.fromkeys(i.strip() for i in request.args.get('ids', '').split(',') if i.strip()))
+	if not ids:
+		abort(400, 'ids is required')
+	if len(ids) > max_batch_ids:
+		abort(400, 'at most {} ids per request'.format(max_batch_ids))
+	return ids
+
+def compact_json(data):
+	return Response(json.dumps(data, separators=(',', ':')), mimetype='application/json')
 
 @app.context_processor
 def process_author():
@@ -33,29 +127,96 @@ def about():
 	 
 @app.route('/search', methods=('GET', 'POST'))
 def search():
-	if request.method == 'POST':
-		search_val = request.form['search_val']
-		search_type = request.form['search_type']
-		data = search_books(search_type, search_val)
-		return render_template('search.html', data=data)
+	# POST comes from the search form; GET with search_val comes from the next-page links
+	params = request.form if request.method == 'POST' else request.args
+	if 'search_val' in params:
+		search_val = params['search_val']
+		search_type = params.get('search_type', 'title')
+		page = params.get('page', 1, type=int)
+		try:
+			data, next_cursor = search_page(search_type, search_val, limit=search_page_size, cursor=params.get('after'))
+		except BadCursor:
+			abort(400, 'invalid cursor')
+		next_url = None
+		if next_cursor:
+			next_url = url_for('search', search_type=search_type, search_val=search_val, after=next_cursor, page=page+1)
+		return render_template('search.html', data=data, search_val=search_val, search_type=search_type,
+			next_url=next_url, first_index=(page-1)*search_page_size)
 	return render_template('search.html')
 
 @app.route('/<book_id>', methods=('GET', 'POST'))
 def book(book_id):
-	book_info = get_book_info(book_id)
-	availability = get_availability(book_id)
+	if async_book_page and request.method == 'GET':
+		book_info = get_book_info(book_id)
+		return render_template('book.html', data=book_info, async_mode=True)
+	# copy_current_request_context so the pool threads' timings count towards this request
+	availability_future = upstream_pool.submit(copy_current_request_context(availability_cache.get), book_id)
+	neighbors_future = None
 	if request.method == 'POST':
-		nearest = get_neighbors(book_id)
-		neighbors = get_neighbors_info(nearest)
+		neighbors_future = upstream_pool.submit(copy_current_request_context(find_neighbors), book_id)
+	book_info = get_book_info(book_id)
+	availability = availability_future.result()
+	if neighbors_future is not None:
+		neighbors = neighbors_future.result()
 		return render_template('book.html', data=book_info, neighbors=neighbors, availability = availability)
 	return render_template('book.html', data=book_info, availability=availability)
 
+@app.route('/api/<book_id>/availability')
+def book_availability(book_id):
+	return jsonify(availability_cache.get(book_id))
+
+@app.route('/api/<book_id>/neighbors')
+def book_neighbors(book_id):
+	neighbors = find_neighbors(book_id)
+	return jsonify([neighbor_dict(row) for row in neighbors])
+
+@app.route('/api/books')
+def books_batch():
+	ids = batch_ids()
+	books = dict()
+	for row in get_books_info(ids):
+		books[row.id] = neighbor_dict(row)
+	return compact_json(books)
+
+@app.route('/api/neighbors')
+def neighbors_batch():
+	ids = batch_ids()
+	k = max(1, min(request.args.get('k', max_neighbors, type=int), max_neighbors))
+	if neighbor_artifact is not None:
+		neighbors = {book_id: [neighbor_dict(item) for item in items] for book_id, items in artifact_neighbors(ids, k).items()}
+		return compact_json(neighbors)
+	neighbors = {book_id: [] for book_id in ids}
+	for row in get_neighbors_batch(ids, k):
+		item = neighbor_dict(row)
+		neighbors[item.pop('book_id')].append(item)
+	return compact_json(neighbors)
+
+@app.route('/api/suggest')
+def suggest():
+	prefix = request.args.get('q', '')
+	limit = max(1, min(request.args.get('limit', 10, type=int), 25))
+	if len(prefix.strip()) < 2:
+		return jsonify([])
+	return jsonify(suggester.suggest(prefix, limit))
+
+@app.route('/stats/availability')
+def availability_stats():
+	return jsonify(availability_cache.stats())
+
+@app.route('/metrics')
+def prometheus_metrics():
+	return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/stats/slow')
+def slow_requests():
+	return jsonify(metrics.slow_requests())
+
 @app.route('/chart/<chart_name>')
 def chart(chart_name):
-	filename = 'static/{chart_name}.json'.format(chart_name = chart_name)
-	f = open (filename, "r")
-	chart = f.read()
-	return render_template('altair.html', chart=chart)
+	page = charts.pages.get(chart_name)
+	if page is None:
+		abort(404)
+	return page.response()
 
 	
 	
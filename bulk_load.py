@@ -0,0 +1,205 @@
+import pandas as pd
+import io
+import time
+import logging
+from sqlalchemy import text
+
+from postgres_interaction import get_engine, neighbor_ranks_table, refresh_table
+from postgres_interaction import search_index_ddl, suggest_index_ddl, search_config
+
+
+# bulk loading through COPY, used by 'postgres_interaction write' and 'migrate_neighbors'.
+# lives apart from postgres_interaction so the web app doesn't have to import pandas.
+
+def quote_ident(name):
+	return '"{}"'.format(str(name).replace('"', '""'))
+
+def _is_list(val):
+	return pd.api.types.is_list_like(val) and not isinstance(val, dict)
+
+def is_list_column(series):
+	# text[] if any non-null value is a list. scraped columns are mostly lists with the odd bare
+	# string or leading NaN, so the first row alone isn't enough to go on
+	if series.dtype != object:
+		return False
+	return bool(series.dropna().map(_is_list).any())
+
+def pg_type(series):
+	# postgres column type for a dataframe column. list-valued columns become native text[]
+	# instead of being stringified the way to_sql does it.
+	if pd.api.types.is_bool_dtype(series):
+		return 'boolean'
+	if pd.api.types.is_integer_dtype(series):
+		return 'bigint'
+	if pd.api.types.is_float_dtype(series):
+		return 'double precision'
+	if pd.api.types.is_datetime64_any_dtype(series):
+		return 'timestamp'
+	if is_list_column(series):
+		return 'text[]'
+	return 'text'
+
+def create_table_ddl(df, table_name):
+	cols = ", ".join("{} {}".format(quote_ident(c), pg_type(df[c])) for c in df.columns)
+	return "CREATE TABLE IF NOT EXISTS {} ({})".format(quote_ident(table_name), cols)
+
+def copy_escape(val):
+	# escaping for COPY ... (FORMAT text)
+	return val.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def array_literal(values):
+	elems = list()
+	for v in values:
+		if v is None or (isinstance(v, float) and v != v):
+			elems.append('NULL')
+		else:
+			elems.append('"{}"'.format(str(v).replace('\\', '\\\\').replace('"', '\\"')))
+	return '{' + ','.join(elems) + '}'
+
+def copy_value(val, is_array):
+	if is_array:
+		if _is_list(val):
+			return copy_escape(array_literal(val))
+		if val is None or (not isinstance(val, str) and pd.isna(val)):
+			return '\\N'
+		# a bare value in a list column is a one-element list
+		return copy_escape(array_literal([val]))
+	if val is None or (not isinstance(val, str) and pd.isna(val)):
+		return '\\N'
+	if isinstance(val, bool):
+		return 't' if val else 'f'
+	if isinstance(val, float):
+		return repr(val)
+	return copy_escape(str(val))
+
+def copy_chunks(conn, df, table_name, chunksize=50000):
+	# stream df into an existing table, chunksize rows per COPY statement
+	columns = list(df.columns)
+	array_cols = [is_list_column(df[c]) for c in columns]
+	copy_sql = "COPY {} ({}) FROM STDIN".format(quote_ident(table_name), ", ".join(map(quote_ident, columns)))
+	cursor = conn.connection.cursor()
+	rows = 0
+	for start in range(0, len(df), chunksize):
+		chunk = df.iloc[start:start+chunksize]
+		buf = io.StringIO()
+		for row in chunk.itertuples(index=False, name=None):
+			buf.write('\t'.join(copy_value(v, a) for v, a in zip(row, array_cols)))
+			buf.write('\n')
+		buf.seek(0)
+		cursor.copy_expert(copy_sql, buf)
+		rows += len(chunk)
+		logging.info('\tcopied {} rows into {}'.format(rows, table_name))
+	cursor.close()
+	return rows
+
+def carried_ddl(conn, table_name, staging_name):
+	# the generated search columns and the search/suggest indexes table_name has, as DDL for the
+	# staging table that is about to replace it
+	statements = list()
+	has_search = conn.execute(text("""SELECT 1 FROM information_schema.columns
+		WHERE table_schema = current_schema() AND table_name = :table AND column_name = 'title_tsv'"""),
+		{'table': table_name}).first()
+	if has_search:
+		statements += search_index_ddl
+	has_suggest = conn.execute(text("""SELECT 1 FROM pg_indexes
+		WHERE schemaname = current_schema() AND tablename = :table AND indexname = :index"""),
+		{'table': table_name, 'index': table_name + '_title_trgm_idx'}).first()
+	if has_suggest:
+		statements += suggest_index_ddl
+	return [ddl.format(table=staging_name, config=search_config) for ddl in statements]
+
+def swap_tables(staging_name, table_name):
+	# readers keep seeing the old table until this commits. the staging table's indexes are
+	# named after it, so they get the old table's index names back once those are dropped
+	with get_engine().connect() as conn:
+		conn.execute(text("DROP TABLE IF EXISTS {}".format(quote_ident(table_name))))
+		conn.execute(text("ALTER TABLE {} RENAME TO {}".format(quote_ident(staging_name), quote_ident(table_name))))
+		indexes = conn.execute(text("""SELECT indexname FROM pg_indexes
+			WHERE schemaname = current_schema() AND tablename = :table"""), {'table': table_name}).scalars().all()
+		for index in indexes:
+			if index.startswith(staging_name + '_'):
+				conn.execute(text("ALTER INDEX {} RENAME TO {}".format(quote_ident(index),
+					quote_ident(table_name + index[len(staging_name):]))))
+		conn.commit()
+
+def copy_table(df, table_name, swap=False, chunksize=50000, index=True):
+	# bulk-load alternative to add_table. with swap=True the rows go into a staging table
+	# that replaces table_name in one transaction once it is fully loaded. the staging table
+	# gets the search columns and indexes of the table it replaces before the swap.
+	if index:
+		df = df.reset_index()
+	target = table_name + '_staging' if swap else table_name
+	start_time = time.perf_counter()
+	with get_engine().connect() as conn:
+		if swap:
+			conn.execute(text("DROP TABLE IF EXISTS {}".format(quote_ident(target))))
+		conn.execute(text(create_table_ddl(df, target)))
+		rows = copy_chunks(conn, df, target, chunksize)
+		conn.commit()
+	if swap:
+		with get_engine().connect() as conn:
+			for ddl in carried_ddl(conn, table_name, target):
+				conn.execute(text(ddl))
+			conn.execute(text("ANALYZE {}".format(quote_ident(target))))
+			conn.commit()
+		swap_tables(target, table_name)
+	elapsed = time.perf_counter() - start_time
+	rate = rows/elapsed if elapsed > 0 else float('inf')
+	logging.info('copied {} rows into {} in {:.1f}s ({:.0f} rows/sec)'.format(rows, table_name, elapsed, rate))
+	refresh_table(table_name)
+	return rows, rate
+
+def replace_rows(df, table_name, key_column, keys, chunksize=50000, index=True):
+	# delete the rows whose key_column is in keys and copy df in, in one transaction, so readers
+	# see either the old rows or the new ones. used for incremental loads of a few changed records.
+	if index:
+		df = df.reset_index()
+	with get_engine().connect() as conn:
+		conn.execute(text(create_table_ddl(df, table_name)))
+		deleted = conn.execute(text("DELETE FROM {} WHERE {} = ANY(:keys)".format(quote_ident(table_name), quote_ident(key_column))),
+			{'keys': [str(k) for k in keys]}).rowcount
+		rows = copy_chunks(conn, df, table_name, chunksize) if len(df) else 0
+		conn.commit()
+	logging.info('replaced {} rows of {} with {}'.format(deleted, table_name, rows))
+	return deleted, rows
+
+
+# long format version of the neighbors table, see postgres_interaction.neighbor_ranks_query
+neighbor_ranks_ddl = """
+	CREATE TABLE {table} (
+		id text NOT NULL,
+		rank smallint NOT NULL,
+		neighbor_id text NOT NULL,
+		distance real
+	)
+	"""
+neighbor_ranks_index_ddl = [
+	"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, rank) INCLUDE (neighbor_id, distance)",
+	"CREATE INDEX {table}_neighbor_id_idx ON {table} (neighbor_id) INCLUDE (id, rank, distance)",
+	]
+
+def neighbors_to_long(neighbors, distances):
+	# wide (book x rank) neighbor and distance frames from nearest_neighbors.do_ml
+	# -> one row per (id, rank, neighbor_id, distance)
+	neighbors = neighbors.rename(columns=int)
+	distances = distances.rename(columns=int)
+	long_df = pd.DataFrame({
+		'neighbor_id': neighbors.stack(),
+		'distance': distances.stack().astype('float32'),
+		})
+	long_df.index.names = ['id', 'rank']
+	return long_df.reset_index()
+
+def load_neighbor_ranks(long_df, chunksize=50000):
+	# build the table without indexes, bulk load it, then add the indexes in one pass
+	with get_engine().connect() as conn:
+		conn.execute(text("DROP TABLE IF EXISTS {}".format(neighbor_ranks_table)))
+		conn.execute(text(neighbor_ranks_ddl.format(table=neighbor_ranks_table)))
+		copy_chunks(conn, long_df, neighbor_ranks_table, chunksize)
+		for ddl in neighbor_ranks_index_ddl:
+			conn.execute(text(ddl.format(table=neighbor_ranks_table)))
+		conn.commit()
+	with get_engine().connect() as conn:
+		conn.execute(text("ANALYZE {}".format(neighbor_ranks_table)))
+		conn.commit()
+	refresh_table(neighbor_ranks_table)
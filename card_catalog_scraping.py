@@ -1,12 +1,12 @@
 import pandas as pd
 import json
 import requests
-from bs4 import BeautifulSoup
 import random
-from retrying import retry
 import argparse
 import logging
 import postgres_interaction
+from page_json import extract_iso_json
+from fetch_engine import scraper_fetcher, default_fetcher, Throughput, search_url
 
 
 
@@ -23,10 +23,10 @@ def book_dict(k, v):
     d['authors'] = authors_list
     return d
 
-@retry(wait_random_min=500, wait_random_max=2000, stop_max_attempt_number=3)
-def scrape_results_page(page_num):
+def scrape_results_page(page_num, fetcher=None):
+    fetcher = fetcher or default_fetcher()
     try:
-        resp=requests.get('https://seattle.bibliocommons.com/v2/search', 
+        resp=fetcher.get(search_url(), 
                       params = {'custom_edit': 'false',
                                 'query':'formatcode:(AB )',
                                 'searchType': 'bl',
@@ -34,12 +34,9 @@ def scrape_results_page(page_num):
                                 'sort':'author',
                                 'page':str(page_num)
                                })
+        resp.raise_for_status()
 
-        soup = BeautifulSoup(resp.content, "html.parser")
-        book_info_json = soup.find('script', attrs={'type':'application/json',
-                                           'data-iso-key':'_0'
-                                      })
-        book_info = json.loads(book_info_json.text)
+        book_info = extract_iso_json(resp.content)
         book_list = book_info['entities']['bibs']
         book_dicts = list() 
 
@@ -54,15 +51,64 @@ def scrape_results_page(page_num):
         logging.warning("Unexpected {}, {} on page {}".format(e, type(e), page_num))
 
 
-def scrape_card_catalog(engine, start, end):
-    # last page is 5607
+# last page is 5607
+catalog_pages = 5608
+
+def catalog_results(fetcher, start, end):
+	# (page_num, dataframe) for result pages start through end-1, fetched concurrently and
+	# yielded as they finish. a page that fails is yielded as (page_num, None), so callers can
+	# tell a complete crawl from a partial one.
 	if end < 0:
-		end = 5608
-	for page_num in range(start, end):
-		if page_num%100 == 0:
-			logging.info("page {}".format(page_num))
-		df = scrape_results_page(page_num)
-		postgres_interaction.add_record(engine, df, 'book_ids')
+		end = catalog_pages
+	progress = Throughput()
+	failed = list()
+	for page_num, df, err in fetcher.map(lambda p: scrape_results_page(p, fetcher), range(start, end)):
+		if err is not None or df is None:
+			if err is not None:
+				logging.warning("Unexpected {}, {} on page {}".format(err, type(err), page_num))
+			progress.tick(ok=False)
+			failed.append(page_num)
+			yield page_num, None
+			continue
+		progress.tick()
+		yield page_num, df
+	logging.info('catalog pages {} through {}: {}'.format(start, end, progress.summary()))
+	if failed:
+		logging.warning('{} catalog pages failed: {}'.format(len(failed), sorted(failed)))
+
+def scrape_catalog(start=1, end=-1, fetcher=None):
+	# (catalog, failed page numbers). the catalog is every (title, authors) row on result pages
+	# start through end-1 as one dataframe indexed by id_num, empty if every page failed
+	fetcher = fetcher or default_fetcher()
+	pages = list()
+	failed = list()
+	for page_num, df in catalog_results(fetcher, start, end):
+		if df is None:
+			failed.append(page_num)
+		else:
+			pages.append(df)
+	if not pages:
+		return pd.DataFrame(columns=['title', 'authors'], index=pd.Index([], name='id_num')), sorted(failed)
+	catalog = pd.concat(pages)
+	return catalog[~catalog.index.duplicated(keep='first')], sorted(failed)
+
+def scrape_card_catalog(start, end, concurrency=4, rate=5.0, batch_rows=1000, cache_dir=None, replay=False):
+	# rows are buffered and upserted into book_ids batch_rows at a time, ~40 pages per statement
+	fetcher = scraper_fetcher(concurrency, rate, cache_dir, replay)
+	postgres_interaction.prepare_book_ids()
+	buffer = dict()
+	written = 0
+	for page_num, df in catalog_results(fetcher, start, end):
+		if df is None:
+			continue
+		for row in df.reset_index().to_dict('records'):
+			buffer[row['id_num']] = row
+		if len(buffer) >= batch_rows:
+			written += postgres_interaction.upsert_book_ids(list(buffer.values()))
+			buffer.clear()
+	written += postgres_interaction.upsert_book_ids(list(buffer.values()))
+	logging.info('upserted {} rows into book_ids'.format(written))
+	return written
 
 
 def main():
@@ -71,6 +117,16 @@ def main():
 								help="which result page to start start scraping")
 	parser.add_argument("end", type=int,
 								help="which results page to stop scraping")
+	parser.add_argument("--concurrency", "-c", type=int, default=4,
+								help="how many result pages to fetch at once, default = 4")
+	parser.add_argument("--rate", "-r", type=float, default=5.0,
+								help="max requests per second across all workers, default = 5")
+	parser.add_argument("--batch", type=int, default=1000,
+								help="rows per upsert statement, default = 1000")
+	parser.add_argument("--cache", default=None,
+								help="directory to keep raw pages in, refetches become conditional requests")
+	parser.add_argument("--replay", action="store_true",
+								help="parse pages from --cache only, without touching the network")
 	args = parser.parse_args()
 	logfile = 'logs/card_catalog_scraping.log'
 	logging.basicConfig(filename=logfile, 
@@ -79,8 +135,7 @@ def main():
 								)
 								
 	logging.info("scraping catalog pages # {} through {}...".format(args.start, args.end))
-	engine = postgres_interaction.get_db_engine()
-	scrape_card_catalog(engine, args.start, args.end)
+	scrape_card_catalog(args.start, args.end, args.concurrency, args.rate, args.batch, args.cache, args.replay)
 	logging.info("done")
 	logging.info("-------------------")
 
@@ -0,0 +1,76 @@
+import os
+import json
+import gzip
+import hashlib
+import logging
+
+from flask import Response, request
+
+# brotli is in requirements.txt. without it charts are still served, gzip only
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+
+# a response body with its compressed variants and etag, all computed once
+class Payload:
+
+	def __init__(self, body, mimetype):
+		self.body = body
+		self.mimetype = mimetype
+		self.etag = hashlib.sha256(body).hexdigest()[:32]
+		self.encoded = {'gzip': gzip.compress(body, compresslevel=9)}
+		if brotli is not None:
+			self.encoded['br'] = brotli.compress(body)
+
+	def response(self, max_age=3600):
+		# 304 for revalidations, otherwise the smallest body the client accepts
+		if request.if_none_match.contains(self.etag):
+			resp = Response(status=304)
+		else:
+			body, encoding = self.body, None
+			for enc in ('br', 'gzip'):
+				if enc in self.encoded and request.accept_encodings[enc]:
+					body, encoding = self.encoded[enc], enc
+					break
+			resp = Response(body, mimetype=self.mimetype)
+			if encoding:
+				resp.headers['Content-Encoding'] = encoding
+		resp.set_etag(self.etag)
+		resp.headers['Vary'] = 'Accept-Encoding'
+		resp.cache_control.public = True
+		resp.cache_control.max_age = max_age
+		return resp
+
+
+# the vega specs in static/, read and validated once at startup. pages holds the rendered
+# /chart/<chart_name> page for each spec.
+class ChartRegistry:
+
+	def __init__(self, directory='static'):
+		self.specs = dict()
+		self.pages = dict()
+		for filename in sorted(os.listdir(directory)):
+			name, ext = os.path.splitext(filename)
+			if ext != '.json':
+				continue
+			with open(os.path.join(directory, filename), 'r') as f:
+				raw = f.read()
+			try:
+				spec = json.loads(raw)
+			except ValueError as err:
+				logging.warning("skipping chart {}: {}".format(filename, err))
+				continue
+			if not isinstance(spec, dict):
+				logging.warning("skipping chart {}: not a vega spec".format(filename))
+				continue
+			self.specs[name] = raw
+
+	def __contains__(self, name):
+		return name in self.specs
+
+	def render_pages(self, render):
+		# render(spec_text) -> html for one chart page. needs an app context.
+		for name, raw in self.specs.items():
+			self.pages[name] = Payload(render(raw).encode('utf-8'), 'text/html')
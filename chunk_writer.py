@@ -0,0 +1,141 @@
+import os
+import re
+import glob
+import logging
+import numpy as np
+import pandas as pd
+
+try:
+	import pyarrow
+	import pyarrow.parquet
+except ImportError:
+	pyarrow = None
+
+
+# streaming output for the scrapers. rows are buffered and written out rows_per_chunk at a time
+# as numbered, append-only part files in one directory per dataset, so memory stays flat and
+# finished parts can be read (read_chunks / pd.read_parquet on the directory) while the scrape
+# is still running. each part is its own file rather than a row group of one big file, because
+# a parquet file can't be read until its footer is written.
+# parts are parquet when pyarrow is installed and pickles without it. scraped frames have list
+# columns and columns that drift between pages, so a part pyarrow can't convert is written as a
+# pickle instead.
+
+part_pattern = re.compile(r'part-(\d+)\.(parquet|pkl)$')
+
+def part_files(directory):
+	# finished parts in write order
+	parts = list()
+	for path in glob.glob(os.path.join(directory, 'part-*')):
+		match = part_pattern.search(os.path.basename(path))
+		if match:
+			parts.append((int(match.group(1)), path))
+	return [path for _, path in sorted(parts)]
+
+def _lists_from_arrays(df):
+	# pyarrow reads list columns back as numpy arrays; the parsers expect the lists that were written
+	for col in df.columns:
+		if df[col].dtype == object:
+			df[col] = df[col].map(lambda v: v.tolist() if isinstance(v, np.ndarray) else v)
+	return df
+
+def read_part(path):
+	if path.endswith('.parquet'):
+		return _lists_from_arrays(pd.read_parquet(path))
+	return pd.read_pickle(path)
+
+def read_chunks(path):
+	# dataframes one part at a time. a plain pickle is read as a single chunk
+	if not os.path.isdir(path):
+		yield pd.read_pickle(path)
+		return
+	for part in part_files(path):
+		yield read_part(part)
+
+def load_frame(path):
+	# the whole dataset at once, from a part directory or a pickle. parts written with
+	# index=True (e.g. cleaned tables indexed by id) keep their index
+	frames = list(read_chunks(path))
+	if not frames:
+		raise FileNotFoundError("no part files in {}".format(path))
+	keep_index = not isinstance(frames[0].index, pd.RangeIndex)
+	return pd.concat(frames, ignore_index=not keep_index)
+
+
+def _parquet_ready(df):
+	# NaN in an object column next to lists or strings trips up pyarrow's type inference
+	df = df.copy()
+	for col in df.columns:
+		if df[col].dtype == object:
+			df[col] = df[col].astype(object).where(df[col].notna(), None)
+	return df
+
+
+class ChunkWriter:
+
+	def __init__(self, directory, rows_per_chunk=5000, overwrite=False, parquet=True, index=False):
+		# overwrite=True clears parts left by an earlier run, otherwise numbering carries on after them.
+		# index=True keeps the frames' index instead of numbering rows per part
+		self.directory = directory
+		self.index = index
+		self.rows_per_chunk = rows_per_chunk
+		self.parquet = parquet and pyarrow is not None
+		os.makedirs(directory, exist_ok=True)
+		existing = part_files(directory)
+		if overwrite:
+			for path in existing:
+				os.remove(path)
+			existing = list()
+		self.next_part = int(part_pattern.search(existing[-1]).group(1)) + 1 if existing else 0
+		self.buffer = list()
+		self.buffered_rows = 0
+		self.rows = 0
+		self.parts = 0
+
+	def append(self, df):
+		if df is None or len(df) == 0:
+			return
+		self.buffer.append(df)
+		self.buffered_rows += len(df)
+		if self.buffered_rows >= self.rows_per_chunk:
+			self.flush()
+
+	def flush(self):
+		if not self.buffer:
+			return
+		chunk = pd.concat(self.buffer, ignore_index=not self.index)
+		self.buffer = list()
+		self.buffered_rows = 0
+		path = os.path.join(self.directory, 'part-{:05d}'.format(self.next_part))
+		self.next_part += 1
+		if self.parquet:
+			try:
+				self._write(chunk, path + '.parquet', lambda df, p: _parquet_ready(df).to_parquet(p, index=self.index))
+			except (pyarrow.ArrowException, TypeError, ValueError) as err:
+				logging.warning("writing {} as a pickle, pyarrow couldn't convert it: {}".format(path, err))
+				self._write(chunk, path + '.pkl', lambda df, p: df.to_pickle(p))
+		else:
+			self._write(chunk, path + '.pkl', lambda df, p: df.to_pickle(p))
+		self.rows += len(chunk)
+		self.parts += 1
+
+	def _write(self, chunk, path, write):
+		# write under a temporary name so readers never pick up a half-written part
+		tmp_path = path + '.tmp'
+		try:
+			write(chunk, tmp_path)
+		except Exception:
+			if os.path.exists(tmp_path):
+				os.remove(tmp_path)
+			raise
+		os.replace(tmp_path, path)
+
+	def close(self):
+		self.flush()
+		logging.info('wrote {} rows in {} parts to {}'.format(self.rows, self.parts, self.directory))
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
@@ -0,0 +1,81 @@
+import time
+import argparse
+import pandas as pd
+
+import data_cleaning as dc
+from chunk_writer import load_frame
+
+
+# rows/sec of data_cleaning's per-row .apply() parsers against their once-per-distinct-cell
+# column versions, on a real scraped table. every pair is checked for identical output before
+# it is timed. desc_len, notes_len and first_isbn are timed through the same helper even though
+# get_relevant_info_audio keeps them on .apply(): rerun this on fresh scrapes to see whether
+# that's still the right call.
+
+def audio_pairs(df):
+	# name -> (per-row version, column version), each a function of the raw table
+	pub = 'fields.DETAILS.PUBLICATION'
+	return {
+		'publication': (lambda: pd.DataFrame(df[pub].fillna(False).apply(dc.parse_about_pub).tolist(), index=df.index),
+			lambda: dc.parse_about_pub_column(df[pub])),
+		'desc_len': (lambda: df['fields.DETAILS.DESCRIPTION'].apply(dc.get_len_from_desc),
+			lambda: dc._column(df['fields.DETAILS.DESCRIPTION'], dc.get_len_from_desc)),
+		'notes_len': (lambda: df['fields.NOTES.GENERAL'].apply(dc.get_len_from_notes),
+			lambda: dc._column(df['fields.NOTES.GENERAL'], dc.get_len_from_notes)),
+		'first_isbn': (lambda: df['fields.IDENTIFIERS.ISBN'].apply(dc.extract_first_isbn),
+			lambda: dc._column(df['fields.IDENTIFIERS.ISBN'], dc.extract_first_isbn)),
+		}
+
+def related_pairs(df):
+	return {
+		'publication_date': (lambda: df['publicationDate'].apply(dc.date_to_int),
+			lambda: dc.date_to_int_column(df['publicationDate'])),
+		}
+
+def best_time(func, repeat):
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		func()
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best
+
+def check(name, before, after):
+	if isinstance(before, pd.DataFrame):
+		pd.testing.assert_frame_equal(before, after, obj=name)
+	else:
+		pd.testing.assert_series_equal(before, after, obj=name)
+
+def report(pairs, rows, repeat):
+	total_before = total_after = 0.0
+	for name, (before, after) in pairs.items():
+		check(name, before(), after())
+		t_before = best_time(before, repeat)
+		t_after = best_time(after, repeat)
+		total_before += t_before
+		total_after += t_after
+		print("{:<18} {:>12.0f} {:>12.0f} {:>8.1f}x".format(name, rows/t_before, rows/t_after, t_before/t_after))
+	return total_before, total_after
+
+def main():
+	parser = argparse.ArgumentParser(description="benchmark data_cleaning's column parsers against the per-row versions")
+	parser.add_argument("audio_path", help="raw book features: a pickle or a directory of scraper output parts")
+	parser.add_argument("--related", default=None, help="raw related titles, to include publicationDate parsing")
+	parser.add_argument("--repeat", type=int, default=3, help="timing runs per parser, the best is reported, default = 3")
+	args = parser.parse_args()
+
+	audio = dc.with_fields(load_frame(args.audio_path), dc.audio_fields)
+	print("{} audio rows".format(len(audio)))
+	print("{:<18} {:>12} {:>12} {:>9}".format('parser', 'rows/s before', 'rows/s after', 'speedup'))
+	total_before, total_after = report(audio_pairs(audio), len(audio), args.repeat)
+	if args.related:
+		related = dc.with_fields(load_frame(args.related), dc.related_fields)
+		print("{} related rows".format(len(related)))
+		report(related_pairs(related), len(related), args.repeat)
+	print("all audio parsers: {:.2f}s -> {:.2f}s, {:.0f} -> {:.0f} rows/sec".format(
+		total_before, total_after, len(audio)/total_before, len(audio)/total_after))
+
+
+if __name__ == "__main__":
+	main()
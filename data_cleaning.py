@@ -1,15 +1,19 @@
+import os
 import pandas as pd
 import re
 import numpy as np
 import argparse
-#import spacy
-#nlp = spacy.load("en_core_web_sm")
+from book_display import parse_author
+from chunk_writer import ChunkWriter, read_chunks
+from heading_vocab import HeadingVocab
+from performer_ner import PerformerParser
 
 
 
 def fix_audio_errors(df):
 	# A children's book called "The Case of The Weird Blue Chicken" whose pubdate is listed as 1917 instead of 2017
-	df.at['S30C3286809', 'publisher_year'] = 2017 
+	if 'S30C3286809' in df.index:
+		df.at['S30C3286809', 'publisher_year'] = 2017 
 
 def fix_related_errors(df):
 	# these 4 books are listed as 'government documents' for some reason...
@@ -79,23 +83,12 @@ def parse_contributors(contributor_list):
 	return list(conts)
 
 	   
+# rule-based for the usual "read by X" strings, spaCy NER (batched, PERFORMER_NER_PROCESSES
+# processes) for the rest, cached per string. see performer_ner.py
+performer_parser = PerformerParser(n_process=int(os.environ.get('PERFORMER_NER_PROCESSES', 1)))
+
 def parse_performers(perf_list):
-    if not pd.api.types.is_list_like(perf_list):
-        return np.nan
-    perfs = set()
-    for perf in perf_list:
-        doc = nlp(perf)
-        for ent in doc.ents:
-            if ent.label_ == 'PERSON':
-                before_char = ''
-                before_word = ''
-                if ent.start_char > 0:
-                    before_char = perf[ent.start_char-1]
-                if ent.start_char >=3:
-                    before_word = perf[ent.start_char-3:ent.start_char-1].lower()
-                if before_word != 'as' and before_char != '(':
-                    perfs.add(ent.text)
-    return list(perfs)
+    return performer_parser.parse_cell(perf_list)
 
 
 # parse book length from 'fields.NOTES.GENERAL' to get length of book in seconds
@@ -108,7 +101,7 @@ def get_len_from_notes(notes):
                 minutes = int(res.group(2))*60.0
                 secs = int(res.group(3))
                 return hrs + minutes + secs
-    return np.NAN
+    return np.nan
 	
 # parse book length from 'fields.DETAILS.DESCRIPTION' to get length of book in seconds
 def get_len_from_desc(desc):
@@ -121,7 +114,7 @@ def get_len_from_desc(desc):
 				minutes = int(res.group(2))*60.0
 				secs = int(res.group(3))
 				return hrs + minutes + secs
-	return np.NAN
+	return np.nan
 	
 assert get_len_from_desc(['1 online resource (1 audio file (03 hr., 09 min., 53 sec.))']) == 11393.0
 
@@ -170,31 +163,40 @@ misspellings = {
 	'romantic suspence fiction': 'romantic suspense fiction',
 }
 
+separators = ['^', "&lt;delimit&gt;", " — ", "--", "/"]
+
+def normalize_heading(elem):
+    # the set of terms one raw subject/genre heading normalizes to
+    terms = set()
+    lower = elem.lower()
+    if len(lower) == 0:
+        return terms
+    if lower[-1] == '.':
+        lower = lower[:-1]
+    if lower in misspellings:
+        lower = misspellings[lower]
+    if lower in bad_entries:
+        return terms
+    for sep in separators:
+        if sep in lower:
+            for sub in lower.split(sep):
+                terms.update(normalize_heading(sub.strip()))
+            return terms
+    terms.add(lower)
+    return terms
+
+# headings are normalized once each and kept as term ids, see heading_vocab.py. the cache and
+# vocabulary are kept between runs in one file shared by this script and incremental_refresh,
+# so they hand out the same ids. HEADING_VOCAB (or --heading-vocab below) points elsewhere
+default_heading_vocab_path = 'pickles/heading_vocab.json'
+heading_vocab = HeadingVocab(normalize_heading,
+    {'misspellings': misspellings, 'bad_entries': sorted(bad_entries), 'separators': separators},
+    os.environ.get('HEADING_VOCAB', default_heading_vocab_path))
+
 def get_subject_genres(field):
     if not pd.api.types.is_list_like(field):
         return np.nan
-    elems = set()
-    for elem in field:
-        lower = elem.lower()
-        if len(lower) == 0:
-            continue
-        if lower[-1] == '.':
-            lower = lower[:-1]
-        if lower in misspellings:
-            lower = misspellings[lower]
-        if lower in bad_entries:
-            continue
-        separators = ['^', "&lt;delimit&gt;", " — ", "--", "/"]
-        separator_found = False
-        for sep in separators:
-            if sep in lower:
-                separator_found = True
-                subs = [s.strip() for s in lower.split(sep)]
-                elems.update(get_subject_genres(subs))
-                break
-        if not separator_found:
-            elems.add(lower)
-    return list(elems)
+    return heading_vocab.decode(heading_vocab.encode(field))
 
 
 def first_list_entry(field, null = np.nan):
@@ -216,18 +218,57 @@ def extract_first_isbn(isbns):
             isbn = re.search('\d+', isbns[0])
             if isbn is not None:
                 return isbn.group(0)
-    return np.NAN
-	
-def parse_author(author):
-	if not author:
-		return "Author not listed"
-	parts = list(map(str.strip, author.split(',')))
-	if len(parts) == 1:
-		return parts[0]
-	else:
-		return " ".join([parts[1], parts[0]])
+    return np.nan
 	
-	 
+
+# whole-column versions of the per-row parsers above, for get_relevant_info_*. they run the
+# per-row parser once per distinct cell and spread the result back over the column, so the two
+# can't drift apart. that only pays off where values repeat: publication strings and dates do,
+# descriptions, notes and isbns are close to unique per book and stay on .apply().
+# cleaning_benchmark.py checks every parser both ways and times them on a scraped table.
+def _per_distinct(col, parse):
+	parsed = dict()
+	results = list()
+	for cell in col:
+		if isinstance(cell, list):
+			key = tuple(cell)
+		elif cell is None or (isinstance(cell, float) and cell != cell):
+			# NaN != NaN, so every NaN would miss the dict
+			key = None
+		elif pd.api.types.is_list_like(cell):
+			key = tuple(cell)
+			cell = list(cell)
+		else:
+			key = (type(cell), cell)
+		try:
+			result = parsed[key]
+		except KeyError:
+			result = parsed[key] = parse(cell)
+		except TypeError:
+			# unhashable cell
+			result = parse(cell)
+		results.append(result)
+	return results
+
+def _column(col, parse):
+	# same values and dtype as col.apply(parse)
+	if len(col) == 0:
+		return col.apply(parse)
+	return pd.Series(_per_distinct(col, parse), index=col.index, name=col.name)
+
+def _parse_about_pub_filled(pub_list):
+	# parse_about_pub after fillna(False)
+	if pub_list is None or (isinstance(pub_list, float) and np.isnan(pub_list)):
+		pub_list = False
+	return parse_about_pub(pub_list)
+
+# same result as pd.DataFrame(col.fillna(False).apply(parse_about_pub).tolist(), index=col.index)
+def parse_about_pub_column(col):
+	return pd.DataFrame(_per_distinct(col, _parse_about_pub_filled), index=col.index)
+
+def date_to_int_column(col):
+	return _column(col, date_to_int)
+
 # fields we want:
 # id - the SC number (col 0)
 # brief.title - str, 16
@@ -249,6 +290,24 @@ def parse_author(author):
 # fields.CALLCLASS.CALLNO_DDC = list dewey decimal call number, 39
 # 'fields.NOTES.GENERAL', 42, sometimes includes duration
 
+# raw columns get_relevant_info_audio and get_relevant_info_related read. a small batch of pages
+# may not have every field, so incremental loads add the missing ones as empty columns first.
+audio_fields = ['brief.title', 'brief.subTitle', 'brief.primaryLanguage', 'brief.publicationDate',
+	'brief.description', 'fields.DETAILS.CREATORS', 'fields.DETAILS.PUBLICATION', 'fields.DETAILS.DESCRIPTION',
+	'fields.NOTES.GENERAL', 'fields.DETAILS.TITLE', 'fields.DETAILS.SUMMARY', 'fields.CONTRIBUTORS.CONTRIBUTOR_NAME',
+	'fields.CONTRIBUTORS.CONTRIBUTOR_PERFORMERS', 'fields.SUBJECTGENRE.SUBJECT', 'fields.SUBJECTGENRE.GENRE',
+	'fields.IDENTIFIERS.ISBN', 'fields.CALLCLASS.CALLNO_LC', 'fields.CALLCLASS.CALLNO_DDC',
+	'brief.coverImage.small', 'brief.coverImage.medium', 'brief.coverImage.large']
+related_fields = ['genreForm', 'compositeSubjectHeadings', 'authors', 'consumptionFormat', 'contentType',
+	'publicationDate', 'primaryLanguage', 'format', 'title', 'subtitle', 'description', 'isbns', 'audiences',
+	'subjectHeadings', 'jacket.small', 'jacket.medium', 'jacket.large', 'rating.averageRating', 'rating.totalCount']
+
+def with_fields(df, fields):
+	missing = [f for f in fields if f not in df.columns]
+	if not missing:
+		return df
+	return df.reindex(columns=list(df.columns) + missing)
+
 def combine_conts(row):
     keys = ['parsed_contributors', 'parsed_performers']
     return combine_col_lists(row, keys)
@@ -296,10 +355,7 @@ def get_relevant_info_audio(df):
 	cleaned['author'] = df['fields.DETAILS.CREATORS'].apply(first_list_entry)
 	cleaned['normalized_author'] = cleaned['author'].apply(normalize_author)
 	
-	cleaned[['publisher_year', 'publisher']] = (pd.DataFrame(df['fields.DETAILS.PUBLICATION']
-	.fillna(False).apply(parse_about_pub)
-	.tolist(), index=df.index)
-	)
+	cleaned[['publisher_year', 'publisher']] = parse_about_pub_column(df['fields.DETAILS.PUBLICATION'])
 		
 	# extract book length from either descripiton or notes column, depending on which has it
 	df['desc_len'] = df['fields.DETAILS.DESCRIPTION'].apply(get_len_from_desc) 
@@ -314,7 +370,7 @@ def get_relevant_info_audio(df):
 	cleaned['all_sumaries'] = df['fields.DETAILS.SUMMARY'].copy()
 	
 	df['parsed_contributors'] = df['fields.CONTRIBUTORS.CONTRIBUTOR_NAME'].apply(parse_contributors)
-	df['parsed_performers'] = df['fields.CONTRIBUTORS.CONTRIBUTOR_PERFORMERS'].apply(parse_performers)
+	df['parsed_performers'] = performer_parser.parse_column(df['fields.CONTRIBUTORS.CONTRIBUTOR_PERFORMERS'])
 	cleaned['parsed_contributors'] = df.apply(combine_conts, axis=1)
 	
 	cleaned['contributors'] = df['fields.CONTRIBUTORS.CONTRIBUTOR_NAME'].copy()
@@ -345,7 +401,7 @@ def get_relevant_info_related(df):
 	cleaned['normalized_author'] = cleaned['author'].apply(normalize_author)
 	cleaned['consumptionFormat'] = df['consumptionFormat'].copy()
 	cleaned['contentType'] = df['contentType'].fillna('UNDETERMINED')
-	cleaned['publicationDate'] = df['publicationDate'].apply(date_to_int)
+	cleaned['publicationDate'] = date_to_int_column(df['publicationDate'])
 
 	cleaned['primaryLanguage'] = df['primaryLanguage'].fillna('UNDETERMINED')
 	fields_to_copy = ['id', 'format', 'title', 'subtitle', 
@@ -362,26 +418,54 @@ def get_relevant_info_related(df):
 
 
 
+def clean_chunks(table_name, input_path):
+	# cleaned dataframes one input chunk at a time. a book scraped twice is kept the first time,
+	# same as drop_duplicates on the whole table.
+	if table_name == "book_features":
+		clean, fields = get_relevant_info_audio, audio_fields
+	else:
+		clean, fields = get_relevant_info_related, related_fields
+	seen = set()
+	for chunk in read_chunks(input_path):
+		cleaned = clean(with_fields(chunk, fields))
+		cleaned = cleaned[~cleaned.index.isin(seen)]
+		seen.update(cleaned.index)
+		yield cleaned
+
 def main():
 	parser = argparse.ArgumentParser()
 	parser.add_argument("table_name", 
 								help="which table are we cleaning")
 	parser.add_argument("input_path",
-								help="filename we're reading from")
+								help="pickle or directory of scraper output parts we're reading from")
 	parser.add_argument("output_path",
-								help="filename we're writing to")
+								help="filename we're writing to, a .pkl file or a directory for part files")
+	parser.add_argument("--heading-vocab", default=None,
+								help="json file of normalized subject/genre headings and term ids, kept between runs, default = HEADING_VOCAB or pickles/heading_vocab.json")
+	parser.add_argument("--ner-processes", type=int, default=None,
+								help="processes for spacy performer NER, default = PERFORMER_NER_PROCESSES or 1")
 	args = parser.parse_args()
+	if args.ner_processes:
+		performer_parser.n_process = args.ner_processes
 	
-	input_table = pd.read_pickle(args.input_path)
-	if args.table_name == "book_features":
-		cleaned = get_relevant_info_audio(input_table)
-	elif args.table_name == "related_books":
-		cleaned = get_relevant_info_related(input_table)
-	else:
+	if args.table_name not in {"book_features", "related_books"}:
 		print("invalid table name. please choose book_features or related_books")
 		return
 	
-	cleaned.to_pickle(args.output_path)
+	if args.heading_vocab and args.heading_vocab != heading_vocab.path:
+		heading_vocab.path = args.heading_vocab
+		if os.path.exists(args.heading_vocab):
+			heading_vocab.load(args.heading_vocab)
+	if args.output_path.endswith('.pkl'):
+		cleaned = pd.concat(clean_chunks(args.table_name, args.input_path))
+		cleaned.to_pickle(args.output_path)
+	else:
+		with ChunkWriter(args.output_path, overwrite=True, index=True) as out:
+			for cleaned in clean_chunks(args.table_name, args.input_path):
+				out.append(cleaned)
+	heading_vocab.save()
+	print(heading_vocab.summary())
+	print(performer_parser.summary())
 
 
 
@@ -0,0 +1,237 @@
+import os
+import time
+import random
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from page_cache import PageCache
+
+
+# shared HTTP fetching for the scrapers: a pooled keep-alive session, a token bucket for the
+# overall request rate, a cap on in-flight requests per host, and retries with exponential
+# backoff that wait out Retry-After on 429/503.
+# with a PageCache every response is kept on disk and refetches are conditional; with
+# replay=True pages come only from the cache and the network is never touched.
+
+retry_statuses = {429, 500, 502, 503, 504}
+
+# where the scrapers point. set BIBLIOCOMMONS_URL (or assign base_url) to aim them at
+# bibliocommons_standin.py instead of the real site.
+base_url = os.environ.get('BIBLIOCOMMONS_URL', 'https://seattle.bibliocommons.com').rstrip('/')
+
+def record_url(book_id):
+	return '{}/v2/record/{}'.format(base_url, book_id)
+
+def search_url():
+	return '{}/v2/search'.format(base_url)
+
+class TokenBucket:
+
+	def __init__(self, rate, burst=None):
+		# rate = tokens per second, burst = bucket size
+		self.rate = rate
+		self.capacity = burst if burst is not None else max(1.0, rate)
+		self.tokens = self.capacity
+		self.updated = time.monotonic()
+		self._lock = threading.Lock()
+
+	def acquire(self):
+		while True:
+			with self._lock:
+				now = time.monotonic()
+				self.tokens = min(self.capacity, self.tokens + (now - self.updated)*self.rate)
+				self.updated = now
+				if self.tokens >= 1:
+					self.tokens -= 1
+					return
+				wait_for = (1 - self.tokens)/self.rate
+			time.sleep(wait_for)
+
+
+def retry_after_seconds(resp):
+	value = resp.headers.get('Retry-After')
+	if not value:
+		return None
+	try:
+		return max(0.0, float(value))
+	except ValueError:
+		pass
+	try:
+		return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+	except (TypeError, ValueError):
+		return None
+
+
+class Fetcher:
+
+	def __init__(self, concurrency=1, rate=5.0, burst=None, per_host=None, max_retries=4,
+				backoff=1.0, max_backoff=60.0, max_retry_after=300.0, timeout=30, cache=None, replay=False):
+		if replay and cache is None:
+			raise ValueError("replay needs a page cache")
+		self.cache = cache
+		self.replay = replay
+		self.concurrency = concurrency
+		self.per_host = per_host or concurrency
+		self.max_retries = max_retries
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.max_retry_after = max_retry_after
+		self.timeout = timeout
+		self.bucket = TokenBucket(rate, burst) if rate else None
+		self.session = requests.Session()
+		adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(concurrency, self.per_host))
+		self.session.mount('https://', adapter)
+		self.session.mount('http://', adapter)
+		self._host_slots = dict()
+		self._lock = threading.Lock()
+		self.stats = {'requests': 0, 'retries': 0, 'failures': 0, 'bytes': 0, 'not_modified': 0, 'replayed': 0}
+
+	def _count(self, key, n=1):
+		with self._lock:
+			self.stats[key] += n
+
+	def _slot(self, url):
+		host = urlsplit(url).netloc
+		with self._lock:
+			if host not in self._host_slots:
+				self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+			return self._host_slots[host]
+
+	def _backoff(self, attempt, resp=None):
+		delay = None
+		if resp is not None:
+			delay = retry_after_seconds(resp)
+		if delay is not None:
+			# a misconfigured server (or a date far in the future) shouldn't park a worker for hours
+			delay = min(delay, self.max_retry_after)
+		else:
+			delay = min(self.max_backoff, self.backoff * 2**attempt)
+			delay = delay/2 + random.uniform(0, delay/2)
+		time.sleep(delay)
+
+	def get(self, url, params=None, headers=None, max_retries=None):
+		# returns the response for anything that isn't retried (including 404s),
+		# raises once retries run out
+		if max_retries is None:
+			max_retries = self.max_retries
+		if self.cache is not None:
+			# the cache is keyed on the full url, query string included
+			url = requests.Request('GET', url, params=params).prepare().url
+			params = None
+			if self.replay:
+				self._count('replayed')
+				return self.cache.response(url)
+			headers = dict(headers or {}, **self.cache.conditional_headers(url))
+		slot = self._slot(url)
+		for attempt in range(max_retries + 1):
+			if self.bucket is not None:
+				self.bucket.acquire()
+			resp = None
+			try:
+				with slot:
+					self._count('requests')
+					resp = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+				if resp.status_code not in retry_statuses:
+					self._count('bytes', len(resp.content))
+					if self.cache is not None:
+						return self._through_cache(url, resp)
+					return resp
+				err = requests.HTTPError("{} for {}".format(resp.status_code, resp.url), response=resp)
+			except (requests.ConnectionError, requests.Timeout) as e:
+				err = e
+			if attempt == max_retries:
+				self._count('failures')
+				raise err
+			self._count('retries')
+			logging.info("retrying {} after {}".format(url, err))
+			self._backoff(attempt, resp)
+
+	def _through_cache(self, url, resp):
+		if resp.status_code == 304:
+			# unchanged since the cached copy: log the fetch against the same body and serve it
+			self._count('not_modified')
+			fetched_at, status, digest, etag, last_modified = self.cache.latest(url)
+			self.cache.record(url, status, digest, resp.headers.get('ETag', etag), resp.headers.get('Last-Modified', last_modified))
+			return self.cache.response(url)
+		self.cache.store(url, resp)
+		return resp
+
+	def map(self, func, items):
+		# run func over items on self.concurrency threads, yielding (item, result, error) as they
+		# finish. only a few batches of work are queued at a time, so memory stays flat.
+		window = self.concurrency * 4
+		items = iter(items)
+		with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='fetch') as pool:
+			pending = dict()
+			exhausted = False
+			while True:
+				while not exhausted and len(pending) < window:
+					try:
+						item = next(items)
+					except StopIteration:
+						exhausted = True
+						break
+					pending[pool.submit(func, item)] = item
+				if not pending:
+					return
+				done, _ = wait(pending, return_when=FIRST_COMPLETED)
+				for future in done:
+					item = pending.pop(future)
+					err = future.exception()
+					yield item, (None if err else future.result()), err
+
+
+def scraper_fetcher(concurrency=1, rate=5.0, cache_dir=None, replay=False):
+	# the fetcher behind the scrapers' --concurrency/--rate/--cache/--replay flags
+	cache = PageCache(cache_dir) if cache_dir else None
+	if replay:
+		# nothing goes over the network, so don't throttle
+		rate = None
+	return Fetcher(concurrency=concurrency, rate=rate, cache=cache, replay=replay)
+
+
+# for callers that fetch the odd page (the web app's availability lookups).
+# set PAGE_CACHE_DIR to keep those pages too.
+_default_fetcher = None
+_default_lock = threading.Lock()
+
+def default_fetcher():
+	global _default_fetcher
+	if _default_fetcher is None:
+		with _default_lock:
+			if _default_fetcher is None:
+				cache_dir = os.environ.get('PAGE_CACHE_DIR')
+				cache = PageCache(cache_dir) if cache_dir else None
+				_default_fetcher = Fetcher(concurrency=8, rate=10.0, max_retries=1, cache=cache)
+	return _default_fetcher
+
+
+class Throughput:
+	# pages/sec reporting for long scrapes
+
+	def __init__(self, every=100):
+		self.every = every
+		self.start = time.perf_counter()
+		self.done = 0
+		self.failed = 0
+
+	def tick(self, ok=True):
+		self.done += 1
+		if not ok:
+			self.failed += 1
+		if self.done % self.every == 0:
+			logging.info('\t{}'.format(self.summary()))
+
+	def rate(self):
+		elapsed = time.perf_counter() - self.start
+		return self.done/elapsed if elapsed > 0 else 0.0
+
+	def summary(self):
+		return '{} pages ({} failed) in {:.1f}s, {:.2f} pages/sec'.format(
+			self.done, self.failed, time.perf_counter() - self.start, self.rate())
@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import hashlib
+import logging
+
+
+# memoized subject/genre heading normalization. the same few thousand heading strings repeat
+# across ~100k books, so each raw heading is normalized once and the resulting terms are kept
+# as integer ids into a shared, append-only term vocabulary. both are saved to a json file so
+# later runs (and the incremental refresh) start warm.
+#
+# the file records a fingerprint of the normalization rules. if the rules change (a new
+# misspelling or bad entry) the memoized headings are thrown away, but the vocabulary is kept:
+# a term's id never changes once it's been handed out.
+
+class HeadingVocab:
+
+	def __init__(self, normalize, rules, path=None):
+		# normalize(raw heading) -> iterable of terms. rules is anything json-serializable that
+		# determines normalize's output, used to tell when the memoized headings are stale
+		self.normalize = normalize
+		self.fingerprint = hashlib.sha256(json.dumps(rules, sort_keys=True).encode('utf-8')).hexdigest()
+		self.path = path
+		self.terms = list()
+		self.ids = dict()
+		self.headings = dict()
+		self.hits = 0
+		self.misses = 0
+		self.miss_seconds = 0.0
+		self.loaded_headings = 0
+		if path and os.path.exists(path):
+			self.load(path)
+
+	def load(self, path):
+		with open(path, encoding='utf-8') as f:
+			saved = json.load(f)
+		self.terms = list(saved['terms'])
+		self.ids = {term: i for i, term in enumerate(self.terms)}
+		if saved.get('fingerprint') == self.fingerprint:
+			self.headings = {raw: tuple(ids) for raw, ids in saved['headings'].items()}
+		else:
+			logging.info('normalization rules changed since {} was written, re-normalizing headings'.format(path))
+			self.headings = dict()
+		self.loaded_headings = len(self.headings)
+
+	def save(self, path=None):
+		path = path or self.path
+		if not path:
+			return
+		directory = os.path.dirname(path)
+		if directory:
+			os.makedirs(directory, exist_ok=True)
+		tmp_path = path + '.tmp'
+		with open(tmp_path, 'w', encoding='utf-8') as f:
+			json.dump({'fingerprint': self.fingerprint, 'terms': self.terms,
+				'headings': {raw: list(ids) for raw, ids in self.headings.items()}}, f, ensure_ascii=False)
+		os.replace(tmp_path, path)
+
+	def term_id(self, term):
+		term_id = self.ids.get(term)
+		if term_id is None:
+			term_id = len(self.terms)
+			self.terms.append(term)
+			self.ids[term] = term_id
+		return term_id
+
+	def heading_ids(self, raw):
+		# term ids for one raw heading
+		ids = self.headings.get(raw)
+		if ids is not None:
+			self.hits += 1
+			return ids
+		start = time.perf_counter()
+		ids = tuple(sorted({self.term_id(term) for term in self.normalize(raw)}))
+		self.miss_seconds += time.perf_counter() - start
+		self.misses += 1
+		self.headings[raw] = ids
+		return ids
+
+	def encode(self, headings):
+		# sorted term ids for a cell's list of raw headings
+		ids = set()
+		for raw in headings:
+			ids.update(self.heading_ids(raw))
+		return sorted(ids)
+
+	def decode(self, ids):
+		return [self.terms[i] for i in ids]
+
+	def hit_rate(self):
+		lookups = self.hits + self.misses
+		return self.hits/lookups if lookups else 0.0
+
+	def summary(self):
+		# time saved assumes a hit would have cost as much as the average miss
+		per_miss = self.miss_seconds/self.misses if self.misses else 0.0
+		return '{} heading lookups, {:.1%} hit rate, {} headings ({} loaded) -> {} terms, ~{:.2f}s saved'.format(
+			self.hits + self.misses, self.hit_rate(), len(self.headings), self.loaded_headings,
+			len(self.terms), self.hits * per_miss)
@@ -0,0 +1,77 @@
+import subprocess
+import sys
+import time
+import argparse
+
+
+# reports what importing a module costs, using python's -X importtime output.
+# e.g. `python import_report.py book_recommender` shows how much of gunicorn worker boot
+# goes into imports and which packages are responsible.
+
+def parse_importtime(stderr):
+	# (name, depth, self us, cumulative us) per line of -X importtime output, in output order:
+	# an import is printed after everything it imported
+	rows = list()
+	for line in stderr.splitlines():
+		# import time: self [us] | cumulative | imported package
+		if not line.startswith('import time:') or 'self [us]' in line:
+			continue
+		self_us, cumulative_us, name = line[len('import time:'):].split('|')
+		depth = (len(name) - len(name.lstrip()) - 1)//2
+		rows.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+	return rows
+
+def import_times(module):
+	start = time.perf_counter()
+	proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+		capture_output=True, text=True)
+	wall = time.perf_counter() - start
+	return parse_importtime(proc.stderr), wall, proc
+
+def module_breakdown(rows, module):
+	# (module's own row, the imports directly under it). a module that starts threads while it's
+	# being imported (book_recommender does) throws off the depths of everything after, so the
+	# module's line isn't necessarily at depth 0: find it by name and take its children relative
+	# to it. None for the row when the module never finished importing
+	for i in range(len(rows) - 1, -1, -1):
+		if rows[i][0] == module:
+			break
+	else:
+		return None, [r for r in rows if r[1] == 0]
+	target = rows[i]
+	children = list()
+	for row in reversed(rows[:i]):
+		if row[1] <= target[1]:
+			break
+		if row[1] == target[1] + 1:
+			children.append(row)
+	return target, children
+
+def report(module, top=15):
+	rows, wall, proc = import_times(module)
+	if proc.returncode != 0:
+		print(proc.stderr.splitlines()[-1] if proc.stderr else 'import failed')
+		print("importing {} failed, times below are partial".format(module))
+	target, children = module_breakdown(rows, module)
+	total_us = target[3] if target else sum(r[3] for r in children)
+	print("import {}: {:.1f} ms in imports, {:.1f} ms wall (including interpreter startup)".format(module, total_us/1000, wall*1000))
+	print("{:>12} {:>12}  {}".format('cumulative', 'self', 'package'))
+	for name, depth, self_us, cumulative_us in sorted(children, key=lambda r: -r[3])[:top]:
+		print("{:>9.1f} ms {:>9.1f} ms  {}".format(cumulative_us/1000, self_us/1000, name))
+	if target:
+		print("{:>9.1f} ms {:>9.1f} ms  {} (total, self is its own module body)".format(target[3]/1000, target[2]/1000, module))
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("modules", nargs='*', default=['book_recommender'],
+								help="modules to import, default = book_recommender")
+	parser.add_argument("--top", "-n", default=15, type=int,
+								help="how many of the most expensive imports directly under each module to list")
+	args = parser.parse_args()
+	for module in args.modules:
+		report(module, args.top)
+		print()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,202 @@
+import json
+import hashlib
+import logging
+import argparse
+import pandas as pd
+from sqlalchemy import text, bindparam, Text
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from postgres_interaction import get_engine, get_book_ids, has_table, prepare_book_ids, upsert_book_ids
+from fetch_engine import scraper_fetcher, Throughput
+from card_catalog_scraping import scrape_catalog
+from book_page_scraping import get_book_info_json, parse_book_page
+import bulk_load
+import data_cleaning
+
+
+# nightly refresh without a full re-crawl. the card catalog is diffed against book_ids to find
+# added and removed audiobooks, and every record keeps a hash of its catalogBibs payload in
+# record_hashes. only added records and records whose hash changed are cleaned and written to
+# book_features / related_books. with --cache, rechecking an unchanged page is a 304.
+
+record_hashes_ddl = """
+	CREATE TABLE IF NOT EXISTS record_hashes (
+		id_num text PRIMARY KEY,
+		content_hash text NOT NULL,
+		scraped_at timestamptz NOT NULL DEFAULT now()
+	)
+	"""
+
+stored_hashes_query = text("SELECT id_num, content_hash FROM record_hashes")
+
+upsert_hashes_query = text("""
+	INSERT INTO record_hashes (id_num, content_hash)
+	SELECT * FROM unnest(:ids, :hashes)
+	ON CONFLICT (id_num) DO UPDATE SET content_hash = excluded.content_hash, scraped_at = now()
+	""").bindparams(bindparam('ids', type_=ARRAY(Text)), bindparam('hashes', type_=ARRAY(Text)))
+
+# (table, key column) for every table a removed record is dropped from
+record_tables = [('book_ids', 'id_num'), ('book_features', 'id'), ('related_books', 'audioId'), ('record_hashes', 'id_num')]
+
+
+def record_hash(catalog_bib):
+	# stable digest of one catalogBibs entry: key order and whitespace don't count as changes
+	payload = json.dumps(catalog_bib, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+	return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def stored_hashes():
+	with get_engine().begin() as conn:
+		conn.execute(text(record_hashes_ddl))
+		return dict(conn.execute(stored_hashes_query).fetchall())
+
+def save_hashes(hashes):
+	if not hashes:
+		return
+	ids = list(hashes)
+	with get_engine().begin() as conn:
+		conn.execute(upsert_hashes_query, {'ids': ids, 'hashes': [hashes[i] for i in ids]})
+
+def catalog_diff(catalog, known_ids):
+	# (added, removed) ids between a fresh catalog scrape and the ids we already have
+	current = set(catalog.index)
+	known = set(known_ids)
+	return sorted(current - known), sorted(known - current)
+
+def fetch_changed(fetcher, book_ids, old_hashes):
+	# fetch each record page and keep the parsed frames only for records whose hash is new.
+	# returns (related frames, feature frames, {id: new hash}, failed ids)
+	related_list = list()
+	features_list = list()
+	new_hashes = dict()
+	failed = list()
+	progress = Throughput()
+
+	def fetch_one(book_id):
+		book_info = get_book_info_json(book_id, fetcher)
+		digest = record_hash(book_info['entities']['catalogBibs'][book_id])
+		if old_hashes.get(book_id) == digest:
+			return digest, None
+		return digest, parse_book_page(book_id, book_info)
+
+	for book_id, result, err in fetcher.map(fetch_one, book_ids):
+		if err is not None:
+			logging.warning("Unexpected {}, {} on book {}".format(err, type(err), book_id))
+			failed.append(book_id)
+			progress.tick(ok=False)
+			continue
+		digest, frames = result
+		if frames is not None:
+			rel, info = frames
+			related_list.append(rel)
+			features_list.append(info)
+			new_hashes[book_id] = digest
+		progress.tick()
+	logging.info('rechecked {} records: {}, {} changed'.format(len(book_ids), progress.summary(), len(new_hashes)))
+	return related_list, features_list, new_hashes, failed
+
+def load_changed(related_list, features_list, changed_ids):
+	features = data_cleaning.with_fields(pd.concat(features_list, ignore_index=True), data_cleaning.audio_fields)
+	bulk_load.replace_rows(data_cleaning.get_relevant_info_audio(features), 'book_features', 'id', changed_ids)
+	related = data_cleaning.with_fields(pd.concat(related_list, ignore_index=True), data_cleaning.related_fields)
+	bulk_load.replace_rows(data_cleaning.get_relevant_info_related(related), 'related_books', 'audioId', changed_ids)
+	data_cleaning.heading_vocab.save()
+	logging.info('headings: {}'.format(data_cleaning.heading_vocab.summary()))
+
+def remove_records(removed):
+	tables = [(table, key) for table, key in record_tables if has_table(table)]
+	with get_engine().begin() as conn:
+		for table, key in tables:
+			conn.execute(text("DELETE FROM {} WHERE {} = ANY(:ids)".format(bulk_load.quote_ident(table), bulk_load.quote_ident(key))),
+				{'ids': list(removed)})
+
+def refresh(fetcher, catalog_start=1, catalog_end=-1, recheck=True, baseline=False, dry_run=False, apply_removals=False):
+	catalog, failed_pages = scrape_catalog(catalog_start, catalog_end, fetcher)
+	if len(catalog) == 0:
+		logging.error('no catalog pages could be fetched ({} failed), aborting the refresh'.format(len(failed_pages)))
+		return {'catalog': 0, 'failed_pages': len(failed_pages), 'aborted': True}
+	known = get_book_ids(get_engine())['id_num']
+	added, missing = catalog_diff(catalog, known)
+	# a record is only removed when it's missing from a complete crawl and removals were asked
+	# for: a skipped or failed page looks exactly like its 25 records were deleted
+	removed = list()
+	if catalog_start != 1 or catalog_end >= 0:
+		reason = 'partial crawl'
+	elif failed_pages:
+		reason = '{} catalog pages failed'.format(len(failed_pages))
+	elif not apply_removals:
+		reason = 'no --apply-removals'
+	else:
+		reason = None
+		removed = missing
+	if missing and reason:
+		logging.warning('{} known records not seen in the catalog, not removing them: {}'.format(len(missing), reason))
+	logging.info('catalog: {} records, {} added, {} missing, {} to remove'.format(len(catalog), len(added), len(missing), len(removed)))
+
+	old_hashes = stored_hashes()
+	to_check = list(added)
+	if recheck:
+		gone = set(missing)
+		to_check += [book_id for book_id in known if book_id not in gone]
+	related_list, features_list, new_hashes, failed = fetch_changed(fetcher, to_check, old_hashes)
+	changed = sorted(new_hashes)
+	summary = {'catalog': len(catalog), 'failed_pages': len(failed_pages), 'added': len(added),
+		'missing': len(missing), 'removed': len(removed),
+		'checked': len(to_check), 'changed': len(changed), 'failed': len(failed)}
+	if dry_run:
+		return summary
+
+	if baseline:
+		# first run: remember what the records look like now without rewriting any tables
+		save_hashes(new_hashes)
+		return summary
+	if added:
+		prepare_book_ids()
+		upsert_book_ids(catalog.loc[added].rename_axis('id_num').reset_index().to_dict('records'))
+	if changed:
+		load_changed(related_list, features_list, changed)
+		save_hashes(new_hashes)
+	if removed:
+		remove_records(removed)
+	return summary
+
+
+def main():
+	parser = argparse.ArgumentParser(description="re-scrape and reload only the records that changed since the last refresh")
+	parser.add_argument("--catalog-start", type=int, default=1,
+								help="first card catalog result page, default = 1")
+	parser.add_argument("--catalog-end", type=int, default=-1,
+								help="card catalog result page to stop at, default = the last one. removals are only applied for a full crawl")
+	parser.add_argument("--new-only", action="store_true",
+								help="only scrape records that are new to the catalog, don't recheck known ones")
+	parser.add_argument("--baseline", action="store_true",
+								help="record the current hashes without loading anything (run once before the first refresh)")
+	parser.add_argument("--apply-removals", action="store_true",
+								help="delete records that are gone from the catalog. only applied after a full crawl with no failed pages")
+	parser.add_argument("--dry-run", action="store_true",
+								help="report what would change without writing anything")
+	parser.add_argument("--concurrency", "-c", type=int, default=1,
+								help="how many pages to fetch at once, default = 1")
+	parser.add_argument("--rate", "-r", type=float, default=5.0,
+								help="max requests per second across all workers, default = 5")
+	parser.add_argument("--cache", default=None,
+								help="directory to keep raw pages in, rechecks become conditional requests")
+	parser.add_argument("--replay", action="store_true",
+								help="parse pages from --cache only, without touching the network")
+	args = parser.parse_args()
+	logfile = 'logs/incremental_refresh.log'
+	logging.basicConfig(filename=logfile,
+								level=logging.INFO,
+								format = '%(asctime)s %(message)s'
+								)
+
+	fetcher = scraper_fetcher(args.concurrency, args.rate, args.cache, args.replay)
+	summary = refresh(fetcher, args.catalog_start, args.catalog_end, not args.new_only, args.baseline, args.dry_run,
+		args.apply_removals)
+	print(", ".join("{} {}".format(k, v) for k, v in summary.items()))
+	logging.info("refresh: {}".format(summary))
+	logging.info("done")
+	logging.info("-------------------")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,131 @@
+import bisect
+import heapq
+import threading
+import time
+import logging
+from functools import wraps
+
+from flask import request, has_request_context
+
+
+# lightweight request instrumentation. every timed call is one perf_counter pair and a
+# locked bucket increment, so it is cheap enough to leave on.
+# numbers are per process: with several gunicorn workers each one reports its own.
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+
+	def __init__(self, buckets=default_buckets):
+		self.buckets = buckets
+		self.counts = [0]*(len(buckets)+1) # last slot is +Inf
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, value):
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.sum += value
+		self.count += 1
+
+
+class Metrics:
+
+	def __init__(self, slow_threshold=1.0, keep_slowest=20):
+		self.slow_threshold = slow_threshold
+		self.keep_slowest = keep_slowest
+		self.histograms = dict() # (name, labels) -> Histogram
+		self.slowest = list() # min-heap of (seconds, time, method, path, phases)
+		self.gauges = list() # callables returning {(name, labels): value}
+		self._lock = threading.Lock()
+
+	def observe(self, name, labels, value):
+		key = (name, tuple(sorted(labels.items())))
+		with self._lock:
+			hist = self.histograms.get(key)
+			if hist is None:
+				hist = self.histograms[key] = Histogram()
+			hist.observe(value)
+
+	def timed(self, phase, op=None):
+		# decorator: time the call as part of phase ('db', 'scrape', 'render'), and add it to the
+		# current request's breakdown when there is one
+		def decorator(func):
+			name = op or func.__name__
+			@wraps(func)
+			def wrapper(*args, **kwargs):
+				start = time.perf_counter()
+				try:
+					return func(*args, **kwargs)
+				finally:
+					elapsed = time.perf_counter() - start
+					self.observe('bookrec_call_seconds', {'phase': phase, 'op': name}, elapsed)
+					if has_request_context():
+						phases = request.environ.get('metrics.phases')
+						if phases is not None:
+							phases.append((phase, elapsed))
+			return wrapper
+		return decorator
+
+	def start_request(self):
+		request.environ['metrics.start'] = time.perf_counter()
+		request.environ['metrics.phases'] = list()
+
+	def finish_request(self, response):
+		start = request.environ.get('metrics.start')
+		if start is None:
+			return response
+		elapsed = time.perf_counter() - start
+		endpoint = request.endpoint or 'unknown'
+		phases = dict()
+		for phase, seconds in request.environ['metrics.phases']:
+			phases[phase] = phases.get(phase, 0.0) + seconds
+		self.observe('bookrec_request_seconds', {'endpoint': endpoint}, elapsed)
+		for phase, seconds in phases.items():
+			self.observe('bookrec_request_phase_seconds', {'endpoint': endpoint, 'phase': phase}, seconds)
+		if elapsed >= self.slow_threshold:
+			logging.warning("slow request: {} {} took {:.3f}s ({})".format(request.method, request.path, elapsed,
+				", ".join("{} {:.3f}s".format(k, v) for k, v in sorted(phases.items()))))
+			entry = (elapsed, time.time(), request.method, request.path, phases)
+			with self._lock:
+				if len(self.slowest) < self.keep_slowest:
+					heapq.heappush(self.slowest, entry)
+				elif elapsed > self.slowest[0][0]:
+					heapq.heapreplace(self.slowest, entry)
+		return response
+
+	def init_app(self, app):
+		app.before_request(self.start_request)
+		app.after_request(self.finish_request)
+
+	def slow_requests(self):
+		with self._lock:
+			slowest = sorted(self.slowest, reverse=True)
+		return [{'seconds': s, 'at': at, 'method': method, 'path': path, 'phases': phases}
+			for s, at, method, path, phases in slowest]
+
+	def render(self):
+		# prometheus text exposition format
+		lines = list()
+		with self._lock:
+			items = sorted((key, hist.buckets, list(hist.counts), hist.sum, hist.count) for key, hist in self.histograms.items())
+		typed = set()
+		for (name, labels), buckets, counts, total, count in items:
+			if name not in typed:
+				lines.append('# TYPE {} histogram'.format(name))
+				typed.add(name)
+			label_str = ",".join('{}="{}"'.format(k, v) for k, v in labels)
+			prefix = label_str + "," if label_str else ""
+			cumulative = 0
+			for bound, n in zip(list(buckets) + ['+Inf'], counts):
+				cumulative += n
+				lines.append('{}_bucket{{{}le="{}"}} {}'.format(name, prefix, bound, cumulative))
+			lines.append('{}_sum{{{}}} {}'.format(name, label_str, total))
+			lines.append('{}_count{{{}}} {}'.format(name, label_str, count))
+		for gauge in self.gauges:
+			for (name, labels), value in sorted(gauge().items()):
+				if name not in typed:
+					lines.append('# TYPE {} gauge'.format(name))
+					typed.add(name)
+				label_str = ",".join('{}="{}"'.format(k, v) for k, v in labels)
+				lines.append('{}{{{}}} {}'.format(name, label_str, value))
+		return "\n".join(lines) + "\n"
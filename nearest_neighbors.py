@@ -15,6 +15,7 @@ from sklearn.neighbors import NearestNeighbors
 
 # my stuff
 from data_cleaning import combine_col_lists, populate_field
+from neighbor_artifact import write_artifact
 
 
 
@@ -161,7 +162,7 @@ class DictEncoder(BaseEstimator, TransformerMixin):
             return X.apply(features_list_to_dict)
 	
 
-def do_ml(X, num_neighbors = 25, neighbors_loc='neighbors.pkl.tar.gz', dists_loc='dists.pkl.tar.gz'):
+def do_ml(X, num_neighbors = 25, neighbors_loc='neighbors.pkl.tar.gz', dists_loc='dists.pkl.tar.gz', artifact_loc=None):
 	encode_and_vectorize = Pipeline([('encode', DictEncoder()), ('vectorize', DictVectorizer())])
 
 	ct = ColumnTransformer([("enc_and_vect_contr", encode_and_vectorize, 'parsed_contributors'),
@@ -189,6 +190,10 @@ def do_ml(X, num_neighbors = 25, neighbors_loc='neighbors.pkl.tar.gz', dists_loc
 	neighbor_table = neighbor_table_raw.applymap(get_sc_num)
 	neighbor_table.to_pickle(neighbors_loc)
 	
+	# binary copy the web app can mmap (see neighbor_artifact.py)
+	if artifact_loc:
+		write_artifact(artifact_loc, X.index, neighbors, distances)
+	
 
 def parse_join(args):
 	audio = pd.read_pickle(args.audio)
@@ -200,10 +205,12 @@ def parse_join(args):
 def parse_find_neighbors(args):
 	joined = pd.read_pickle(args.input)
 	X = prepare_for_ml(joined)
-	do_ml(X, num_neighbors= args.num, neighbors_loc = args.nout, dists_loc = args.dout)
+	do_ml(X, num_neighbors= args.num, neighbors_loc = args.nout, dists_loc = args.dout, artifact_loc = args.aout)
 	print("Done.")
 	print("neighbors saved at {}".format(args.nout))
 	print("distances saved at {}".format(args.dout))
+	if args.aout:
+		print("neighbor artifact saved at {}".format(args.aout))
 
 
 def main():
@@ -221,6 +228,7 @@ def main():
 	find_neighbors.add_argument('--input', '-i', default = 'datasets/joined.pkl.tar.gz', help = 'where we\'re reading the joined table from')
 	find_neighbors.add_argument('--nout', default= "datasets/neighbors.pkl.tar.gz", help = 'where we\'re saving the neighbor table')
 	find_neighbors.add_argument('--dout', default= "datasets/dists.pkl.tar.gz", help = 'where we\'re saving the distances table')
+	find_neighbors.add_argument('--aout', default= "datasets/neighbors.bin", help = 'where we\'re saving the mmap-able neighbor artifact (empty string to skip)')
 	find_neighbors.set_defaults(func=parse_find_neighbors)
 	
 	args = parser.parse_args()
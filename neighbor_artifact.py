@@ -0,0 +1,157 @@
+import os
+import mmap
+import struct
+import time
+import threading
+import logging
+
+
+# compact binary copy of the nearest-neighbor model output, written by nearest_neighbors.do_ml.
+# the web app mmaps it read-only, so every gunicorn worker shares one copy through the page cache
+# and a neighbor lookup is a binary search plus a slice, no database involved.
+#
+# layout (little endian):
+#   header    magic 'NBRS', format version (uint32), build version (uint64), n, k, id width (uint32)
+#   ids       n fixed-width, NUL-padded ascii ids, sorted, so row i belongs to the i-th smallest id
+#   neighbors n*k int32 row numbers, column 0 is the book itself
+#   distances n*k float32
+# sections start on 8 byte boundaries.
+
+magic = b'NBRS'
+format_version = 1
+header_format = '<4sIQIII'
+header_size = 32
+
+def _align(offset):
+	return (offset + 7) & ~7
+
+def write_artifact(path, ids, neighbors, distances, build_version=None):
+	# ids: row labels (e.g. X.index); neighbors: (n, k) row numbers; distances: (n, k) floats
+	import numpy as np
+	ids = np.asarray(ids).astype('S')
+	neighbors = np.asarray(neighbors)
+	distances = np.asarray(distances)
+	n, k = neighbors.shape
+	order = np.argsort(ids, kind='stable')
+	new_row = np.empty(n, dtype=np.int64)
+	new_row[order] = np.arange(n)
+	sorted_ids = ids[order]
+	sorted_neighbors = new_row[neighbors[order]].astype('<i4')
+	sorted_distances = distances[order].astype('<f4')
+	if build_version is None:
+		build_version = time.time_ns()
+	id_width = sorted_ids.dtype.itemsize
+
+	# write next to the target and rename over it, so readers never see a half-written file
+	tmp_path = path + '.tmp'
+	with open(tmp_path, 'wb') as f:
+		f.write(struct.pack(header_format, magic, format_version, build_version, n, k, id_width).ljust(header_size, b'\0'))
+		f.write(sorted_ids.tobytes())
+		f.write(b'\0' * (_align(f.tell()) - f.tell()))
+		f.write(sorted_neighbors.tobytes())
+		f.write(b'\0' * (_align(f.tell()) - f.tell()))
+		f.write(sorted_distances.tobytes())
+	os.replace(tmp_path, path)
+	return build_version
+
+
+class NeighborArtifact:
+
+	def __init__(self, path):
+		with open(path, 'rb') as f:
+			self.stat = os.fstat(f.fileno())
+			self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		if len(self.mm) < header_size:
+			self.mm.close()
+			raise ValueError("{} is too short for a neighbor artifact header".format(path))
+		file_magic, version, self.build_version, self.n, self.k, self.id_width = struct.unpack_from(header_format, self.mm)
+		if file_magic != magic or version != format_version:
+			self.mm.close()
+			raise ValueError("{} is not a version {} neighbor artifact".format(path, format_version))
+		self.ids_offset = header_size
+		neighbors_offset = _align(self.ids_offset + self.n*self.id_width)
+		distances_offset = _align(neighbors_offset + self.n*self.k*4)
+		# a truncated file would otherwise give short slices and lookups past their end
+		expected_size = distances_offset + self.n*self.k*4
+		if len(self.mm) < expected_size:
+			self.mm.close()
+			raise ValueError("{} is {} bytes, its header (n={}, k={}, id width={}) needs {}".format(
+				path, len(self.mm), self.n, self.k, self.id_width, expected_size))
+		buf = memoryview(self.mm)
+		self.neighbors = buf[neighbors_offset:neighbors_offset + self.n*self.k*4].cast('i')
+		self.distances = buf[distances_offset:distances_offset + self.n*self.k*4].cast('f')
+
+	def _id(self, row):
+		start = self.ids_offset + row*self.id_width
+		return self.mm[start:start + self.id_width]
+
+	def row_of(self, book_id):
+		try:
+			key = book_id.encode('ascii').ljust(self.id_width, b'\0')
+		except UnicodeEncodeError:
+			# ids are ascii, so this one can't be in the file
+			return None
+		if len(key) > self.id_width:
+			return None
+		lo, hi = 0, self.n
+		while lo < hi:
+			mid = (lo + hi)//2
+			if self._id(mid) < key:
+				lo = mid + 1
+			else:
+				hi = mid
+		if lo < self.n and self._id(lo) == key:
+			return lo
+		return None
+
+	def lookup(self, book_id, num_neighbors=None):
+		# [(neighbor_id, distance), ...] in rank order, leaving out the book itself.
+		# None if the book isn't in the artifact.
+		row = self.row_of(book_id)
+		if row is None:
+			return None
+		if num_neighbors is None or num_neighbors > self.k - 1:
+			num_neighbors = self.k - 1
+		start = row*self.k
+		result = list()
+		for rank in range(1, num_neighbors + 1):
+			neighbor_row = self.neighbors[start + rank]
+			result.append((self._id(neighbor_row).rstrip(b'\0').decode('ascii'), self.distances[start + rank]))
+		return result
+
+
+# keeps the current artifact open and picks up a replaced file (new inode or mtime) within
+# check_interval seconds. a file that fails the version check is ignored and the old one stays.
+class ArtifactHandle:
+
+	def __init__(self, path, check_interval=30):
+		self.path = path
+		self.check_interval = check_interval
+		self.artifact = NeighborArtifact(path)
+		self._last_check = time.monotonic()
+		self._lock = threading.Lock()
+
+	def _maybe_reload(self):
+		now = time.monotonic()
+		if now - self._last_check < self.check_interval:
+			return
+		with self._lock:
+			if now - self._last_check < self.check_interval:
+				return
+			self._last_check = now
+			try:
+				st = os.stat(self.path)
+				current = self.artifact.stat
+				if (st.st_ino, st.st_mtime_ns) == (current.st_ino, current.st_mtime_ns):
+					return
+				artifact = NeighborArtifact(self.path)
+			except (OSError, ValueError) as err:
+				logging.warning("Unexpected {}, {} reloading neighbor artifact {}".format(err, type(err), self.path))
+				return
+			# the old mmap is left for the garbage collector, other threads may still be reading it
+			logging.info("switching neighbor artifact from build {} to {}".format(self.artifact.build_version, artifact.build_version))
+			self.artifact = artifact
+
+	def lookup(self, book_id, num_neighbors=None):
+		self._maybe_reload()
+		return self.artifact.lookup(book_id, num_neighbors)
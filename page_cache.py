@@ -0,0 +1,113 @@
+import os
+import gzip
+import hashlib
+import sqlite3
+import threading
+import time
+
+
+# on-disk store of raw scraped pages, so parsers can be re-run without re-scraping.
+# bodies are gzipped and stored once per sha256 of their content under objects/; index.sqlite
+# records every fetch (url, time, status, digest, etag, last-modified) so the same url can
+# have many fetches pointing at one body.
+
+class CacheMiss(LookupError):
+	pass
+
+
+# just enough of requests.Response for the scrapers to parse a cached page
+class CachedResponse:
+
+	def __init__(self, url, status_code, content, headers=None):
+		self.url = url
+		self.status_code = status_code
+		self.content = content
+		self.headers = headers or dict()
+
+	@property
+	def text(self):
+		return self.content.decode('utf-8', errors='replace')
+
+	def raise_for_status(self):
+		if self.status_code >= 400:
+			import requests
+			raise requests.HTTPError("{} for {}".format(self.status_code, self.url), response=self)
+
+
+class PageCache:
+
+	def __init__(self, root):
+		self.root = root
+		os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+		self._lock = threading.Lock()
+		self.db = sqlite3.connect(os.path.join(root, 'index.sqlite'), check_same_thread=False)
+		with self._lock:
+			self.db.execute("PRAGMA journal_mode=WAL")
+			self.db.execute("""CREATE TABLE IF NOT EXISTS fetches (
+				url TEXT NOT NULL,
+				fetched_at REAL NOT NULL,
+				status INTEGER NOT NULL,
+				digest TEXT NOT NULL,
+				etag TEXT,
+				last_modified TEXT
+				)""")
+			self.db.execute("CREATE INDEX IF NOT EXISTS fetches_url_idx ON fetches (url, fetched_at)")
+			self.db.commit()
+
+	def _object_path(self, digest):
+		return os.path.join(self.root, 'objects', digest[:2], digest + '.gz')
+
+	def put_body(self, content):
+		digest = hashlib.sha256(content).hexdigest()
+		path = self._object_path(digest)
+		if not os.path.exists(path):
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+			with open(tmp_path, 'wb') as f:
+				f.write(gzip.compress(content))
+			os.replace(tmp_path, path)
+		return digest
+
+	def get_body(self, digest):
+		with open(self._object_path(digest), 'rb') as f:
+			return gzip.decompress(f.read())
+
+	def record(self, url, status, digest, etag=None, last_modified=None, fetched_at=None):
+		with self._lock:
+			self.db.execute("INSERT INTO fetches VALUES (?, ?, ?, ?, ?, ?)",
+				(url, fetched_at or time.time(), status, digest, etag, last_modified))
+			self.db.commit()
+
+	def store(self, url, resp):
+		digest = self.put_body(resp.content)
+		self.record(url, resp.status_code, digest, resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+		return digest
+
+	def latest(self, url):
+		# (fetched_at, status, digest, etag, last_modified) of the newest fetch of url, or None
+		with self._lock:
+			return self.db.execute("""SELECT fetched_at, status, digest, etag, last_modified FROM fetches
+				WHERE url = ? ORDER BY fetched_at DESC LIMIT 1""", (url,)).fetchone()
+
+	def conditional_headers(self, url):
+		# If-None-Match / If-Modified-Since from the last successful fetch of url
+		entry = self.latest(url)
+		headers = dict()
+		if entry is not None and entry[1] == 200:
+			if entry[3]:
+				headers['If-None-Match'] = entry[3]
+			if entry[4]:
+				headers['If-Modified-Since'] = entry[4]
+		return headers
+
+	def response(self, url):
+		# the newest cached copy of url as a response object
+		entry = self.latest(url)
+		if entry is None:
+			raise CacheMiss(url)
+		fetched_at, status, digest, etag, last_modified = entry
+		return CachedResponse(url, status, self.get_body(digest), {'ETag': etag, 'Last-Modified': last_modified})
+
+	def urls(self):
+		with self._lock:
+			return [row[0] for row in self.db.execute("SELECT DISTINCT url FROM fetches")]
@@ -0,0 +1,119 @@
+import os
+import re
+import json
+import time
+import glob
+import argparse
+
+
+# bibliocommons pages carry everything the scrapers want as json in
+# <script type="application/json" data-iso-key="_0">. building a BeautifulSoup tree of the whole
+# page just to find that one tag is the scrapers' CPU hot spot, so slice the payload out of the
+# raw bytes instead and only fall back to BeautifulSoup when the markup doesn't look as expected.
+
+iso_script_pattern = re.compile(rb'<script\b([^>]*?\bdata-iso-key\s*=\s*["\']?_0(?![\w-])[^>]*)>', re.IGNORECASE)
+json_type_pattern = re.compile(rb'\btype\s*=\s*["\']?application/json', re.IGNORECASE)
+script_end_pattern = re.compile(rb'</script\s*>', re.IGNORECASE)
+
+def _as_bytes(content):
+	if isinstance(content, str):
+		return content.encode('utf-8')
+	return content
+
+def fast_iso_json(content):
+	# the parsed payload, or None when the tag can't be found by slicing
+	content = _as_bytes(content)
+	for match in iso_script_pattern.finditer(content):
+		if not json_type_pattern.search(match.group(1)):
+			continue
+		end = script_end_pattern.search(content, match.end())
+		if end is None:
+			return None
+		try:
+			return json.loads(content[match.end():end.start()])
+		except ValueError:
+			return None
+	return None
+
+def soup_iso_json(content):
+	from bs4 import BeautifulSoup
+	soup = BeautifulSoup(content, "html.parser")
+	book_info_json = soup.find('script', attrs={'type':'application/json',
+											'data-iso-key':'_0'
+									})
+	if book_info_json is None:
+		raise ValueError('no data-iso-key="_0" script on page')
+	return json.loads(book_info_json.text)
+
+def extract_iso_json(content):
+	book_info = fast_iso_json(content)
+	if book_info is None:
+		book_info = soup_iso_json(content)
+	return book_info
+
+
+def saved_pages(source):
+	# raw page bodies from a page_cache.PageCache directory or a directory of saved .html files
+	if os.path.exists(os.path.join(source, 'index.sqlite')):
+		from page_cache import PageCache
+		cache = PageCache(source)
+		return [cache.response(url).content for url in cache.urls()]
+	pages = list()
+	for path in sorted(glob.glob(os.path.join(source, '*.html'))):
+		with open(path, 'rb') as f:
+			pages.append(f.read())
+	return pages
+
+def time_pages(extract, pages, repeat):
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		for page in pages:
+			extract(page)
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best
+
+def main():
+	parser = argparse.ArgumentParser(description="benchmark data-iso-key json extraction over saved pages")
+	parser.add_argument("source",
+								help="page cache directory or directory of .html files")
+	parser.add_argument("--repeat", type=int, default=3,
+								help="timing runs per extractor, the best is reported, default = 3")
+	args = parser.parse_args()
+
+	pages = saved_pages(args.source)
+	if not pages:
+		print("no pages found in {}".format(args.source))
+		return
+	# pages without a data-iso-key="_0" payload (error pages, captchas) are counted and left out
+	fallbacks = 0
+	failures = 0
+	usable = list()
+	for page in pages:
+		try:
+			expected = soup_iso_json(page)
+		except ValueError:
+			failures += 1
+			continue
+		fast = fast_iso_json(page)
+		if fast is None:
+			fallbacks += 1
+		elif fast != expected:
+			raise AssertionError("fast and BeautifulSoup extraction disagree")
+		usable.append(page)
+	mb = sum(len(page) for page in usable)/1e6
+	print("{} pages, {:.1f} MB, {} need the BeautifulSoup fallback, {} without a payload skipped".format(
+		len(usable), mb, fallbacks, failures))
+	if not usable:
+		return
+	pages = usable
+	timings = [('beautifulsoup', time_pages(soup_iso_json, pages, args.repeat)),
+				('sliced', time_pages(extract_iso_json, pages, args.repeat))]
+	for name, seconds in timings:
+		print("{:>14} {:8.3f}s {:10.1f} pages/sec".format(name, seconds, len(pages)/seconds))
+	print("speedup {:.1f}x".format(timings[0][1]/timings[1][1]))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,174 @@
+import re
+import logging
+import numpy as np
+import pandas as pd
+
+try:
+	import spacy
+except ImportError:
+	spacy = None
+
+
+# performer names from the CONTRIBUTOR_PERFORMERS strings ("Read by Scott Brick.", "Narrated by
+# Kate Reading and Michael Kramer"). most of them follow a handful of patterns (see get_intros
+# in data_cleaning), so a strict rule-based parser handles those and only the leftovers go
+# through spaCy's NER, in batches with nlp.pipe. every distinct string is parsed once.
+# without spaCy (or its model) the leftovers get a looser rule-based pass instead.
+
+# "read by", "narrated by", "read and performed by", "with ... read by"...
+intro_pattern = re.compile(r'^(?:[A-Za-z]+[ ,]+){0,5}?by\s+', re.I)
+name_separator_pattern = re.compile(r',\s*and\s+|\s*,\s*|\s+and\s+|\s*&\s*|\s*;\s*')
+# a trailing "Unabridged." / "Abridged." sentence isn't part of the names
+abridged_pattern = re.compile(r'[.\s]*\b(?:un)?abridged\.?\s*$', re.I)
+initials_pattern = re.compile(r'^(?:[A-Z]\.)+$')
+name_word = r"(?:(?:[A-Z]\.){1,3}|[A-Z][A-Za-z'’\-]*\.?)"
+name_particles = {'de', 'del', 'della', 'da', 'di', 'du', 'la', 'le', 'van', 'von', 'der', 'den', 'st.'}
+name_pattern = re.compile(
+	r"^{word}(?:\s+(?:{word}|{particles}))*\s+{word}$".format(word=name_word,
+		particles='|'.join(re.escape(p) for p in sorted(name_particles))))
+parenthetical_pattern = re.compile(r'\([^)]*\)?')
+# capitalized words that turn up in performer strings but aren't names: credits, and the
+# publishers and studios that get listed alongside the readers
+not_name_words = {'the', 'a', 'an', 'full', 'cast', 'author', 'authors', 'various', 'others', 'unabridged',
+	'abridged', 'narrator', 'narrators', 'read', 'by', 'with', 'introduction', 'music', 'performed',
+	'narrated', 'featuring', 'audio', 'productions', 'production', 'company', 'theatre', 'theater', 'bbc',
+	'recorded', 'recording', 'recordings', 'books', 'book', 'inc', 'llc', 'ltd', 'corp', 'corporation',
+	'media', 'publishing', 'publishers', 'press', 'random', 'house', 'penguin', 'audible', 'studio',
+	'studios', 'entertainment', 'group', 'blackstone', 'brilliance', 'tantor', 'highbridge', 'macmillan',
+	'hachette', 'harpercollins', 'overdrive', 'podium', 'dreamscape', 'naxos', 'radio', 'drama'}
+# more words than this in one name part is usually two names run together ("Mary McDonnell
+# Dennis Boutsikaris"); initials and particles don't count towards the full words
+max_name_tokens = 4
+max_full_words = 3
+
+
+def _split_names(text):
+	# the names part of a performer string, split into candidate names
+	text = abridged_pattern.sub('', text.strip())
+	if text.endswith('.') and not re.search(r'\b[A-Z]\.$', text):
+		text = text[:-1]
+	match = intro_pattern.match(text)
+	if match:
+		text = text[match.end():]
+	return [part.strip() for part in name_separator_pattern.split(text) if part.strip()]
+
+def _is_name(candidate):
+	if not name_pattern.match(candidate):
+		return False
+	return not any(word.lower().strip('.') in not_name_words for word in candidate.split())
+
+def _is_plain_name(candidate):
+	# a name the fast path can take without asking NER
+	if not _is_name(candidate):
+		return False
+	tokens = candidate.split()
+	full_words = [t for t in tokens if t not in name_particles and not initials_pattern.match(t)]
+	return len(tokens) <= max_name_tokens and len(full_words) <= max_full_words
+
+def rule_performers(perf):
+	# names for strings that are nothing but an optional intro and a list of names, otherwise
+	# None so the string goes to NER. roles ("as Hamlet") and parentheticals always go to NER
+	if '(' in perf or ' as ' in perf or any(c.isdigit() for c in perf):
+		return None
+	names = _split_names(perf)
+	if not names or not all(_is_plain_name(name) for name in names):
+		return None
+	return names
+
+def loose_performers(perf):
+	# best effort without NER: drop parentheticals and roles, keep whatever looks like a name
+	names = list()
+	for part in _split_names(parenthetical_pattern.sub('', perf)):
+		part = part.split(' as ')[0].strip()
+		if _is_name(part):
+			names.append(part)
+	return names
+
+def ner_performers(perf, doc):
+	# PERSON entities, skipping the ones introduced by "as" or inside parentheses (character names)
+	perfs = list()
+	for ent in doc.ents:
+		if ent.label_ == 'PERSON':
+			before_char = ''
+			before_word = ''
+			if ent.start_char > 0:
+				before_char = perf[ent.start_char-1]
+			if ent.start_char >= 3:
+				before_word = perf[ent.start_char-3:ent.start_char-1].lower()
+			if before_word != 'as' and before_char != '(':
+				perfs.append(ent.text)
+	return perfs
+
+
+class PerformerParser:
+
+	def __init__(self, model='en_core_web_sm', n_process=1, batch_size=256):
+		self.model = model
+		self.n_process = n_process
+		self.batch_size = batch_size
+		self.cache = dict()
+		self.counts = {'cached': 0, 'rules': 0, 'ner': 0, 'loose': 0}
+		self._nlp = None
+		self._nlp_loaded = False
+
+	def nlp(self):
+		# the spaCy pipeline, loaded on first use. None if spaCy or the model isn't installed
+		if not self._nlp_loaded:
+			self._nlp_loaded = True
+			if spacy is None:
+				logging.warning("spacy isn't installed, parsing performers with rules only")
+			else:
+				try:
+					self._nlp = spacy.load(self.model, disable=['parser', 'lemmatizer'])
+				except OSError as err:
+					logging.warning("couldn't load spacy model {}, parsing performers with rules only: {}".format(self.model, err))
+		return self._nlp
+
+	def parse_strings(self, strings):
+		# fill the cache for every string not already in it
+		todo = list()
+		for perf in dict.fromkeys(strings):
+			if perf in self.cache:
+				self.counts['cached'] += 1
+				continue
+			names = rule_performers(perf)
+			if names is None:
+				todo.append(perf)
+			else:
+				self.cache[perf] = names
+				self.counts['rules'] += 1
+		if not todo:
+			return
+		nlp = self.nlp()
+		if nlp is None:
+			for perf in todo:
+				self.cache[perf] = loose_performers(perf)
+			self.counts['loose'] += len(todo)
+			return
+		docs = nlp.pipe(todo, n_process=self.n_process, batch_size=self.batch_size)
+		for perf, doc in zip(todo, docs):
+			self.cache[perf] = ner_performers(perf, doc)
+		self.counts['ner'] += len(todo)
+
+	def _names(self, perf_list):
+		perfs = set()
+		for perf in perf_list:
+			perfs.update(self.cache[perf])
+		return sorted(perfs)
+
+	def parse_cell(self, perf_list):
+		if not pd.api.types.is_list_like(perf_list):
+			return np.nan
+		self.parse_strings(perf_list)
+		return self._names(perf_list)
+
+	def parse_column(self, col):
+		# parse_cell over a whole column, with all of its uncached strings sent to NER in one go
+		cells = [cell if pd.api.types.is_list_like(cell) else None for cell in col]
+		self.parse_strings(perf for cell in cells if cell is not None for perf in cell)
+		return pd.Series([np.nan if cell is None else self._names(cell) for cell in cells],
+			index=col.index, name=col.name, dtype=object)
+
+	def summary(self):
+		return '{} distinct performer strings: {} by rules, {} by NER, {} by loose rules, {} already cached'.format(
+			len(self.cache), self.counts['rules'], self.counts['ner'], self.counts['loose'], self.counts['cached'])
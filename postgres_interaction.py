@@ -1,76 +1,298 @@
 import sqlalchemy as db
 from sqlalchemy import text, MetaData
-import pandas as pd
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
 import os
 import logging
 import argparse
 import sys
+import re
+import threading
+import time
+import json
+import base64
 
 
-def get_neighbors_info(nearest):
-	nearest_tuple = tuple(nearest)
-	table = metadata_obj.tables['book_features']
-	sc_num = table.c['id']
-	icon_url = table.c['jacket.small']
-	title = table.c['title']
-	subtitle = table.c['subtitle']
-	author = table.c['author']
-	performers = table.c['performers']
-	query = db.select(sc_num, icon_url, title, subtitle, author, performers).where(text("id IN {id_tuple}".format(id_tuple=nearest_tuple)))
-	with engine.connect() as conn:
-		result = conn.execute(query)
+# the neighbors table is wide: column '0' is the book itself, '1'..'24' are its neighbors in order.
+# unnest that row WITH ORDINALITY so the join against book_features keeps the neighbor rank.
+max_neighbors = 24
+neighbors_ranked_query = text("""
+	SELECT b.id, b."jacket.small", b.title, b.subtitle, b.author, b.performers, nb.rank
+	FROM neighbors n
+	CROSS JOIN LATERAL unnest(ARRAY[{cols}]) WITH ORDINALITY AS nb(neighbor_id, rank)
+	JOIN book_features b ON b.id = nb.neighbor_id
+	WHERE n.id = :sc_num AND nb.rank <= :num_neighbors
+	ORDER BY nb.rank
+	""".format(cols=", ".join('n."{}"'.format(i) for i in range(1, max_neighbors+1))))
+
+# long format version of the neighbors table: one row per (book, rank).
+# the primary key covers forward lookups (top-k of a book) with an index-only scan,
+# the second index covers reverse lookups (which books list X as a neighbor).
+# rank 0 is the book itself, same as column '0' of the wide table.
+neighbor_ranks_table = 'neighbor_ranks'
+neighbor_ranks_query = text("""
+	SELECT b.id, b."jacket.small", b.title, b.subtitle, b.author, b.performers, r.rank, r.distance
+	FROM neighbor_ranks r
+	JOIN book_features b ON b.id = r.neighbor_id
+	WHERE r.id = :sc_num AND r.rank BETWEEN 1 AND :num_neighbors
+	ORDER BY r.rank
+	""")
+
+referrers_query = text("""
+	SELECT r.id, r.rank, r.distance
+	FROM neighbor_ranks r
+	WHERE r.neighbor_id = :sc_num AND r.rank BETWEEN 1 AND :max_rank
+	ORDER BY r.rank, r.distance
+	""")
+
+def get_neighbors_ranked(sc_num, num_neighbors=max_neighbors):
+	# a book's neighbors and their display fields in a single round trip
+	if has_table(neighbor_ranks_table):
+		query = neighbor_ranks_query
+	else:
+		# not migrated yet, so no distances
+		query = neighbors_ranked_query
+	with get_engine().connect() as conn:
+		result = conn.execute(query, {'sc_num': sc_num, 'num_neighbors': num_neighbors})
 		conn.commit()
 	return result
 
-def get_neighbors(sc_num, num_neighbors=25):
-	table = metadata_obj.tables['neighbors']
-	sc_num_col = table.c['id']
-	results_cols = map(lambda x: table.c[x], map(str, list(range(1,num_neighbors))))
-	select_statement = db.select(*results_cols).where(sc_num_col == sc_num).fetch(1)
-	with engine.connect() as conn:
+def get_referrers(sc_num, max_rank=max_neighbors):
+	# books that have sc_num among their top max_rank neighbors
+	with get_engine().connect() as conn:
+		result = conn.execute(referrers_query, {'sc_num': sc_num, 'max_rank': max_rank})
+		conn.commit()
+	return result
+
+# batch versions for the JSON api: many books in one statement, ids bound as a single array
+neighbor_ranks_batch_query = text("""
+	SELECT r.id AS book_id, r.rank, r.distance, b.id, b."jacket.small", b.title, b.subtitle, b.author, b.performers
+	FROM neighbor_ranks r
+	JOIN book_features b ON b.id = r.neighbor_id
+	WHERE r.id = ANY(:ids) AND r.rank BETWEEN 1 AND :num_neighbors
+	ORDER BY r.id, r.rank
+	""").bindparams(db.bindparam('ids', type_=ARRAY(db.Text)))
+
+neighbors_batch_query = text("""
+	SELECT n.id AS book_id, nb.rank, NULL AS distance, b.id, b."jacket.small", b.title, b.subtitle, b.author, b.performers
+	FROM neighbors n
+	CROSS JOIN LATERAL unnest(ARRAY[{cols}]) WITH ORDINALITY AS nb(neighbor_id, rank)
+	JOIN book_features b ON b.id = nb.neighbor_id
+	WHERE n.id = ANY(:ids) AND nb.rank <= :num_neighbors
+	ORDER BY n.id, nb.rank
+	""".format(cols=", ".join('n."{}"'.format(i) for i in range(1, max_neighbors+1)))).bindparams(db.bindparam('ids', type_=ARRAY(db.Text)))
+
+def get_neighbors_batch(sc_nums, num_neighbors=max_neighbors):
+	# ranked neighbors of every book in sc_nums; book_id says whose neighbor a row is
+	query = neighbor_ranks_batch_query if has_table(neighbor_ranks_table) else neighbors_batch_query
+	with get_engine().connect() as conn:
+		result = conn.execute(query, {'ids': list(sc_nums), 'num_neighbors': num_neighbors})
+		conn.commit()
+	return result
+
+def get_books_info(sc_nums):
+	# the summary fields of several books at once (unknown ids are just missing from the result)
+	table = get_table('book_features')
+	sc_num = table.c['id']
+	columns = [table.c[c] for c in ['id', 'title', 'subtitle', 'author', 'performers', 'jacket.small', 'jacket.medium']]
+	select_statement = db.select(*columns).where(sc_num == db.any_(db.literal(list(sc_nums), type_=ARRAY(db.Text))))
+	with get_engine().connect() as conn:
 		result = conn.execute(select_statement)
 		conn.commit()
-	return list(result)[0]
-	
+	return result
+
+# full text search. each searchable field gets a stored, generated tsvector column with a
+# GIN index, so postgres doesn't run to_tsvector on every row at query time.
+# search_text() papers over columns that are text in older loads and text[] after copy_table.
+search_config = 'english'
+search_columns = {
+	'title': 'title_tsv',
+	'author': 'author_tsv',
+	'narrator': 'performers_tsv',
+	'everything': 'search_tsv',
+	}
+search_index_ddl = [
+	"CREATE OR REPLACE FUNCTION search_text(text) RETURNS text LANGUAGE sql IMMUTABLE AS $$ SELECT coalesce($1, '') $$",
+	"CREATE OR REPLACE FUNCTION search_text(text[]) RETURNS text LANGUAGE sql IMMUTABLE AS $$ SELECT coalesce(array_to_string($1, ' '), '') $$",
+	"""ALTER TABLE {table} ADD COLUMN IF NOT EXISTS title_tsv tsvector GENERATED ALWAYS AS
+		(to_tsvector('{config}', search_text(title) || ' ' || search_text(subtitle))) STORED""",
+	"""ALTER TABLE {table} ADD COLUMN IF NOT EXISTS author_tsv tsvector GENERATED ALWAYS AS
+		(to_tsvector('{config}', search_text(author))) STORED""",
+	"""ALTER TABLE {table} ADD COLUMN IF NOT EXISTS performers_tsv tsvector GENERATED ALWAYS AS
+		(to_tsvector('{config}', search_text(performers))) STORED""",
+	"""ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_tsv tsvector GENERATED ALWAYS AS
+		(setweight(to_tsvector('{config}', search_text(title) || ' ' || search_text(subtitle)), 'A') ||
+		setweight(to_tsvector('{config}', search_text(author)), 'B') ||
+		setweight(to_tsvector('{config}', search_text(performers)), 'C')) STORED""",
+	"CREATE INDEX IF NOT EXISTS {table}_title_tsv_idx ON {table} USING gin (title_tsv)",
+	"CREATE INDEX IF NOT EXISTS {table}_author_tsv_idx ON {table} USING gin (author_tsv)",
+	"CREATE INDEX IF NOT EXISTS {table}_performers_tsv_idx ON {table} USING gin (performers_tsv)",
+	"CREATE INDEX IF NOT EXISTS {table}_search_tsv_idx ON {table} USING gin (search_tsv)",
+	]
+
+def create_search_index(table_name='book_features'):
+	# write --swap carries these over to the new table once they exist
+	with get_engine().connect() as conn:
+		for ddl in search_index_ddl:
+			conn.execute(text(ddl.format(table=table_name, config=search_config)))
+		conn.commit()
+	with get_engine().connect() as conn:
+		conn.execute(text("ANALYZE {}".format(table_name)))
+		conn.commit()
+	metadata_obj.reflect(bind=get_engine(), only=[table_name], extend_existing=True)
+
+def prefix_tsquery(search_val):
+	# 'lord of the ri' -> 'lord:* & of:* & the:* & ri:*' so partially typed words still match.
+	# only word characters make it through, so the result is always valid tsquery syntax.
+	words = re.findall(r'\w+', search_val)
+	return " & ".join(w + ':*' for w in words)
 
-def search_books(search_type, search_val, table_name='book_features'):
-	table = metadata_obj.tables[table_name]
+def search_books(search_type, search_val, table_name='book_features', limit=10, after=None):
+	# results come back ordered by (rank desc, id). after is the (rank, id) of the last row
+	# of the previous page; paging on that key instead of OFFSET keeps deep pages as cheap as the first.
+	table = get_table(table_name)
 	sc_num = table.c['id']
 	icon_url = table.c['jacket.small']
 	title = table.c['title']
 	subtitle = table.c['subtitle']
 	author = table.c['author']
 	performer = table.c['performers']
+	if isinstance(performer.type, db.ARRAY):
+		# tables loaded with copy_table store performers as text[]
+		performer = db.func.array_to_string(performer, ' ')
 	
-	search_phrase = " & ".join(search_val.split())
-	
-	if search_type == 'title':
-		select_statement = db.select(sc_num, icon_url, title, subtitle, author).where(title.match(search_phrase)).fetch(10)
-	elif search_type == 'author':
-		select_statement = db.select(sc_num, icon_url, title, subtitle, author).where(author.match(search_phrase)).fetch(10)
-	elif search_type == 'narrator':
-		select_statement = db.select(sc_num, icon_url, title, subtitle, author).where(performer.match(search_phrase)).fetch(10)
-	elif search_type == 'sc_number':
+	if search_type == 'sc_number':
 		select_statement = db.select(sc_num, icon_url, title, subtitle, author).where(sc_num == search_val)
+	elif search_type in search_columns and search_columns[search_type] in table.c:
+		tsquery_string = prefix_tsquery(search_val)
+		if not tsquery_string:
+			return None
+		tsv = table.c[search_columns[search_type]]
+		query = db.func.to_tsquery(db.literal_column("'{}'::regconfig".format(search_config)), tsquery_string)
+		rank = db.func.ts_rank(tsv, query)
+		select_statement = (db.select(sc_num, icon_url, title, subtitle, author, rank.label('rank'))
+			.where(tsv.op('@@')(query))
+			.order_by(rank.desc(), sc_num)
+			.fetch(limit))
+		if after is not None:
+			after_rank = db.cast(db.literal(after[0]), db.REAL)
+			select_statement = select_statement.where(db.or_(rank < after_rank, db.and_(rank == after_rank, sc_num > after[1])))
 	else:
-		return None
-	with engine.connect() as conn:
+		# table hasn't been through create_search_index yet, so there is no rank to order by
+		search_phrase = " & ".join(search_val.split())
+		if search_type == 'title':
+			condition = title.match(search_phrase)
+		elif search_type == 'author':
+			condition = author.match(search_phrase)
+		elif search_type == 'narrator':
+			condition = performer.match(search_phrase)
+		else:
+			return None
+		select_statement = db.select(sc_num, icon_url, title, subtitle, author).where(condition).order_by(sc_num).fetch(limit)
+		if after is not None:
+			select_statement = select_statement.where(sc_num > after[1])
+	with get_engine().connect() as conn:
 		result_set = conn.execute(select_statement) # note: this is an iterable!!!!
 		conn.commit()
 	return result_set
+
+def encode_cursor(rank, sc_num):
+	return base64.urlsafe_b64encode(json.dumps([rank, sc_num]).encode()).decode()
+
+class BadCursor(ValueError):
+	pass
+
+def decode_cursor(cursor):
+	# cursors come back from the query string, so anything malformed raises BadCursor
+	try:
+		rank, sc_num = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+	except (ValueError, TypeError) as err:
+		raise BadCursor('bad cursor {!r}: {}'.format(cursor, err))
+	if not isinstance(sc_num, str) or isinstance(rank, bool) or not (rank is None or isinstance(rank, (int, float))):
+		raise BadCursor('bad cursor {!r}'.format(cursor))
+	return (rank, sc_num)
+
+def search_page(search_type, search_val, table_name='book_features', limit=10, cursor=None):
+	# one page of search_books plus the cursor for the next page (None on the last page)
+	after = decode_cursor(cursor) if cursor else None
+	result = search_books(search_type, search_val, table_name, limit+1, after)
+	if result is None:
+		return None, None
+	rows = list(result)
+	next_cursor = None
+	if len(rows) > limit:
+		rows = rows[:limit]
+		last = rows[-1]._mapping
+		next_cursor = encode_cursor(last.get('rank'), last['id'])
+	return rows, next_cursor
 		
+# trigram indexes behind the typeahead fallback (suggest.py serves from memory when it can).
+# LIKE 'prefix%' on lower(...) can use these once the prefix is 3+ characters.
+suggest_index_ddl = [
+	"CREATE EXTENSION IF NOT EXISTS pg_trgm",
+	"CREATE INDEX IF NOT EXISTS {table}_title_trgm_idx ON {table} USING gin (lower(title) gin_trgm_ops)",
+	"CREATE INDEX IF NOT EXISTS {table}_author_trgm_idx ON {table} USING gin (lower(author) gin_trgm_ops)",
+	"CREATE INDEX IF NOT EXISTS {table}_performers_trgm_idx ON {table} USING gin (lower(search_text(performers)) gin_trgm_ops)",
+	]
+
+suggest_query = text("""
+	(SELECT 'title' AS kind, title AS text, id FROM book_features WHERE lower(title) LIKE :pattern LIMIT :limit)
+	UNION ALL
+	(SELECT 'author' AS kind, author AS text, min(id) AS id FROM book_features WHERE lower(author) LIKE :pattern GROUP BY author LIMIT :limit)
+	UNION ALL
+	(SELECT 'narrator' AS kind, search_text(performers) AS text, min(id) AS id FROM book_features
+		WHERE lower(search_text(performers)) LIKE :pattern GROUP BY search_text(performers) LIMIT :limit)
+	""")
+
+book_signature_query = text("""
+	SELECT c.oid, c.relfilenode, s.n_tup_ins + s.n_tup_upd + s.n_tup_del AS writes
+	FROM pg_class c JOIN pg_stat_user_tables s ON s.relid = c.oid
+	WHERE c.oid = to_regclass(:table_name)
+	""")
+
+def create_suggest_index(table_name='book_features'):
+	# needs the search_text() functions from create_search_index
+	with get_engine().connect() as conn:
+		for ddl in suggest_index_ddl:
+			conn.execute(text(ddl.format(table=table_name)))
+		conn.commit()
+
+def suggest_books(prefix, limit=10):
+	pattern = prefix.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+	with get_engine().connect() as conn:
+		result = conn.execute(suggest_query, {'pattern': pattern, 'limit': limit})
+		conn.commit()
+	return result
+
+def get_suggest_rows(table_name='book_features'):
+	# everything the in-memory typeahead index is built from
+	table = get_table(table_name)
+	select_statement = db.select(table.c['id'], table.c['title'], table.c['author'], table.c['performers'])
+	with get_engine().connect() as conn:
+		result = conn.execute(select_statement)
+		conn.commit()
+	return result
+
+def get_table_signature(table_name='book_features'):
+	# changes whenever the table is swapped out, truncated or written to
+	with get_engine().connect() as conn:
+		result = conn.execute(book_signature_query, {'table_name': table_name}).first()
+		conn.commit()
+	return tuple(result) if result is not None else None
+
 def get_book_info(book_id):
-	table = metadata_obj.tables['book_features']
+	table = get_table('book_features')
 	sc_num = table.c['id']
-	select_statement = db.select(table).where(sc_num == book_id)
-	with engine.connect() as conn:
+	# the tsvector columns are only there for search
+	columns = [c for c in table.c if c.name not in search_columns.values()]
+	select_statement = db.select(*columns).where(sc_num == book_id)
+	with get_engine().connect() as conn:
 		result_set = conn.execute(select_statement) # note: this is an iterable!!!!
 		conn.commit()
 	return result_set.first()
 
 	
 def drop_table(table_name):
-	with engine.connect() as conn:
+	with get_engine().connect() as conn:
 		conn.execute(text(
 			"""
 			DROP TABLE IF EXISTS {}
@@ -80,12 +302,44 @@ def drop_table(table_name):
         
         
 def add_table(df, table_name):
-    with engine.connect() as conn:
+    with get_engine().connect() as conn:
         df.to_sql(table_name, conn, if_exists = 'append')
         conn.commit()
-        
+
+
+# book_ids is written by the card catalog crawl with upserts keyed on id_num, so a rerun updates
+# rows instead of duplicating them. tables loaded before that may have duplicates and no key.
+book_ids_ddl = [
+	"CREATE TABLE IF NOT EXISTS book_ids (id_num text PRIMARY KEY, title text, authors text[])",
+	"DELETE FROM book_ids a USING book_ids b WHERE a.id_num = b.id_num AND a.ctid > b.ctid",
+	"CREATE UNIQUE INDEX IF NOT EXISTS book_ids_id_num_key ON book_ids (id_num)",
+	]
+
+def prepare_book_ids():
+	with get_engine().connect() as conn:
+		for ddl in book_ids_ddl:
+			conn.execute(text(ddl))
+		conn.commit()
+	metadata_obj.reflect(bind=get_engine(), only=['book_ids'], extend_existing=True)
+
+def upsert_book_ids(rows):
+	# rows: dicts with id_num and the columns to set. one multi-row INSERT ... ON CONFLICT DO UPDATE.
+	# an id may only appear once per statement, the last row for it wins.
+	if not rows:
+		return 0
+	rows = list({row['id_num']: row for row in rows}.values())
+	table = get_table('book_ids')
+	statement = pg_insert(table).values(rows)
+	statement = statement.on_conflict_do_update(index_elements=[table.c['id_num']],
+		set_={name: statement.excluded[name] for name in rows[0] if name != 'id_num'})
+	with get_engine().connect() as conn:
+		conn.execute(statement)
+		conn.commit()
+	return len(rows)
+
+
 def read_head(table, head_len = 10):
-	with engine.connect() as conn:
+	with get_engine().connect() as conn:
 		select_statement = table.select().fetch(head_len)
 		result_set = conn.execute(select_statement)
 		for r in result_set:
@@ -93,6 +347,7 @@ def read_head(table, head_len = 10):
 		conn.commit()
 
 def get_book_ids(engine):
+	import pandas as pd
 	with engine.connect() as conn:
 		logging.info('reading book_ids into a dataframe')
 		book_ids = pd.read_sql_table('book_ids', conn)
@@ -102,6 +357,57 @@ def get_book_ids(engine):
 
 	
 
+# the engine and the reflected tables are created on first use, not at import time, and only
+# the tables a caller actually asks for get reflected.
+metadata_obj = MetaData()
+_engine = None
+_lock = threading.RLock()
+_missing_tables = dict()
+missing_table_ttl = 60
+
+def get_engine():
+	global _engine
+	if _engine is None:
+		with _lock:
+			if _engine is None:
+				_engine = get_db_engine()
+	return _engine
+
+def get_table(table_name):
+	if table_name not in metadata_obj.tables:
+		with _lock:
+			if table_name not in metadata_obj.tables:
+				metadata_obj.reflect(bind=get_engine(), only=[table_name])
+	return metadata_obj.tables[table_name]
+
+def has_table(table_name):
+	# tables that exist stay in metadata_obj. a missing one is remembered for missing_table_ttl
+	# seconds, so routes that check for an optional table (neighbor_ranks) don't probe the
+	# database on every request, but a table created later by another process is still found.
+	# bulk_load reflects the tables it creates, so those show up in this process at once
+	if table_name in metadata_obj.tables:
+		return True
+	checked_at = _missing_tables.get(table_name)
+	if checked_at is not None and time.monotonic() - checked_at < missing_table_ttl:
+		return False
+	try:
+		get_table(table_name)
+		_missing_tables.pop(table_name, None)
+		return True
+	except db.exc.InvalidRequestError:
+		# reflect(only=...) raises this for tables that don't exist
+		_missing_tables[table_name] = time.monotonic()
+		return False
+
+def refresh_table(table_name):
+	# for a table that was replaced under the same name (copy_table with swap=True): the
+	# reflected columns belong to the old table, so drop them and reflect the new one
+	with _lock:
+		if table_name in metadata_obj.tables:
+			metadata_obj.remove(metadata_obj.tables[table_name])
+		_missing_tables.pop(table_name, None)
+		return get_table(table_name)
+
 def get_db_engine():
 	connection_url = os.environ['POSTGRES_CONN']
 	try:
@@ -117,47 +423,72 @@ def get_db_engine():
 def parse_read(args):
 	table_name = args.table_name
 	print("reading the first {} rows of {}...\n".format(args.length, table_name))
-	table = metadata_obj.tables[table_name]
+	table = get_table(table_name)
 	read_head(table, args.length)
 	
 def parse_write(args):
 	table_name = args.table_name
 	print("writing {} to {}...\n".format(args.filename, table_name))
 	# table may not exist yet...
-	# table = metadata_obj.tables[table_name]
-	df = pd.read_pickle(args.filename)
-	add_table(df, table_name)
+	# table = get_table(table_name)
+	from chunk_writer import load_frame
+	df = load_frame(args.filename)
+	if args.method == 'insert':
+		add_table(df, table_name)
+		return
+	from bulk_load import copy_table
+	rows, rate = copy_table(df, table_name, swap=args.swap, chunksize=args.chunksize)
+	print("copied {} rows ({:.0f} rows/sec).".format(rows, rate))
 	
 def parse_delete(args):
 	table_name = args.table_name
-	table = metadata_obj.tables[table_name]
+	table = get_table(table_name)
 	logging.info('confirming deletion of table {}'.format(table_name))
 	yes_no = input('are you sure you want to delete {}? y/n: '.format(table_name))
 	if lower(yes_no) in {'y', 'yes'}:
 		print('dropping table {}'.format(table_name))
 		drop_table(table)
 
+def parse_index_search(args):
+	print("adding search columns and indexes to {}...\n".format(args.table_name))
+	create_search_index(args.table_name)
+
+def parse_index_suggest(args):
+	print("adding trigram indexes to {}...\n".format(args.table_name))
+	create_suggest_index(args.table_name)
+
 def parse_search(args):
-	result = search_books(args.by, args.value, args.table_name)
-	args.outfile.write(str(list(result)))
+	rows, next_cursor = search_page(args.by, args.value, args.table_name, args.limit, args.after)
+	args.outfile.write(str(rows))
+	if next_cursor:
+		args.outfile.write("\nnext page: --after {}\n".format(next_cursor))
 	
 def parse_neighbors(args):
-	neighbors = get_neighbors(args.sc_num)
-	result = get_neighbors_info(neighbors)
+	if args.reverse:
+		result = get_referrers(args.sc_num, args.k)
+	else:
+		result = get_neighbors_ranked(args.sc_num, args.k)
 	for res in result:
 		args.outfile.write(str(res))
+
+def parse_migrate_neighbors(args):
+	print("migrating {} and {} to {}...\n".format(args.neighbors, args.dists, neighbor_ranks_table))
+	import pandas as pd
+	from bulk_load import neighbors_to_long, load_neighbor_ranks
+	neighbors = pd.read_pickle(args.neighbors)
+	distances = pd.read_pickle(args.dists)
+	long_df = neighbors_to_long(neighbors, distances)
+	load_neighbor_ranks(long_df)
+	logging.info('loaded {} rows into {}'.format(len(long_df), neighbor_ranks_table))
+	print("loaded {} rows.".format(len(long_df)))
 	
 	
 	
 	
 
 
-table_names = ['book_ids', 'book_features', 'related_books', 'neighbors', 'joined']
-
+table_names = ['book_ids', 'book_features', 'related_books', 'neighbors', 'joined', 'neighbor_ranks', 'scrape_jobs']
 
-engine = get_db_engine()
-metadata_obj = MetaData()
-metadata_obj.reflect(bind=engine)
 
 def main():
 	parser = argparse.ArgumentParser()
@@ -169,8 +500,11 @@ def main():
 	read.set_defaults(func=parse_read)
 	
 	write = subparsers.add_parser('write', aliases=['w'], help = "write a pickled pandas dataframe to an sql table")
-	write.add_argument('filename', help = 'name of pickled pandas dataframe')
+	write.add_argument('filename', help = 'name of pickled pandas dataframe, or a directory of scraper output parts')
 	write.add_argument('table_name', choices = table_names, help = 'name of table to read from')
+	write.add_argument('--method', choices = ['copy', 'insert'], default = 'copy', help = 'load with COPY (default) or with pandas to_sql inserts')
+	write.add_argument('--swap', action='store_true', help = 'load into a staging table and swap it in for table_name when done (replaces the table)')
+	write.add_argument('--chunksize', default = 50000, type=int, help = 'rows per COPY statement, default = 50000')
 	write.set_defaults(func=parse_write)
 	
 	delete = subparsers.add_parser('delete', aliases=['d'], help = "drop an sql table")
@@ -180,18 +514,35 @@ def main():
 	neighbors = subparsers.add_parser('neighbors', aliases=['n'], help = "query neighbors")
 	neighbors.add_argument('sc_num', help = 'the sc_num of the book you are querying')
 	neighbors.add_argument('outfile', nargs='?', type=argparse.FileType('w'), default=sys.stdout, help = "where to print neighbors")
+	neighbors.add_argument('--k', '-k', default=max_neighbors, type=int, help = 'how many neighbors to return, default = {}'.format(max_neighbors))
+	neighbors.add_argument('--reverse', action='store_true', help = 'list the books that have sc_num as one of their neighbors instead')
 	neighbors.set_defaults(func=parse_neighbors)
 
+	migrate = subparsers.add_parser('migrate_neighbors', aliases=['m'], help = "load the pickled neighbor and distance tables into the long-format neighbor_ranks table")
+	migrate.add_argument('--neighbors', default = 'datasets/neighbors.pkl.tar.gz', help = 'location of the pickled neighbors dataframe')
+	migrate.add_argument('--dists', default = 'datasets/dists.pkl.tar.gz', help = 'location of the pickled distances dataframe')
+	migrate.set_defaults(func=parse_migrate_neighbors)
+
 	search = subparsers.add_parser('search', aliases=['s'], help = "search an sql table")
 	search.add_argument('table_name', choices = table_names, help = 'name of table to search')
 	search.add_argument('--by', 
-						choices = ['sc_number', 'title', 'author'],
+						choices = ['sc_number', 'title', 'author', 'narrator', 'everything'],
 						default='sc_number', 
 						help = 'what to search by (default = sc_number)'
 						)
 	search.add_argument('--value', '-v', help = "value to search for", required = True)
+	search.add_argument('--limit', default = 10, type=int, help = 'results per page, default = 10')
+	search.add_argument('--after', help = 'cursor printed at the end of the previous page')
 	search.add_argument('outfile', nargs='?', type=argparse.FileType('w'), default=sys.stdout, help = "where to print search results")
 	search.set_defaults(func=parse_search)
+
+	index_search = subparsers.add_parser('index_search', help = "add generated tsvector columns and GIN indexes used by search (write --swap keeps them)")
+	index_search.add_argument('table_name', nargs='?', default='book_features', choices = table_names, help = 'name of table to index, default = book_features')
+	index_search.set_defaults(func=parse_index_search)
+
+	index_suggest = subparsers.add_parser('index_suggest', help = "add the trigram indexes used as the typeahead fallback (run index_search first)")
+	index_suggest.add_argument('table_name', nargs='?', default='book_features', choices = table_names, help = 'name of table to index, default = book_features')
+	index_suggest.set_defaults(func=parse_index_suggest)
 	
 	
 
@@ -208,7 +559,7 @@ def main():
 
 	# elif args.search:
 	# 	logging.info('searching {}'.format(table_name))
-	# 	table = metadata_obj.tables[table_name]
+	# 	table = get_table(table_name)
 	# 	read_head(engine, table)
 	# else:
 	# 	logging.info('no option selected')
@@ -221,10 +572,7 @@ def main():
 
 if __name__ == "__main__":
     main()
-	
-engine = get_db_engine()
-metadata_obj = MetaData()
-metadata_obj.reflect(bind=engine)
+
     
 
 
@@ -0,0 +1,273 @@
+import os
+import socket
+import logging
+import argparse
+from sqlalchemy import text, bindparam, Text
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from postgres_interaction import get_engine, get_book_ids
+
+
+# a work queue for scrapes, kept in postgres so any number of workers on any number of machines
+# can share one run. each (job, id_num) row goes pending -> running -> done (or failed after
+# max_attempts). a worker claims a batch with FOR UPDATE SKIP LOCKED, so two workers never get
+# the same rows, and holds it on a lease: if the worker dies the lease runs out and the rows go
+# to whoever claims next. a batch is only marked done after its output has been written, so a
+# crash costs at most the batches that were in flight.
+
+queue_ddl = [
+	"""CREATE TABLE IF NOT EXISTS scrape_jobs (
+		job text NOT NULL,
+		id_num text NOT NULL,
+		state text NOT NULL DEFAULT 'pending',
+		worker text,
+		lease_until timestamptz,
+		attempts integer NOT NULL DEFAULT 0,
+		last_error text,
+		done_at timestamptz,
+		PRIMARY KEY (job, id_num))""",
+	"CREATE INDEX IF NOT EXISTS scrape_jobs_claim_idx ON scrape_jobs (job, state, lease_until)",
+]
+
+enqueue_query = text("""
+	INSERT INTO scrape_jobs (job, id_num)
+	SELECT :job, unnest(:ids)
+	ON CONFLICT (job, id_num) DO NOTHING
+	""").bindparams(bindparam('ids', type_=ARRAY(Text)))
+
+claim_query = text("""
+	UPDATE scrape_jobs AS j
+	SET state = 'running', worker = :worker, attempts = j.attempts + 1,
+		lease_until = now() + make_interval(secs => :lease_seconds)
+	FROM (
+		SELECT job, id_num FROM scrape_jobs
+		WHERE job = :job
+			AND (state = 'pending' OR (state = 'running' AND lease_until < now()))
+			AND attempts < :max_attempts
+		ORDER BY id_num
+		LIMIT :batch_size
+		FOR UPDATE SKIP LOCKED
+	) AS claimed
+	WHERE j.job = claimed.job AND j.id_num = claimed.id_num
+	RETURNING j.id_num
+	""")
+
+# a worker that dies on its last attempt leaves a running row nobody may claim again (it's out of
+# attempts) and nobody will fail (fail_query only runs for live workers). once the lease is up,
+# sweep those rows to failed so status and retry see them
+expire_query = text("""
+	UPDATE scrape_jobs
+	SET state = 'failed', lease_until = NULL, last_error = 'lease expired on the last attempt (worker ' || coalesce(worker, '?') || ')'
+	WHERE job = :job AND state = 'running' AND lease_until < now() AND attempts >= :max_attempts
+	""")
+
+# the worker check means a worker whose lease ran out and was taken over can't clobber the new owner
+complete_query = text("""
+	UPDATE scrape_jobs
+	SET state = 'done', done_at = now(), lease_until = NULL, last_error = NULL
+	WHERE job = :job AND worker = :worker AND state = 'running' AND id_num = ANY(:ids)
+	""").bindparams(bindparam('ids', type_=ARRAY(Text)))
+
+fail_query = text("""
+	UPDATE scrape_jobs
+	SET state = CASE WHEN attempts >= :max_attempts THEN 'failed' ELSE 'pending' END,
+		lease_until = NULL, last_error = :error
+	WHERE job = :job AND worker = :worker AND state = 'running' AND id_num = :id_num
+	""")
+
+extend_query = text("""
+	UPDATE scrape_jobs
+	SET lease_until = now() + make_interval(secs => :lease_seconds)
+	WHERE job = :job AND worker = :worker AND state = 'running' AND id_num = ANY(:ids)
+	""").bindparams(bindparam('ids', type_=ARRAY(Text)))
+
+retry_failed_query = text("""
+	UPDATE scrape_jobs SET state = 'pending', attempts = 0
+	WHERE job = :job AND state = 'failed'
+	""")
+
+status_query = text("""
+	SELECT state, count(*), count(*) FILTER (WHERE state = 'running' AND lease_until < now())
+	FROM scrape_jobs WHERE job = :job GROUP BY state
+	""")
+
+rate_query = text("""
+	SELECT count(*), min(done_at), max(done_at)
+	FROM scrape_jobs WHERE job = :job AND state = 'done' AND done_at > now() - make_interval(mins => :minutes)
+	""")
+
+workers_query = text("""
+	SELECT worker, count(*) FROM scrape_jobs
+	WHERE job = :job AND state = 'running' AND lease_until >= now()
+	GROUP BY worker ORDER BY worker
+	""")
+
+
+def default_worker_name():
+	return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+def create_queue():
+	with get_engine().begin() as conn:
+		for ddl in queue_ddl:
+			conn.execute(text(ddl))
+
+def enqueue(job, ids):
+	# add ids to job; ids already queued (in any state) are left alone. returns how many were new
+	create_queue()
+	with get_engine().begin() as conn:
+		result = conn.execute(enqueue_query, {'job': job, 'ids': [str(i) for i in ids]})
+	return result.rowcount
+
+
+class WorkQueue:
+
+	def __init__(self, job, worker=None, lease_seconds=600, max_attempts=3):
+		self.job = job
+		self.worker = worker or default_worker_name()
+		self.lease_seconds = lease_seconds
+		self.max_attempts = max_attempts
+
+	def claim(self, batch_size):
+		with get_engine().begin() as conn:
+			conn.execute(expire_query, {'job': self.job, 'max_attempts': self.max_attempts})
+			rows = conn.execute(claim_query, {'job': self.job, 'worker': self.worker, 'batch_size': batch_size,
+				'lease_seconds': self.lease_seconds, 'max_attempts': self.max_attempts})
+			return sorted(row[0] for row in rows)
+
+	def extend(self, ids):
+		# checkpoint: keep the lease on ids that are still being worked on
+		with get_engine().begin() as conn:
+			conn.execute(extend_query, {'job': self.job, 'worker': self.worker, 'ids': list(ids),
+				'lease_seconds': self.lease_seconds})
+
+	def complete(self, ids):
+		if not ids:
+			return 0
+		with get_engine().begin() as conn:
+			return conn.execute(complete_query, {'job': self.job, 'worker': self.worker, 'ids': list(ids)}).rowcount
+
+	def fail(self, failures):
+		# failures: {id_num: error}. rows go back to pending until they run out of attempts
+		with get_engine().begin() as conn:
+			for id_num, err in failures.items():
+				conn.execute(fail_query, {'job': self.job, 'worker': self.worker, 'id_num': id_num,
+					'error': str(err)[:1000], 'max_attempts': self.max_attempts})
+
+	def batches(self, batch_size):
+		# claimed batches until the queue runs dry
+		while True:
+			ids = self.claim(batch_size)
+			if not ids:
+				return
+			yield ids
+
+
+def expire_leases(job, max_attempts=3):
+	# running rows whose worker died on the last attempt -> failed. returns how many
+	with get_engine().begin() as conn:
+		return conn.execute(expire_query, {'job': job, 'max_attempts': max_attempts}).rowcount
+
+def retry_failed(job, max_attempts=3):
+	expire_leases(job, max_attempts)
+	with get_engine().begin() as conn:
+		return conn.execute(retry_failed_query, {'job': job}).rowcount
+
+def queue_status(job, minutes=10, max_attempts=3):
+	expire_leases(job, max_attempts)
+	with get_engine().connect() as conn:
+		counts = {state: (n, expired) for state, n, expired in conn.execute(status_query, {'job': job})}
+		recent, first_done, last_done = conn.execute(rate_query, {'job': job, 'minutes': minutes}).one()
+		workers = list(conn.execute(workers_query, {'job': job}))
+	total = sum(n for n, _ in counts.values())
+	status = {state: counts.get(state, (0, 0))[0] for state in ('pending', 'running', 'done', 'failed')}
+	status['total'] = total
+	status['expired_leases'] = counts.get('running', (0, 0))[1]
+	status['workers'] = [(w, n) for w, n in workers]
+	rate = None
+	if recent and first_done is not None and last_done > first_done:
+		rate = recent / (last_done - first_done).total_seconds()
+	status['rate'] = rate
+	left = status['pending'] + status['running']
+	status['eta_seconds'] = left / rate if rate else None
+	return status
+
+def format_status(job, status):
+	lines = ['job {}: {} ids'.format(job, status['total'])]
+	for state in ('done', 'running', 'pending', 'failed'):
+		pct = 100.0 * status[state] / status['total'] if status['total'] else 0.0
+		lines.append('  {:<8} {:>9} ({:5.1f}%)'.format(state, status[state], pct))
+	if status['expired_leases']:
+		lines.append('  {} running ids have expired leases and will be reclaimed'.format(status['expired_leases']))
+	if status['rate']:
+		lines.append('  {:.2f} ids/sec over the last few minutes, about {:.0f} minutes to go'.format(
+			status['rate'], status['eta_seconds'] / 60))
+	for worker, n in status['workers']:
+		lines.append('  worker {} holds {}'.format(worker, n))
+	return '\n'.join(lines)
+
+
+def parse_enqueue(args):
+	if args.ids:
+		ids = [line.strip() for line in args.ids if line.strip()]
+	else:
+		ids = list(get_book_ids(get_engine())['id_num'])
+	n = enqueue(args.job, ids)
+	print('queued {} new ids for {} ({} given)'.format(n, args.job, len(ids)))
+
+def parse_work(args):
+	from book_page_scraping import work_queue
+	queue = WorkQueue(args.job, args.worker, args.lease, args.max_attempts)
+	work_queue(queue, args.batch, args.concurrency, args.rate, args.cache, args.replay)
+
+def parse_status(args):
+	print(format_status(args.job, queue_status(args.job, args.minutes, args.max_attempts)))
+
+def parse_retry(args):
+	print('requeued {} failed ids'.format(retry_failed(args.job, args.max_attempts)))
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	subparsers = parser.add_subparsers()
+
+	enqueue_cmd = subparsers.add_parser('enqueue', help = "queue ids for a job (every id in book_ids by default)")
+	enqueue_cmd.add_argument('--job', default='book_pages', help = 'job name, default = book_pages')
+	enqueue_cmd.add_argument('--ids', type=argparse.FileType('r'), help = 'file of ids to queue, one per line')
+	enqueue_cmd.set_defaults(func=parse_enqueue)
+
+	work = subparsers.add_parser('work', help = "claim batches and scrape them until the queue is empty")
+	work.add_argument('--job', default='book_pages', help = 'job name, default = book_pages')
+	work.add_argument('--batch', default=200, type=int, help = 'ids per claimed batch (and per output file), default = 200')
+	work.add_argument('--lease', default=600, type=int, help = 'seconds a claimed batch is held before others may take it, default = 600')
+	work.add_argument('--max-attempts', default=3, type=int, help = 'attempts per id before it is marked failed, default = 3')
+	work.add_argument('--worker', help = 'worker name, default = hostname:pid')
+	work.add_argument('--concurrency', '-c', default=1, type=int, help = 'how many pages to fetch at once, default = 1')
+	work.add_argument('--rate', '-r', default=5.0, type=float, help = 'max requests per second for this worker, default = 5')
+	work.add_argument('--cache', default=None, help = 'directory to keep raw pages in')
+	work.add_argument('--replay', action='store_true', help = 'parse pages from --cache only')
+	work.set_defaults(func=parse_work)
+
+	status = subparsers.add_parser('status', help = "show progress and rate for a job")
+	status.add_argument('--job', default='book_pages', help = 'job name, default = book_pages')
+	status.add_argument('--minutes', default=10, type=int, help = 'window for the rate estimate, default = 10')
+	status.add_argument('--max-attempts', default=3, type=int, help = 'attempts per id, expired leases on the last one count as failed, default = 3')
+	status.set_defaults(func=parse_status)
+
+	retry = subparsers.add_parser('retry', help = "put failed ids back in the queue")
+	retry.add_argument('--job', default='book_pages', help = 'job name, default = book_pages')
+	retry.add_argument('--max-attempts', default=3, type=int, help = 'attempts per id, expired leases on the last one count as failed, default = 3')
+	retry.set_defaults(func=parse_retry)
+
+	args = parser.parse_args()
+	logfile = 'logs/scrape_queue.log'
+	logging.basicConfig(filename=logfile,
+								level=logging.INFO,
+								format = '%(asctime)s %(message)s'
+								)
+	args.func(args)
+	logging.info("done")
+	logging.info("-------------------")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import urllib.request
+
+import fetch_engine
+from fetch_engine import Fetcher
+from bibliocommons_standin import synthetic_id
+
+
+# throughput benchmark for the scrapers against bibliocommons_standin.py. runs scrape_book_page,
+# get_availability and scrape_results_page at each concurrency level and reports pages/sec,
+# p50/p99 call latency, client CPU per page and the retry rate. the stand-in runs in its own
+# process so its CPU doesn't count against the scrapers.
+
+def free_port():
+	with socket.socket() as s:
+		s.bind(('127.0.0.1', 0))
+		return s.getsockname()[1]
+
+def start_standin(args):
+	port = free_port()
+	cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bibliocommons_standin.py'),
+		'--port', str(port), '--latency', str(args.latency), '--jitter', str(args.jitter),
+		'--error-rate', str(args.error_rate), '--throttle-rate', str(args.throttle_rate),
+		'--retry-after', str(args.retry_after), '--padding', str(args.padding)]
+	if args.pages:
+		cmd += ['--pages', args.pages]
+	proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+	url = 'http://127.0.0.1:{}'.format(port)
+	deadline = time.monotonic() + 10
+	while True:
+		try:
+			urllib.request.urlopen(url + '/_stats', timeout=1).read()
+			return proc, url
+		except OSError:
+			if time.monotonic() > deadline or proc.poll() is not None:
+				proc.kill()
+				raise RuntimeError("stand-in server didn't come up on {}".format(url))
+			time.sleep(0.1)
+
+def targets(url, n):
+	# name -> (function(item, fetcher), items)
+	from book_page_scraping import scrape_book_page, get_availability
+	from card_catalog_scraping import scrape_results_page
+	known = json.loads(urllib.request.urlopen(url + '/_ids').read())
+	record_ids = known['records'] or [synthetic_id(i) for i in range(n)]
+	search_pages = [int(p) for p in known['search_pages']] or list(range(1, n + 1))
+	record_ids = (record_ids * (n // len(record_ids) + 1))[:n]
+	search_pages = (search_pages * (n // len(search_pages) + 1))[:n]
+	return {
+		'book_page': (scrape_book_page, record_ids),
+		'availability': (get_availability, record_ids),
+		'results_page': (scrape_results_page, search_pages),
+		}
+
+def percentile(sorted_values, p):
+	if not sorted_values:
+		return float('nan')
+	return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+def run(func, items, concurrency, max_retries, backoff):
+	fetcher = Fetcher(concurrency=concurrency, rate=None, max_retries=max_retries, backoff=backoff, max_backoff=2.0)
+	latencies = list()
+
+	def timed(item):
+		start = time.perf_counter()
+		try:
+			return func(item, fetcher)
+		finally:
+			latencies.append(time.perf_counter() - start)
+
+	failures = 0
+	cpu_start = time.process_time()
+	start = time.perf_counter()
+	for item, result, err in fetcher.map(timed, items):
+		if err is not None or result is None:
+			failures += 1
+	wall = time.perf_counter() - start
+	cpu = time.process_time() - cpu_start
+	latencies.sort()
+	requests = fetcher.stats['requests']
+	return {
+		'pages_per_sec': len(items) / wall,
+		'p50_ms': 1000 * percentile(latencies, 0.50),
+		'p99_ms': 1000 * percentile(latencies, 0.99),
+		'cpu_ms_per_page': 1000 * cpu / len(items),
+		'retry_rate': fetcher.stats['retries'] / requests if requests else 0.0,
+		'failures': failures,
+		}
+
+def main():
+	parser = argparse.ArgumentParser(description="benchmark scraper throughput against the local bibliocommons stand-in")
+	parser.add_argument("--url", default=None, help="use an already running stand-in instead of starting one")
+	parser.add_argument("--pages", default=None, help="page_cache directory of recorded pages for the stand-in to serve")
+	parser.add_argument("--n", type=int, default=200, help="calls per target and concurrency level, default = 200")
+	parser.add_argument("--concurrency", default='1,4,16', help="comma separated concurrency levels, default = 1,4,16")
+	parser.add_argument("--targets", default='book_page,availability,results_page', help="comma separated targets to run")
+	parser.add_argument("--latency", type=float, default=0.05, help="stand-in mean latency in seconds, default = 0.05")
+	parser.add_argument("--jitter", type=float, default=0.02, help="stand-in latency standard deviation, default = 0.02")
+	parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 503s from the stand-in, default = 0")
+	parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of 429s from the stand-in, default = 0")
+	parser.add_argument("--retry-after", type=float, default=0.2, help="Retry-After seconds on 429s, default = 0.2")
+	parser.add_argument("--padding", type=int, default=100, help="KB of filler markup per generated page, default = 100")
+	parser.add_argument("--max-retries", type=int, default=4, help="fetcher retries per page, default = 4")
+	parser.add_argument("--backoff", type=float, default=0.05, help="fetcher base backoff in seconds, default = 0.05")
+	args = parser.parse_args()
+
+	proc = None
+	url = args.url
+	if url is None:
+		proc, url = start_standin(args)
+	fetch_engine.base_url = url.rstrip('/')
+	try:
+		available = targets(url, args.n)
+		print("{:<14} {:>5} {:>10} {:>9} {:>9} {:>10} {:>8} {:>6}".format(
+			'target', 'conc', 'pages/sec', 'p50 ms', 'p99 ms', 'cpu ms/pg', 'retries', 'fails'))
+		for name in args.targets.split(','):
+			func, items = available[name]
+			for concurrency in [int(c) for c in args.concurrency.split(',')]:
+				r = run(func, items, concurrency, args.max_retries, args.backoff)
+				print("{:<14} {:>5} {:>10.1f} {:>9.1f} {:>9.1f} {:>10.2f} {:>7.1%} {:>6}".format(
+					name, concurrency, r['pages_per_sec'], r['p50_ms'], r['p99_ms'], r['cpu_ms_per_page'],
+					r['retry_rate'], r['failures']))
+	finally:
+		if proc is not None:
+			proc.terminate()
+			proc.wait()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,133 @@
+import bisect
+import re
+import threading
+import time
+import logging
+
+from book_display import parse_author
+
+
+# "Read by Jim Dale." -> "Jim Dale"
+intro_pattern = re.compile(r'^\s*[\w\s]*?\bby\s+', re.IGNORECASE)
+
+def performer_names(performers):
+	if not performers:
+		return []
+	if isinstance(performers, str):
+		# older tables store the list as a postgres array literal, e.g. '{"Read by Jim Dale."}'
+		performers = [p.strip('"') for p in performers.strip('{}').split('","')]
+	names = list()
+	for perf in performers:
+		name = intro_pattern.sub('', perf).strip().rstrip('.')
+		if name:
+			names.append(name)
+	return names
+
+def word_starts(s):
+	# every suffix of s that starts at a word, so 'rings' finds 'the lord of the rings'
+	lower = s.lower()
+	starts = [0] + [m.end() for m in re.finditer(r'\s+', lower)]
+	return [lower[i:] for i in starts if i < len(lower)]
+
+
+# typeahead index over titles, authors and narrators, kept as one sorted list of keys so a
+# lookup is a bisect plus a short scan. keys[i] belongs to payloads[i] = (kind, text, book_id).
+class PrefixIndex:
+
+	def __init__(self, rows=()):
+		entries = list()
+		for book_id, title, author, performers in rows:
+			if title:
+				for key in word_starts(title):
+					entries.append((key, 'title', title, book_id))
+			if author:
+				name = parse_author(author)
+				for key in word_starts(name):
+					entries.append((key, 'author', name, book_id))
+			for name in performer_names(performers):
+				for key in word_starts(name):
+					entries.append((key, 'narrator', name, book_id))
+		entries.sort()
+		self.keys = [e[0] for e in entries]
+		self.payloads = [e[1:] for e in entries]
+
+	def __len__(self):
+		return len(self.keys)
+
+	def lookup(self, prefix, limit=10, max_scan=2000):
+		prefix = prefix.lower().strip()
+		if not prefix:
+			return []
+		results = list()
+		seen = set()
+		i = bisect.bisect_left(self.keys, prefix)
+		stop = min(len(self.keys), i + max_scan)
+		while i < stop and self.keys[i].startswith(prefix):
+			kind, text, book_id = self.payloads[i]
+			if (kind, text) not in seen:
+				seen.add((kind, text))
+				results.append({'kind': kind, 'text': text, 'id': book_id})
+				if len(results) >= limit:
+					break
+			i += 1
+		return results
+
+
+# owns the current PrefixIndex. the index is built in a background thread at startup and
+# rebuilt whenever the book_features signature changes (e.g. after write --swap). until the
+# first build finishes, lookups go to the trigram query in postgres.
+class Suggester:
+
+	def __init__(self, load_rows, get_signature, fallback, check_interval=60):
+		self.load_rows = load_rows
+		self.get_signature = get_signature
+		self.fallback = fallback
+		self.check_interval = check_interval
+		self.index = None
+		self.signature = None
+		self._last_check = 0.0
+		self._building = False
+		self._lock = threading.Lock()
+
+	def _refresh(self):
+		try:
+			signature = self.get_signature()
+			if self.index is not None and signature == self.signature:
+				return
+			start = time.perf_counter()
+			index = PrefixIndex(self.load_rows())
+			self.index, self.signature = index, signature
+			logging.info('built typeahead index: {} keys in {:.1f}s'.format(len(index), time.perf_counter() - start))
+		except Exception as err:
+			logging.warning("Unexpected {}, {} building typeahead index".format(err, type(err)))
+		finally:
+			with self._lock:
+				self._building = False
+
+	def start(self):
+		# check the table signature and rebuild if needed, off the request thread
+		with self._lock:
+			if self._building:
+				return
+			self._building = True
+			self._last_check = time.monotonic()
+		threading.Thread(target=self._refresh, name='suggest-build', daemon=True).start()
+
+	def suggest(self, prefix, limit=10):
+		if time.monotonic() - self._last_check >= self.check_interval:
+			self.start()
+		index = self.index
+		if index is not None:
+			return index.lookup(prefix, limit)
+		# same author format as the index ("Frank Herbert", not "Herbert, Frank"), which can
+		# merge authors the query kept apart
+		results = list()
+		seen = set()
+		for row in self.fallback(prefix, limit):
+			item = dict(row._mapping)
+			if item['kind'] == 'author':
+				item['text'] = parse_author(item['text'])
+			if (item['kind'], item['text']) not in seen:
+				seen.add((item['kind'], item['text']))
+				results.append(item)
+		return results
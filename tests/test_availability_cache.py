@@ -0,0 +1,62 @@
+import threading
+import pytest
+
+from availability_cache import AvailabilityCache
+
+
+def test_concurrent_misses_share_one_fetch():
+	calls = list()
+	release = threading.Event()
+
+	def fetch(book_id):
+		calls.append(book_id)
+		release.wait(5)
+		return {'available': 3}
+
+	cache = AvailabilityCache(fetch)
+	results = list()
+	threads = [threading.Thread(target=lambda: results.append(cache.get('S30C0000001'))) for _ in range(8)]
+	for t in threads:
+		t.start()
+	# let every thread get to the cache before the fetch returns
+	while cache.stats()['misses'] < len(threads):
+		pass
+	release.set()
+	for t in threads:
+		t.join()
+	assert calls == ['S30C0000001']
+	assert results == [{'available': 3}] * len(threads)
+	stats = cache.stats()
+	assert stats['coalesced'] == len(threads) - 1
+	assert stats['inflight'] == 0
+
+def test_waiters_see_the_fetch_error():
+	release = threading.Event()
+
+	def fetch(book_id):
+		release.wait(5)
+		raise ConnectionError('catalog down')
+
+	cache = AvailabilityCache(fetch)
+	errors = list()
+
+	def get():
+		try:
+			cache.get('S30C0000001')
+		except ConnectionError as err:
+			errors.append(err)
+
+	threads = [threading.Thread(target=get) for _ in range(4)]
+	for t in threads:
+		t.start()
+	while cache.stats()['misses'] < len(threads):
+		pass
+	release.set()
+	for t in threads:
+		t.join()
+	assert len(errors) == len(threads)
+	# a failed fetch isn't cached, the next request tries again
+
+	with pytest.raises(ConnectionError):
+		cache.get('S30C0000001')
+	assert cache.stats()['inflight'] == 0
@@ -0,0 +1,58 @@
+import os
+import uuid
+import numpy as np
+import pandas as pd
+import pytest
+
+sqlalchemy = pytest.importorskip('sqlalchemy')
+
+import postgres_interaction
+from bulk_load import is_list_column, pg_type, copy_value, copy_table
+
+database_url = os.environ.get('TEST_DATABASE_URL')
+
+
+def test_leading_nan():
+	assert is_list_column(pd.Series([np.nan, None, ['a', 'b']]))
+	assert pg_type(pd.Series([np.nan, ['a']])) == 'text[]'
+
+def test_bare_value_before_lists():
+	assert is_list_column(pd.Series([np.nan, 'a', ['b', 'c']]))
+
+def test_not_lists():
+	assert not is_list_column(pd.Series([np.nan, 'a', 'b']))
+	assert not is_list_column(pd.Series([{'small': 'x'}, np.nan]))
+	assert not is_list_column(pd.Series([np.nan, np.nan]))
+	assert not is_list_column(pd.Series([1.0, 2.0]))
+
+def test_copy_values_for_list_columns():
+	assert copy_value(['a', 'b'], True) == '{"a","b"}'
+	assert copy_value(np.array(['a'], dtype=object), True) == '{"a"}'
+	assert copy_value('a', True) == '{"a"}'
+	assert copy_value(np.nan, True) == '\\N'
+
+
+@pytest.mark.skipif(not database_url, reason='TEST_DATABASE_URL not set')
+def test_swap_keeps_search_columns_and_indexes(monkeypatch):
+	monkeypatch.setattr(postgres_interaction, '_engine', sqlalchemy.create_engine(database_url))
+	table_name = 'test_books_{}'.format(uuid.uuid4().hex[:8])
+	df = pd.DataFrame({'title': ['Dune'], 'subtitle': [None], 'author': ['Frank Herbert'],
+		'performers': [['Scott Brick']]}, index=pd.Index([1], name='id'))
+	try:
+		copy_table(df, table_name)
+		postgres_interaction.create_search_index(table_name)
+		copy_table(df.rename(index={1: 2}), table_name, swap=True)
+		table = postgres_interaction.get_table(table_name)
+		assert 'search_tsv' in table.c
+		with postgres_interaction.get_engine().connect() as conn:
+			indexes = set(conn.execute(sqlalchemy.text("SELECT indexname FROM pg_indexes WHERE tablename = :t"),
+				{'t': table_name}).scalars())
+			ids = conn.execute(sqlalchemy.select(table.c['id'])).scalars().all()
+		assert table_name + '_search_tsv_idx' in indexes
+		assert not any('_staging' in index for index in indexes)
+		assert ids == [2]
+	finally:
+		with postgres_interaction.get_engine().begin() as conn:
+			conn.execute(sqlalchemy.text('DROP TABLE IF EXISTS {}'.format(table_name)))
+		if table_name in postgres_interaction.metadata_obj.tables:
+			postgres_interaction.metadata_obj.remove(postgres_interaction.metadata_obj.tables[table_name])
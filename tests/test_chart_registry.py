@@ -0,0 +1,25 @@
+import gzip
+import pytest
+
+flask = pytest.importorskip('flask')
+
+import chart_registry
+
+
+def test_gzip_without_brotli(monkeypatch):
+	monkeypatch.setattr(chart_registry, 'brotli', None)
+	payload = chart_registry.Payload(b'{"mark": "bar"}' * 100, 'application/json')
+	app = flask.Flask(__name__)
+	with app.test_request_context(headers={'Accept-Encoding': 'br, gzip'}):
+		resp = payload.response()
+	assert resp.headers['Content-Encoding'] == 'gzip'
+	assert gzip.decompress(resp.get_data()) == payload.body
+
+def test_brotli_preferred():
+	brotli = pytest.importorskip('brotli')
+	payload = chart_registry.Payload(b'{"mark": "bar"}' * 100, 'application/json')
+	app = flask.Flask(__name__)
+	with app.test_request_context(headers={'Accept-Encoding': 'gzip, br'}):
+		resp = payload.response()
+	assert resp.headers['Content-Encoding'] == 'br'
+	assert brotli.decompress(resp.get_data()) == payload.body
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import chunk_writer
+from chunk_writer import ChunkWriter, load_frame, read_chunks
+
+
+def scraped_frame(start, n):
+	return pd.DataFrame({
+		'id': ['S30C{:07d}'.format(i) for i in range(start, start + n)],
+		'fields.DETAILS.PUBLICATION': [['Ashland : Blackstone Audio, 2009.', 'Other, 2010']] * (n - 1) + [np.nan],
+		'brief.title': ['t'] * n,
+		})
+
+
+@pytest.mark.parametrize('parquet', [True, False])
+def test_round_trip_keeps_lists(tmp_path, parquet):
+	if parquet and chunk_writer.pyarrow is None:
+		pytest.skip('pyarrow not installed')
+	with ChunkWriter(str(tmp_path), rows_per_chunk=3, parquet=parquet) as out:
+		out.append(scraped_frame(0, 4))
+		out.append(scraped_frame(4, 4))
+	assert len(list(read_chunks(str(tmp_path)))) == 2
+	df = load_frame(str(tmp_path))
+	assert len(df) == 8
+	pubs = df['fields.DETAILS.PUBLICATION']
+	assert pubs[0] == ['Ashland : Blackstone Audio, 2009.', 'Other, 2010']
+	assert all(isinstance(v, list) for v in pubs.dropna())
+
+def test_load_frame_without_parts(tmp_path):
+	with pytest.raises(FileNotFoundError):
+		load_frame(str(tmp_path))
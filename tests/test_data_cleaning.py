@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_cleaning
+
+
+def test_parse_about_pub_column_matches_per_row():
+	sample = pd.Series([['[Prince Frederick] : HighBridge Audio, 2020.'], ['Ashland : Blackstone Audio, Inc., 2009.'],
+		['[New York] : Penguin Random House Audio, [2021]'], np.nan, None, [], ['No colon, 1999'],
+		['Comma, before : colon 2001'], ['Publisher : no comma 2003'], ['Ends with colon:'], [''],
+		['Colon : no year,'], ['Ashland : Blackstone Audio, 2009.', 'Other, 2010'],
+		['[Prince Frederick] : HighBridge Audio, 2020.']], index=list('abcdefghijklmn'))
+	per_row = pd.DataFrame(sample.fillna(False).apply(data_cleaning.parse_about_pub).tolist(), index=sample.index)
+	pd.testing.assert_frame_equal(data_cleaning.parse_about_pub_column(sample), per_row)
+
+def test_parse_about_pub_column_takes_arrays():
+	# list columns come back from parquet as numpy arrays
+	sample = pd.Series([np.array(['Ashland : Blackstone Audio, 2009.', 'Other, 2010'], dtype=object)])
+	assert data_cleaning.parse_about_pub_column(sample).values.tolist() == [[2009, 'Blackstone Audio']]
+
+def test_per_row_parsers_return_nan():
+	assert np.isnan(data_cleaning.get_len_from_desc(np.nan))
+	assert np.isnan(data_cleaning.get_len_from_notes(['no length']))
+	assert np.isnan(data_cleaning.extract_first_isbn(np.nan))
+
+samples = {
+	'desc': pd.Series([['1 online resource (1 audio file (03 hr., 09 min., 53 sec.))'], np.nan, 'not a list (01 hr., 00 min., 00 sec.)',
+		['no length', 'Length (12 hr., 1 min., 0 sec.)'], [], ['1 online resource (1 audio file (03 hr., 09 min., 53 sec.))']], name='desc'),
+	'notes': pd.Series([['Duration: 10:05:00'], np.nan, ['no length'], ['Duration: 10:05:00'], None], name='notes'),
+	'isbn': pd.Series([['9781982112 (digital)', '123'], np.nan, ['no digits'], ['9781982112 (digital)']], name='isbn'),
+	'date': pd.Series(['2017', '2017-05-01', 'c2017', np.nan, 2017, '201', '2017'], name='date'),
+	'empty': pd.Series([], dtype=object, name='empty'),
+	'all_nan': pd.Series([np.nan, np.nan], dtype=object, name='all_nan'),
+	}
+
+@pytest.mark.parametrize('parse', [data_cleaning.get_len_from_desc, data_cleaning.get_len_from_notes,
+	data_cleaning.extract_first_isbn, data_cleaning.date_to_int])
+@pytest.mark.parametrize('sample', sorted(samples))
+def test_column_matches_apply(parse, sample):
+	col = samples[sample]
+	try:
+		expected = col.apply(parse)
+	except Exception as err:
+		# e.g. extract_first_isbn on an empty list: the column version fails the same way
+		with pytest.raises(type(err)):
+			data_cleaning._column(col, parse)
+		return
+	pd.testing.assert_series_equal(data_cleaning._column(col, parse), expected)
+
+def test_date_to_int_column():
+	col = samples['date']
+	pd.testing.assert_series_equal(data_cleaning.date_to_int_column(col), col.apply(data_cleaning.date_to_int))
@@ -0,0 +1,25 @@
+import pytest
+
+pytest.importorskip('requests')
+
+import requests
+import fetch_engine
+
+
+def response_with(retry_after):
+	resp = requests.Response()
+	resp.headers['Retry-After'] = retry_after
+	return resp
+
+
+@pytest.mark.parametrize('retry_after, expected', [
+	('5', 5.0),
+	('86400', 120.0),
+	('Fri, 31 Dec 2100 23:59:59 GMT', 120.0),
+	])
+def test_retry_after_is_clamped(monkeypatch, retry_after, expected):
+	slept = list()
+	monkeypatch.setattr(fetch_engine.time, 'sleep', slept.append)
+	fetcher = fetch_engine.Fetcher(rate=None, max_retry_after=120.0)
+	fetcher._backoff(0, response_with(retry_after))
+	assert slept == [expected]
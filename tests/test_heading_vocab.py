@@ -0,0 +1,26 @@
+import data_cleaning
+from heading_vocab import HeadingVocab
+
+
+rules = {'misspellings': data_cleaning.misspellings, 'bad_entries': sorted(data_cleaning.bad_entries),
+	'separators': data_cleaning.separators}
+
+def test_normalized_terms():
+	vocab = HeadingVocab(data_cleaning.normalize_heading, rules)
+	terms = vocab.decode(vocab.encode(['Women — Fiction.', 'Fcition', 'Audiobooks', 'History -- 20th century']))
+	assert sorted(terms) == ['20th century', 'history', 'women']
+
+def test_saved_vocabulary_keeps_ids(tmp_path):
+	path = str(tmp_path / 'vocab.json')
+	vocab = HeadingVocab(data_cleaning.normalize_heading, rules, path)
+	ids = vocab.encode(['Mystery fiction.', 'Women — Fiction'])
+	vocab.save()
+
+	reloaded = HeadingVocab(data_cleaning.normalize_heading, rules, path)
+	assert reloaded.encode(['Mystery fiction.', 'Women — Fiction']) == ids
+	assert reloaded.hits == 2 and reloaded.misses == 0
+
+	# changed rules: headings are normalized again, ids stay the same
+	changed = HeadingVocab(data_cleaning.normalize_heading, dict(rules, extra=1), path)
+	assert changed.encode(['Mystery fiction.', 'Women — Fiction']) == ids
+	assert changed.misses == 2
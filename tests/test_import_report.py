@@ -0,0 +1,33 @@
+from import_report import parse_importtime, module_breakdown
+
+
+# book_recommender nested at depth 2 behind threads started during its import
+skewed = """import time: self [us] | cumulative | imported package
+import time:       900 |       1200 | site
+import time:       300 |        300 | encodings
+import time:      1000 |       1000 |     flask.json
+import time:     90000 |      91000 |   flask
+import time:        50 |         50 |     pandas.core
+import time:    200000 |     200050 |   pandas
+import time:     59000 |     351050 | book_recommender
+"""
+
+nested = skewed.replace("| book_recommender", "|     book_recommender").replace("|   flask", "|       flask").replace(
+	"|   pandas", "|       pandas").replace("|     pandas.core", "|         pandas.core").replace(
+	"|     flask.json", "|         flask.json")
+
+def test_top_level_module():
+	target, children = module_breakdown(parse_importtime(skewed), 'book_recommender')
+	assert target[3] == 351050
+	assert sorted(name for name, *_ in children) == ['flask', 'pandas']
+
+def test_module_nested_by_threads():
+	rows = parse_importtime(nested)
+	target, children = module_breakdown(rows, 'book_recommender')
+	assert target[1] == 2 and target[3] == 351050
+	assert sorted(name for name, *_ in children) == ['flask', 'pandas']
+
+def test_failed_import_falls_back_to_top_level():
+	target, children = module_breakdown(parse_importtime(skewed), 'missing_module')
+	assert target is None
+	assert [name for name, *_ in children] == ['site', 'encodings', 'book_recommender']
@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('sqlalchemy')
+
+import incremental_refresh
+
+
+def catalog_of(ids):
+	return pd.DataFrame({'title': ['t'] * len(ids), 'authors': [['a']] * len(ids)},
+		index=pd.Index(ids, name='id_num'))
+
+
+@pytest.fixture
+def db(monkeypatch):
+	# stand-ins for everything refresh reads from or writes to postgres
+	calls = {'removed': [], 'upserted': []}
+	monkeypatch.setattr(incremental_refresh, 'get_engine', lambda: None)
+	monkeypatch.setattr(incremental_refresh, 'get_book_ids', lambda engine: pd.DataFrame({'id_num': ['a', 'b', 'c']}))
+	monkeypatch.setattr(incremental_refresh, 'stored_hashes', lambda: {})
+	monkeypatch.setattr(incremental_refresh, 'fetch_changed', lambda fetcher, ids, old: ([], [], {}, []))
+	monkeypatch.setattr(incremental_refresh, 'prepare_book_ids', lambda: None)
+	monkeypatch.setattr(incremental_refresh, 'upsert_book_ids', lambda rows: calls['upserted'].extend(rows))
+	monkeypatch.setattr(incremental_refresh, 'remove_records', lambda ids: calls['removed'].extend(ids))
+	return calls
+
+def use_catalog(monkeypatch, catalog, failed_pages):
+	monkeypatch.setattr(incremental_refresh, 'scrape_catalog', lambda start, end, fetcher: (catalog, failed_pages))
+
+
+def test_failed_page_does_not_remove_records(db, monkeypatch):
+	use_catalog(monkeypatch, catalog_of(['a']), [17])
+	summary = incremental_refresh.refresh(None, apply_removals=True)
+	assert summary['missing'] == 2
+	assert summary['removed'] == 0
+	assert db['removed'] == []
+
+def test_removals_need_apply_removals(db, monkeypatch):
+	use_catalog(monkeypatch, catalog_of(['a']), [])
+	summary = incremental_refresh.refresh(None)
+	assert summary['removed'] == 0
+	assert db['removed'] == []
+
+def test_partial_crawl_does_not_remove_records(db, monkeypatch):
+	use_catalog(monkeypatch, catalog_of(['a']), [])
+	incremental_refresh.refresh(None, catalog_end=10, apply_removals=True)
+	assert db['removed'] == []
+
+def test_complete_crawl_removes_missing_records(db, monkeypatch):
+	use_catalog(monkeypatch, catalog_of(['a', 'd']), [])
+	summary = incremental_refresh.refresh(None, apply_removals=True)
+	assert sorted(db['removed']) == ['b', 'c']
+	assert [row['id_num'] for row in db['upserted']] == ['d']
+	assert summary['added'] == 1
+
+def test_empty_catalog_aborts(db, monkeypatch):
+	use_catalog(monkeypatch, catalog_of([]), list(range(1, 5608)))
+	summary = incremental_refresh.refresh(None, apply_removals=True)
+	assert summary['aborted']
+	assert db['removed'] == [] and db['upserted'] == []
@@ -0,0 +1,44 @@
+import pytest
+import numpy as np
+
+from neighbor_artifact import write_artifact, NeighborArtifact
+
+
+def test_row_of(tmp_path):
+	path = str(tmp_path / 'neighbors.bin')
+	ids = ['S30C0000002', 'S30C0000001', 'S30C0000003']
+	neighbors = np.array([[0, 1], [1, 2], [2, 0]])
+	distances = np.array([[0.0, 0.5], [0.0, 0.25], [0.0, 0.75]])
+	write_artifact(path, ids, neighbors, distances)
+	artifact = NeighborArtifact(path)
+	assert artifact.row_of('S30C0000001') is not None
+	assert artifact.row_of('S30C0000009') is None
+	assert artifact.row_of('S30C000000Ω') is None
+	assert artifact.row_of('S30C00000001234') is None
+
+def test_round_trip(tmp_path):
+	path = str(tmp_path / 'neighbors.bin')
+	# ids out of order, so the rows get renumbered on the way in
+	ids = ['S30C0000003', 'S30C0000001', 'S30C0000002', 'S30C0000010']
+	neighbors = np.array([[0, 2, 1], [1, 3, 0], [2, 0, 3], [3, 1, 2]])
+	distances = np.array([[0.0, 0.5, 0.75], [0.0, 0.125, 0.25], [0.0, 0.375, 0.625], [0.0, 0.875, 1.0]], dtype=np.float32)
+	build_version = write_artifact(path, ids, neighbors, distances, build_version=7)
+	artifact = NeighborArtifact(path)
+	assert build_version == artifact.build_version == 7
+	assert (artifact.n, artifact.k) == (4, 3)
+	for row, book_id in enumerate(ids):
+		expected = [(ids[neighbors[row, rank]], float(distances[row, rank])) for rank in range(1, 3)]
+		assert artifact.lookup(book_id) == expected
+		assert artifact.lookup(book_id, num_neighbors=1) == expected[:1]
+	assert artifact.lookup('S30C0000009') is None
+
+def test_truncated_file(tmp_path):
+	path = str(tmp_path / 'neighbors.bin')
+	write_artifact(path, ['S30C0000001', 'S30C0000002'], np.array([[0, 1], [1, 0]]), np.array([[0.0, 0.5], [0.0, 0.5]]))
+	with open(path, 'rb') as f:
+		data = f.read()
+	for size in (len(data) - 4, 16):
+		with open(path, 'wb') as f:
+			f.write(data[:size])
+		with pytest.raises(ValueError):
+			NeighborArtifact(path)
@@ -0,0 +1,23 @@
+import sys
+import pytest
+
+pytest.importorskip('bs4')
+
+import page_json
+
+
+good = b'<html><script type="application/json" data-iso-key="_0">{"a": 1}</script></html>'
+
+def test_extract():
+	assert page_json.extract_iso_json(good) == {'a': 1}
+	with pytest.raises(ValueError):
+		page_json.extract_iso_json(b'<html>no payload</html>')
+
+def test_benchmark_skips_pages_without_payload(tmp_path, monkeypatch, capsys):
+	(tmp_path / 'a.html').write_bytes(good)
+	(tmp_path / 'b.html').write_bytes(b'<html>no payload</html>')
+	monkeypatch.setattr(sys, 'argv', ['page_json.py', str(tmp_path), '--repeat', '1'])
+	page_json.main()
+	first_line = capsys.readouterr().out.splitlines()[0]
+	assert first_line.startswith('1 pages')
+	assert '1 without a payload skipped' in first_line
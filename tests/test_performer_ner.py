@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import performer_ner
+from performer_ner import rule_performers, loose_performers, PerformerParser
+
+
+@pytest.mark.parametrize('perf, names', [
+	("Read by Scott Brick.", ['Scott Brick']),
+	("Narrated by Kate Reading and Michael Kramer", ['Kate Reading', 'Michael Kramer']),
+	("Read by John Lee, Simon Vance, and Anna Fields.", ['John Lee', 'Simon Vance', 'Anna Fields']),
+	("Read by J. R. R. Tolkien.", ['J. R. R. Tolkien']),
+	("Read by J.D. Jackson", ['J.D. Jackson']),
+	("Read by Barbara Rosenblat. Unabridged.", ['Barbara Rosenblat']),
+	("Read by Ludwig van Beethoven", ['Ludwig van Beethoven']),
+	])
+def test_rules_take_plain_names(perf, names):
+	assert rule_performers(perf) == names
+
+@pytest.mark.parametrize('perf', [
+	"Read by Scott Brick, Recorded Books",
+	"Read by Mary McDonnell Dennis Boutsikaris",
+	"Read by Jim Dale (as Harry Potter)",
+	"Kenneth Branagh as Hamlet, Derek Jacobi",
+	"Performed by a full cast.",
+	"Narrated by the author.",
+	"Unabridged.",
+	])
+def test_rules_leave_the_rest_to_ner(perf):
+	assert rule_performers(perf) is None
+
+@pytest.mark.parametrize('perf, names', [
+	("Read by Jim Dale (as Harry Potter)", ['Jim Dale']),
+	("Kenneth Branagh as Hamlet, Derek Jacobi", ['Kenneth Branagh', 'Derek Jacobi']),
+	("Read by Scott Brick, Recorded Books", ['Scott Brick']),
+	("Performed by a full cast.", []),
+	])
+def test_loose_rules(perf, names):
+	assert loose_performers(perf) == names
+
+def test_parser_without_spacy(monkeypatch):
+	monkeypatch.setattr(performer_ner, 'spacy', None)
+	parser = PerformerParser()
+	col = pd.Series([["Read by Scott Brick."], np.nan, ["Read by Scott Brick.", "Kenneth Branagh as Hamlet"], []])
+	parsed = parser.parse_column(col)
+	assert parsed[0] == ['Scott Brick']
+	assert np.isnan(parsed[1])
+	assert parsed[2] == ['Kenneth Branagh', 'Scott Brick']
+	assert parsed[3] == []
+	assert parser.counts['rules'] == 1 and parser.counts['loose'] == 1
+	assert parser.parse_cell(["Read by Scott Brick."]) == ['Scott Brick']
+	assert parser.counts['cached'] == 1
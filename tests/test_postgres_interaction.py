@@ -0,0 +1,40 @@
+import pytest
+
+pytest.importorskip('sqlalchemy')
+
+from postgres_interaction import encode_cursor, decode_cursor, BadCursor
+
+
+def test_cursor_round_trip():
+	assert decode_cursor(encode_cursor(0.25, 'S30C1234567')) == (0.25, 'S30C1234567')
+	assert decode_cursor(encode_cursor(None, 'S30C1234567')) == (None, 'S30C1234567')
+
+@pytest.mark.parametrize('cursor', ['not base64!', 'eyJh', encode_cursor(1, 2), 'WzEsMiwzXQ==', 'bnVsbA=='])
+def test_malformed_cursor(cursor):
+	with pytest.raises(BadCursor):
+		decode_cursor(cursor)
+
+def test_has_table_caches_misses_briefly(monkeypatch):
+	import sqlalchemy
+	import postgres_interaction
+	probes = []
+	created = []
+
+	def get_table(name):
+		probes.append(name)
+		if not created:
+			raise sqlalchemy.exc.InvalidRequestError('no such table')
+		return object()
+	monkeypatch.setattr(postgres_interaction, 'get_table', get_table)
+	monkeypatch.setattr(postgres_interaction, '_missing_tables', dict())
+	clock = [1000.0]
+	monkeypatch.setattr(postgres_interaction.time, 'monotonic', lambda: clock[0])
+
+	assert not postgres_interaction.has_table('neighbor_ranks')
+	assert not postgres_interaction.has_table('neighbor_ranks')
+	assert len(probes) == 1
+	# created by another process: seen once the miss expires
+	created.append('neighbor_ranks')
+	clock[0] += postgres_interaction.missing_table_ttl + 1
+	assert postgres_interaction.has_table('neighbor_ranks')
+	assert len(probes) == 2
@@ -0,0 +1,44 @@
+import os
+import uuid
+import pytest
+
+sqlalchemy = pytest.importorskip('sqlalchemy')
+
+import postgres_interaction
+import scrape_queue
+
+# these run against a real postgres (FOR UPDATE SKIP LOCKED, leases on now()), e.g.
+# TEST_DATABASE_URL=postgresql://localhost/test pytest tests
+database_url = os.environ.get('TEST_DATABASE_URL')
+pytestmark = pytest.mark.skipif(not database_url, reason='TEST_DATABASE_URL not set')
+
+
+@pytest.fixture
+def job(monkeypatch):
+	monkeypatch.setattr(postgres_interaction, '_engine', sqlalchemy.create_engine(database_url))
+	name = 'test-{}'.format(uuid.uuid4().hex)
+	yield name
+	with postgres_interaction.get_engine().begin() as conn:
+		conn.execute(sqlalchemy.text("DELETE FROM scrape_jobs WHERE job = :job"), {'job': name})
+
+
+def test_expired_lease_on_last_attempt_is_failed(job):
+	scrape_queue.enqueue(job, ['a'])
+	# the first worker claims 'a' on its only attempt and dies: its lease runs out at once
+	dead = scrape_queue.WorkQueue(job, worker='dead', lease_seconds=0, max_attempts=1)
+	assert dead.claim(10) == ['a']
+
+	live = scrape_queue.WorkQueue(job, worker='live', max_attempts=1)
+	assert live.claim(10) == []
+	status = scrape_queue.queue_status(job, max_attempts=1)
+	assert status['failed'] == 1 and status['running'] == 0
+	assert scrape_queue.retry_failed(job, max_attempts=1) == 1
+	assert live.claim(10) == ['a']
+
+def test_expired_lease_with_attempts_left_is_reclaimed(job):
+	scrape_queue.enqueue(job, ['a'])
+	dead = scrape_queue.WorkQueue(job, worker='dead', lease_seconds=0, max_attempts=2)
+	assert dead.claim(10) == ['a']
+	live = scrape_queue.WorkQueue(job, worker='live', max_attempts=2)
+	assert live.claim(10) == ['a']
+	assert live.complete(['a']) == 1
@@ -0,0 +1,19 @@
+from types import SimpleNamespace
+
+from suggest import PrefixIndex, Suggester
+
+
+def row(**values):
+	return SimpleNamespace(_mapping=values)
+
+
+def test_fallback_authors_match_index():
+	books = [('S30C0000001', 'Dune', 'Herbert, Frank', None)]
+	index = PrefixIndex(books)
+	fallback_rows = [row(kind='author', text='Herbert, Frank', id='S30C0000001'),
+		row(kind='author', text='Herbert,Frank', id='S30C0000002')]
+	suggester = Suggester(lambda: books, lambda: None, lambda prefix, limit: fallback_rows)
+	# no index yet, so this goes to the fallback
+	suggester._last_check = float('inf')
+	assert suggester.suggest('herb') == [{'kind': 'author', 'text': 'Frank Herbert', 'id': 'S30C0000001'}]
+	assert index.lookup('herb') == suggester.suggest('herb')